@@ -0,0 +1,64 @@
+from __future__ import print_function
+
+from sys import intern
+
+
+class Checkout(object):
+    """
+    A single checkout of a depot file.
+
+    Large servers hold hundreds of thousands of these at once, so the record
+    uses __slots__ rather than a dict, and interns its user, client and
+    filetype, which repeat across most checkouts. Records are only turned
+    into dicts when the state is written.
+    """
+
+    __slots__ = ('type', 'client', 'user', 'timestamp')
+
+    def __init__(self, file_type, client, user, timestamp):
+        self.type = intern(file_type)
+        self.client = intern(client)
+        self.user = intern(user)
+        self.timestamp = timestamp
+
+    def __eq__(self, other):
+        if not isinstance(other, Checkout):
+            return NotImplemented
+        return (
+            self.type == other.type and self.client == other.client
+            and self.user == other.user and self.timestamp == other.timestamp
+        )
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Checkout({!r}, {!r}, {!r}, {!r})'.format(self.type, self.client, self.user, self.timestamp)
+
+    def to_dict(self):
+        return {
+            'type': self.type,
+            'client': self.client,
+            'user': self.user,
+            'timestamp': self.timestamp,
+        }
+
+    @classmethod
+    def from_dict(cls, checkout_data):
+        return cls(
+            checkout_data['type'],
+            checkout_data['client'],
+            checkout_data['user'],
+            checkout_data['timestamp']
+        )
+
+
+def checkouts_from_data(data):
+    """Converts state data of checkout dicts keyed by depot path to Checkouts."""
+    return {
+        depot_path: [Checkout.from_dict(checkout_data) for checkout_data in checkouts]
+        for depot_path, checkouts in data.items()
+    }
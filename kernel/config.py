@@ -0,0 +1,335 @@
+from __future__ import print_function
+
+import os
+import re
+
+DEFAULT_LOG_PATH = "../log.txt"
+DEFAULT_DATA_PATH = "../data.json"
+
+# Server settings holding file or directory paths, which are resolved from
+# the script directory when they are relative.
+PATH_SETTINGS = (
+    'log_filepath',
+    'data_filepath',
+    'state_filepath',
+    'metrics_filepath',
+    'group_cache_filepath',
+    'journal_filepath',
+    'journal_state_filepath',
+    'contention_feed_filepath',
+    'notify_spool_dirpath',
+)
+
+
+def expect(types, description):
+    """Returns a check that the value is one of types, booleans aside."""
+    def check(value):
+        if isinstance(value, bool) and bool not in types:
+            return description
+        if not isinstance(value, types):
+            return description
+        return None
+    return check
+
+
+def number(minimum=0, integer=False):
+    """Returns a check for a number of at least minimum."""
+    description = '{} of at least {}'.format('a whole number' if integer else 'a number', minimum)
+    is_number = expect((int,) if integer else (int, float), description)
+
+    def check(value):
+        return is_number(value) or (description if value < minimum else None)
+    return check
+
+
+def choice(*options):
+    """Returns a check that the value is one of options."""
+    def check(value):
+        if value not in options:
+            return 'one of {}'.format(', '.join(options))
+        return None
+    return check
+
+
+def regex(value):
+    if not isinstance(value, str):
+        return 'a regex string'
+    try:
+        re.compile(value)
+    except re.error as error:
+        return 'a valid regex ({})'.format(error)
+    return None
+
+
+def time_limit(value):
+    description = 'a Day:Hour:Minute:Second time limit such as 01:00:00:00'
+    if not isinstance(value, str):
+        return description
+    parts = value.split(':')
+    if len(parts) != 4 or not all(part.isdigit() for part in parts):
+        return description
+    return None
+
+
+def string_list(value):
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        return 'a list of strings'
+    return None
+
+
+def shard_list(value):
+    description = 'a list of depot paths, or lists of depot paths'
+    if not isinstance(value, list) or not value:
+        return description
+    for shard in value:
+        if not isinstance(shard, str) and string_list(shard):
+            return description
+    return None
+
+
+text = expect((str,), 'a string')
+flag = expect((bool,), 'true or false')
+mapping = expect((dict,), 'an object')
+
+SERVER_SETTINGS = {
+    'server': mapping,
+    'file_lock_time_limit': time_limit,
+    'log_filepath': text,
+    'data_filepath': text,
+    'ignored_usernames': string_list,
+    'ignored_groupnames': string_list,
+    'group_cache_filepath': text,
+    'group_cache_ttl': number(),
+    'time_limit_policies': expect((list,), 'a list of policy rules'),
+    'filetype_filter': regex,
+    'user_filter': regex,
+    'client_filter': regex,
+    'path_filters': string_list,
+    'opened_paths': string_list,
+    'shards': shard_list,
+    'shard_workers': number(1, integer=True),
+    'opened_exclusive_only': flag,
+    'stream_opened': flag,
+    'revert_chunk_size': number(1, integer=True),
+    'max_reverts_per_run': number(0, integer=True),
+    'revert_ops_per_second': number(),
+    'revert_time_budget': number(),
+    'contention_feed_filepath': text,
+    'contention_window': number(),
+    'contention_only': flag,
+    'rpc_retries': number(0, integer=True),
+    'rpc_backoff': number(),
+    'rpc_max_backoff': number(),
+    'rpc_timeout': number(),
+    'journal_filepath': text,
+    'journal_state_filepath': text,
+    'journal_reconcile_interval': number(),
+    'journal_columns': mapping,
+    'state_backend': choice('json', 'sqlite'),
+    'state_filepath': text,
+    'compaction_interval': number(),
+    'history_days': number(0, integer=True),
+    'metrics_filepath': text,
+    'metrics_format': choice('json', 'prometheus'),
+    'log_format': choice('text', 'json'),
+    'log_max_bytes': number(1, integer=True),
+    'log_rotate_interval': number(),
+    'log_backup_count': number(0, integer=True),
+    'notify_method': choice('smtp', 'webhook', 'spool'),
+    'notify_window': number(),
+    'notify_interval': number(),
+    'notify_max_files': number(1, integer=True),
+    'notify_smtp': mapping,
+    'notify_webhook_url': text,
+    'notify_spool_dirpath': text,
+}
+
+# Server settings that must not point at the same file for two servers, as
+# each server reads back its own data from them and rewrites them.
+UNSHARED_PATH_SETTINGS = (
+    'log_filepath',
+    'data_filepath',
+    'state_filepath',
+    'metrics_filepath',
+    'journal_state_filepath',
+    'group_cache_filepath',
+)
+
+TOP_LEVEL_SETTINGS = {
+    'servers': mapping,
+    'max_workers': number(1, integer=True),
+    'daemon_interval': number(),
+}
+
+
+def check_settings(prefix, values, settings, errors):
+    """Checks each value against its setting, flagging unknown settings."""
+    for key in sorted(values):
+        check = settings.get(key)
+        if check is None:
+            errors.append('{}{}: unknown setting'.format(prefix, key))
+            continue
+        problem = check(values[key])
+        if problem:
+            errors.append('{}{}: expected {}, got {!r}'.format(prefix, key, problem, values[key]))
+
+
+def validate_policies(prefix, rules, errors):
+    for position, rule in enumerate(rules):
+        rule_prefix = '{}time_limit_policies[{}]'.format(prefix, position)
+        if not isinstance(rule, dict):
+            errors.append('{}: expected an object, got {!r}'.format(rule_prefix, rule))
+            continue
+        check_settings(
+            rule_prefix + '.',
+            rule,
+            {
+                'path': text,
+                'time_limit': time_limit,
+                'exempt': flag,
+                'filetype': regex,
+                'group': text,
+                'name': text,
+            },
+            errors
+        )
+        if not rule.get('exempt') and 'time_limit' not in rule:
+            errors.append('{}: needs a time_limit or "exempt": true'.format(rule_prefix))
+
+
+def validate_server(server_name, values):
+    """Lists the problems with a single server block."""
+    prefix = 'servers.{}.'.format(server_name)
+    if not isinstance(values, dict):
+        return ['servers.{}: expected an object, got {!r}'.format(server_name, values)]
+
+    errors = []
+    check_settings(prefix, values, SERVER_SETTINGS, errors)
+
+    connection = values.get('server')
+    if not isinstance(connection, dict):
+        if connection is None:
+            errors.append(prefix + 'server: missing connection settings')
+    else:
+        for key in ('port', 'user'):
+            if not connection.get(key):
+                errors.append('{}server.{}: missing'.format(prefix, key))
+        check_settings(
+            prefix + 'server.',
+            connection,
+            {
+                'port': text,
+                'user': text,
+                'password': expect((str, type(None)), 'a string or null'),
+                'charset': text,
+            },
+            errors
+        )
+
+    if isinstance(values.get('time_limit_policies'), list):
+        validate_policies(prefix, values['time_limit_policies'], errors)
+
+    columns = values.get('journal_columns')
+    if isinstance(columns, dict):
+        check_settings(
+            prefix + 'journal_columns.',
+            columns,
+            dict((column, number(0, integer=True)) for column in ('depotFile', 'client', 'user', 'type')),
+            errors
+        )
+
+    if values.get('shards') and values.get('opened_paths'):
+        errors.append(prefix + 'shards: replaces opened_paths, set one or the other')
+
+    method = values.get('notify_method')
+    if method == 'webhook' and not values.get('notify_webhook_url'):
+        errors.append(prefix + 'notify_webhook_url: needed by the webhook notify_method')
+    if method == 'spool' and not values.get('notify_spool_dirpath'):
+        errors.append(prefix + 'notify_spool_dirpath: needed by the spool notify_method')
+    if method == 'smtp' and isinstance(values.get('notify_smtp'), dict):
+        check_settings(
+            prefix + 'notify_smtp.',
+            values['notify_smtp'],
+            {
+                'host': text,
+                'port': number(1, integer=True),
+                'sender': text,
+                'username': text,
+                'password': text,
+                'starttls': flag,
+            },
+            errors
+        )
+    return errors
+
+
+def validate_shared_paths(servers, errors):
+    """Flags the per-server files that two servers are configured to share."""
+    owners = {}
+    for server_name in sorted(servers):
+        values = servers[server_name]
+        if not isinstance(values, dict):
+            continue
+        for key in UNSHARED_PATH_SETTINGS:
+            if not isinstance(values.get(key), str):
+                continue
+            path = os.path.normpath(values[key])
+            if path in owners:
+                errors.append('servers.{}.{}: {} is already used by servers.{}'.format(
+                    server_name, key, values[key], owners[path]
+                ))
+            else:
+                owners[path] = server_name
+
+
+def validate_config(config):
+    """
+    Checks a loaded config without connecting to anything, returning a list
+    of readable problems that is empty when the config is valid.
+    """
+    if not isinstance(config, dict):
+        return ['expected the config to be an object, got {!r}'.format(config)]
+
+    errors = []
+    check_settings('', config, TOP_LEVEL_SETTINGS, errors)
+    servers = config.get('servers')
+    if not servers:
+        errors.append('servers: no servers are configured')
+    elif isinstance(servers, dict):
+        for server_name in sorted(servers):
+            errors.extend(validate_server(server_name, servers[server_name]))
+        validate_shared_paths(servers, errors)
+    return errors
+
+
+def resolve_path(path, base_dir):
+    """Resolves a relative path from base_dir, leaving absolute paths alone."""
+    if not path:
+        return path
+    return os.path.join(base_dir, path)
+
+
+def server_default_path(path, server_name):
+    """Adds the server name to a default path, as in ../data_commit.json."""
+    root, extension = os.path.splitext(path)
+    return '{}_{}{}'.format(root, server_name, extension)
+
+
+def resolve_server_paths(values, base_dir, server_name=None):
+    """
+    Returns a copy of a server block with its paths, including the default
+    log and data paths, resolved from base_dir. When a server_name is given,
+    as it is when several servers are configured, the default paths are
+    named after the server so each keeps its own log and data file.
+    """
+    resolved = dict(values)
+    log_path, data_path = DEFAULT_LOG_PATH, DEFAULT_DATA_PATH
+    if server_name:
+        log_path = server_default_path(log_path, server_name)
+        data_path = server_default_path(data_path, server_name)
+    resolved.setdefault('log_filepath', log_path)
+    resolved.setdefault('data_filepath', data_path)
+    for key in PATH_SETTINGS:
+        if key in resolved:
+            resolved[key] = resolve_path(resolved[key], base_dir)
+    return resolved
@@ -0,0 +1,171 @@
+from __future__ import print_function
+
+import threading
+import time
+from contextlib import contextmanager
+
+from p4_timecop.kernel import utils
+
+# Fragments of P4 error messages that indicate a problem with the link or
+# the login rather than with the command itself.
+TRANSIENT_ERRORS = (
+    'TCP receive failed',
+    'TCP send failed',
+    'TCP connect',
+    'Connect to server failed',
+    'Partner exited unexpectedly',
+    'Your session has expired',
+    'Perforce password (P4PASSWD) invalid or unset',
+    'Command terminated',
+    'timed out',
+)
+
+
+def is_transient_error(error, connection=None):
+    """Decides whether a failed command is worth retrying on a fresh connection."""
+    if connection is not None:
+        try:
+            if not connection.connected():
+                return True
+        except utils.P4Exception:
+            return True
+    message = str(error)
+    return any(fragment.lower() in message.lower() for fragment in TRANSIENT_ERRORS)
+
+
+class CommandTimeout(object):
+    """
+    A P4 keep alive that cancels the running command once its deadline
+    has passed.
+    """
+
+    def __init__(self):
+        self.deadline = None
+
+    def isAlive(self):
+        return self.deadline is None or time.time() < self.deadline
+
+
+class RetryingConnection(object):
+    """
+    Wraps a P4 connection so commands that fail with a transient error are
+    retried on a fresh, logged in connection after an exponential backoff.
+    Commands can also be given a timeout, after which they are cancelled.
+    Anything other than run is passed through to the current connection.
+    """
+
+    def __init__(self, connection, connect, retries=3, backoff=1.0, max_backoff=30.0, timeout=None):
+        self.connect = connect
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.retry_count = 0
+        self.keep_alive = CommandTimeout()
+        self.connection = None
+        self.use_connection(connection)
+
+    def use_connection(self, connection):
+        self.connection = connection
+        if self.timeout and connection is not None:
+            connection.setbreak(self.keep_alive)
+
+    def raise_transient_errors(self):
+        """
+        Raises the errors of a command run with exception_level 0, which
+        leaves them on the connection, when they look transient.
+        """
+        errors = list(getattr(self.connection, 'errors', None) or [])
+        if errors and is_transient_error('\n'.join(errors), self.connection):
+            raise utils.P4Exception('\n'.join(errors))
+
+    def reconnect(self):
+        try:
+            if self.connection is not None and self.connection.connected():
+                self.connection.disconnect()
+        except utils.P4Exception:
+            pass
+        self.use_connection(self.connect())
+
+    def run(self, *args, **kwargs):
+        attempt = 0
+        while True:
+            if self.timeout:
+                self.keep_alive.deadline = time.time() + self.timeout
+            try:
+                result = self.connection.run(*args, **kwargs)
+                if kwargs.get('exception_level') == 0:
+                    self.raise_transient_errors()
+                return result
+            except utils.P4Exception as error:
+                if attempt >= self.retries or not is_transient_error(error, self.connection):
+                    raise
+                delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+                print('p4 {} failed ({}), retrying in {}s'.format(args[0], error, delay))
+                time.sleep(delay)
+                attempt += 1
+                self.retry_count += 1
+                try:
+                    self.reconnect()
+                except utils.P4Exception as connect_error:
+                    print('reconnect failed: {}'.format(connect_error))
+            finally:
+                self.keep_alive.deadline = None
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class ConnectionPool(object):
+    """
+    Hands out up to size retrying connections to concurrent workers,
+    creating them on first use and reusing them afterwards.
+    """
+
+    def __init__(self, connect, size=2, **retry_options):
+        self.connect = connect
+        self.size = size
+        self.retry_options = retry_options
+        self.idle = []
+        self.connections = []
+        self.reserved = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def connection(self):
+        with self.condition:
+            while not self.idle and self.reserved >= self.size:
+                self.condition.wait()
+            connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                self.reserved += 1
+
+        if connection is None:
+            try:
+                connection = RetryingConnection(self.connect(), self.connect, **self.retry_options)
+            except Exception:
+                with self.condition:
+                    self.reserved -= 1
+                    self.condition.notify()
+                raise
+            with self.condition:
+                self.connections.append(connection)
+
+        try:
+            yield connection
+        finally:
+            with self.condition:
+                self.idle.append(connection)
+                self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            for connection in self.connections:
+                try:
+                    if connection.connected():
+                        connection.disconnect()
+                except utils.P4Exception:
+                    pass
+            self.idle = []
+            self.connections = []
+            self.reserved = 0
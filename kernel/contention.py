@@ -0,0 +1,60 @@
+from __future__ import print_function
+
+import json
+import os
+
+
+def read_contention_feed(feed_path, since=None):
+    """
+    Streams (depot path, user, time) entries from a json lines feed of
+    blocked opens, such as lock failures or queued opens written by a
+    trigger. Entries older than since, in epoch seconds, and lines that
+    can't be read are skipped.
+    """
+    if not feed_path or not os.path.exists(feed_path):
+        return
+
+    with open(feed_path) as feed_file:
+        for line in feed_file:
+            try:
+                entry = json.loads(line)
+                depot_path = entry['depotFile']
+            except (ValueError, KeyError, TypeError):
+                continue
+
+            blocked_time = entry.get('time')
+            if since is not None and blocked_time is not None and blocked_time < since:
+                continue
+            yield depot_path, entry.get('user'), blocked_time
+
+
+def build_contention_index(feed_path, since=None):
+    """
+    Builds a reverse index of depot path to the set of users that have been
+    blocked from opening it, so checking a checkout is a single lookup.
+    """
+    contention = {}
+    for depot_path, user, _ in read_contention_feed(feed_path, since):
+        contention.setdefault(depot_path, set()).add(user)
+    return contention
+
+
+def blocked_users(contention, file_path, holder):
+    """Returns the users other than the lock holder waiting on file_path."""
+    return contention.get(file_path, set()) - {holder}
+
+
+def split_contended(to_be_unlocked, contention):
+    """
+    Splits the expired checkouts into those another user is blocked on and
+    those nobody is waiting for, both keyed by depot path.
+    """
+    contended = {}
+    uncontended = {}
+    for file_path in to_be_unlocked:
+        for checkout in to_be_unlocked[file_path]:
+            if file_path in contention and blocked_users(contention, file_path, checkout.user):
+                contended.setdefault(file_path, []).append(checkout)
+            else:
+                uncontended.setdefault(file_path, []).append(checkout)
+    return contended, uncontended
@@ -0,0 +1,71 @@
+from __future__ import print_function
+
+import re
+
+
+class CachedMatcher(object):
+    """
+    A compiled regex whose result is memoized per distinct value, since
+    values such as filetypes, users and clients repeat across many checkouts.
+    """
+
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern)
+        self.results = {}
+
+    def __call__(self, value):
+        result = self.results.get(value)
+        if result is None:
+            result = self.results[value] = bool(self.regex.search(value))
+        return result
+
+
+def translate_depot_pattern(pattern):
+    """
+    Converts a depot path pattern using p4 wildcards into a regex, where
+    `...` matches across directories and `*` matches within one.
+    """
+    parts = []
+    for index, chunk in enumerate(pattern.split('...')):
+        if index:
+            parts.append('.*')
+        parts.append('[^/]*'.join(re.escape(piece) for piece in chunk.split('*')))
+    return ''.join(parts)
+
+
+class CheckoutFilter(object):
+    """
+    Decides which checkouts are eligible for unlocking. A checkout has to
+    match every configured filter; an unset filter matches everything.
+    """
+
+    def __init__(self, filetype_filter=None, user_filter=None, client_filter=None, path_filters=None):
+        self.field_matchers = []
+        for field, pattern in (('type', filetype_filter), ('user', user_filter), ('client', client_filter)):
+            if pattern:
+                self.field_matchers.append((field, CachedMatcher(pattern)))
+
+        self.path_regex = None
+        if path_filters:
+            self.path_regex = re.compile(
+                '|'.join('(?:{})$'.format(translate_depot_pattern(pattern)) for pattern in path_filters)
+            )
+
+    def matches_path(self, file_path):
+        return self.path_regex is None or bool(self.path_regex.match(file_path))
+
+    def matches(self, checkout):
+        for field, matcher in self.field_matchers:
+            if not matcher(getattr(checkout, field)):
+                return False
+        return True
+
+
+def build_checkout_filter(config):
+    """Creates the CheckoutFilter described by a server's config values."""
+    return CheckoutFilter(
+        filetype_filter=config.get('filetype_filter'),
+        user_filter=config.get('user_filter'),
+        client_filter=config.get('client_filter'),
+        path_filters=config.get('path_filters'),
+    )
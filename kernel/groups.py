@@ -0,0 +1,88 @@
+from __future__ import print_function
+
+import time
+
+from p4_timecop.kernel.utils import (
+    read_json,
+    write_json
+)
+
+
+def fetch_group_memberships(server):
+    """
+    Reads every group's direct users and subgroups with a single
+    `p4 groups` sweep.
+    """
+    memberships = {}
+    for record in server.run('groups'):
+        entry = memberships.setdefault(record['group'], {'users': set(), 'subgroups': set()})
+        if record.get('isSubGroup') == '1':
+            entry['subgroups'].add(record['user'])
+        elif record.get('isUser', '1') == '1':
+            entry['users'].add(record['user'])
+    return memberships
+
+
+def resolve_group_users(memberships, group_name):
+    """
+    Collects the users of a group and all of its nested subgroups. Each group
+    is only visited once, so cyclic subgroup definitions are safe.
+    """
+    users = set()
+    visited = set()
+    pending = [group_name]
+
+    while pending:
+        current = pending.pop()
+        if current in visited:
+            continue
+        visited.add(current)
+
+        entry = memberships.get(current)
+        if entry is None:
+            print('group {} does not exist'.format(current))
+            continue
+        users.update(entry['users'])
+        pending.extend(entry['subgroups'] - visited)
+
+    return users
+
+
+def resolve_groups(server, group_names, cache_path=None, cache_ttl=3600):
+    """
+    Returns a dict of each given group's users, including those of nested
+    subgroups.
+
+    When cache_path is set, resolved memberships are kept there and reused
+    until they are older than cache_ttl seconds or a new group is requested.
+    Groups already in the cache are resolved again alongside new ones, so
+    callers asking for different groups don't evict each other's entries.
+    """
+    if not group_names:
+        return {}
+
+    cache = read_json(cache_path) if cache_path else {}
+    cached_groups = cache.get('groups', {})
+    fresh = time.time() - cache.get('fetched', 0) < cache_ttl
+
+    if not (fresh and all(group_name in cached_groups for group_name in group_names)):
+        memberships = fetch_group_memberships(server)
+        cached_groups = {
+            group_name: sorted(resolve_group_users(memberships, group_name))
+            for group_name in set(group_names).union(cached_groups)
+        }
+        if cache_path:
+            write_json({'fetched': time.time(), 'groups': cached_groups}, cache_path)
+
+    return {
+        group_name: set(cached_groups.get(group_name, []))
+        for group_name in group_names
+    }
+
+
+def resolve_ignored_groups(server, group_names, cache_path=None, cache_ttl=3600):
+    """Returns the set of users belonging to any of the given groups."""
+    users = set()
+    for group_users in resolve_groups(server, group_names, cache_path, cache_ttl).values():
+        users.update(group_users)
+    return users
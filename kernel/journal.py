@@ -0,0 +1,170 @@
+from __future__ import print_function
+
+import os
+
+from p4_timecop.kernel.checkout import Checkout
+
+# Column positions of the db.working fields timecop needs, counted from the
+# first field after the table name.
+DEFAULT_JOURNAL_COLUMNS = {
+    'depotFile': 1,
+    'client': 2,
+    'user': 3,
+    'type': 7,
+}
+
+PUT_OPERATIONS = ('pv', 'rv')
+DELETE_OPERATIONS = ('dv',)
+TRANSACTION_MARKERS = ('ex', 'mx')
+
+
+def split_journal_line(line):
+    """
+    Splits a journal line into its fields. Strings are wrapped in @ with
+    any literal @ doubled, every other field is separated by spaces.
+    """
+    fields = []
+    index = 0
+    length = len(line)
+
+    while index < length:
+        char = line[index]
+        if char in ' \r\n':
+            index += 1
+            continue
+
+        if char == '@':
+            start = index + 1
+            value = []
+            while True:
+                end = line.find('@', start)
+                if end == -1:
+                    value.append(line[start:])
+                    index = length
+                    break
+                if line[end + 1:end + 2] == '@':
+                    value.append(line[start:end + 1])
+                    start = end + 2
+                    continue
+                value.append(line[start:end])
+                index = end + 1
+                break
+            fields.append(''.join(value))
+        else:
+            end = line.find(' ', index)
+            if end == -1:
+                end = length
+            fields.append(line[index:end].rstrip('\r\n'))
+            index = end
+
+    return fields
+
+
+def read_journal_transactions(journal_path, offset=0, table='db.working', columns=None):
+    """
+    Reads complete transactions from the journal starting at offset.
+
+    Yields (transaction_time, records, next_offset) for each transaction marker
+    found. Records are (operation, depotFile, client, user, type) tuples. Any
+    trailing records that have not been closed by a marker yet are left for
+    the next read, so next_offset never points into an open transaction.
+    A journal shorter than offset is treated as rotated and read from the start.
+    """
+    columns = columns or DEFAULT_JOURNAL_COLUMNS
+    if not os.path.exists(journal_path):
+        return
+
+    if os.path.getsize(journal_path) < offset:
+        offset = 0
+
+    pending = []
+    position = offset
+    with open(journal_path, 'rb') as journal_file:
+        journal_file.seek(offset)
+        for raw_line in journal_file:
+            if not raw_line.endswith(b'\n'):
+                break
+            position += len(raw_line)
+
+            fields = split_journal_line(raw_line.decode('utf-8', 'replace'))
+            if not fields:
+                continue
+
+            operation = fields[0]
+            if operation in TRANSACTION_MARKERS:
+                transaction_time = int(fields[2])
+                yield transaction_time, pending, position
+                pending = []
+            elif operation in PUT_OPERATIONS + DELETE_OPERATIONS and fields[2] == table:
+                values = fields[3:]
+                pending.append((
+                    operation,
+                    values[columns['depotFile']],
+                    values[columns['client']],
+                    values[columns['user']],
+                    values[columns['type']],
+                ))
+
+
+def load_open_files(existing_data):
+    """
+    Copies the saved checkout lists, so journal records can be applied
+    without touching the data they were loaded from.
+    """
+    return {file_path: list(checkouts) for file_path, checkouts in existing_data.items()}
+
+
+def apply_journal_records(open_files, records, transaction_time):
+    """
+    Applies db.working journal records to open_files in place. New checkouts
+    are stamped with the time of the transaction that opened them.
+    """
+    for operation, depot_path, client, user, file_type in records:
+        checkouts = open_files.get(depot_path, [])
+        existing = [
+            checkout for checkout in checkouts
+            if checkout.client == client and checkout.user == user
+        ]
+
+        if operation in DELETE_OPERATIONS:
+            for checkout in existing:
+                checkouts.remove(checkout)
+            if depot_path in open_files and not checkouts:
+                del open_files[depot_path]
+        elif not existing:
+            open_files.setdefault(depot_path, []).append(
+                Checkout(file_type, client, user, transaction_time)
+            )
+
+
+def journal_types_expired(open_files, expire_before):
+    """
+    Decides whether a checkout still carrying the server's numeric filetype
+    code from the journal has been open since expire_before, as its real
+    filetype is only known once an opened query has been made.
+    """
+    for checkouts in open_files.values():
+        for checkout in checkouts:
+            if checkout.type.isdigit() and checkout.timestamp <= expire_before:
+                return True
+    return False
+
+
+def update_from_journal(open_files, journal_path, offset=0, columns=None):
+    """
+    Brings open_files up to date with every complete transaction in the
+    journal after offset. Returns the offset to resume from next time.
+    """
+    for transaction_time, records, next_offset in read_journal_transactions(
+        journal_path, offset, columns=columns
+    ):
+        apply_journal_records(open_files, records, transaction_time)
+        offset = next_offset
+    return offset
+
+
+def journal_end_offset(journal_path):
+    """Returns the offset just past the journal's current contents."""
+    if not os.path.exists(journal_path):
+        return 0
+    return os.path.getsize(journal_path)
@@ -0,0 +1,92 @@
+from __future__ import print_function
+
+import json
+import os
+from datetime import datetime
+
+from p4_timecop.kernel.utils import write_log
+
+LOG_TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+
+class RunLog(object):
+    """
+    Buffers the log events of a run and appends them to the log file in a
+    single flush, rotating the file first when it has grown past max_bytes or
+    its first entry is older than rotate_interval seconds.
+
+    Events are written as the usual text lines, or as one json object per
+    line when json_lines is set. Every event is stamped with the run's time,
+    now in epoch seconds, which is formatted once up front.
+    """
+
+    def __init__(self, file_path, json_lines=False, max_bytes=None, rotate_interval=None, backup_count=5, now=None):
+        self.file_path = file_path
+        self.json_lines = json_lines
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.lines = []
+
+        run_time = datetime.now() if now is None else datetime.fromtimestamp(now)
+        self.text_time = run_time.strftime(LOG_TIME_FORMAT)
+        self.iso_time = run_time.isoformat()
+
+    def event(self, event, message, **fields):
+        if self.json_lines:
+            record = dict(fields, time=self.iso_time, event=event, message=message)
+            self.lines.append(json.dumps(record, sort_keys=True) + '\n')
+        else:
+            self.lines.append('{time}: {message}\n'.format(time=self.text_time, message=message))
+
+    def first_entry_time(self):
+        with open(self.file_path) as log_file:
+            first_line = log_file.readline()
+        try:
+            if first_line.startswith('{'):
+                return datetime.strptime(json.loads(first_line)['time'][:19], "%Y-%m-%dT%H:%M:%S")
+            return datetime.strptime(first_line[:24], LOG_TIME_FORMAT)
+        except (ValueError, KeyError):
+            return None
+
+    def should_rotate(self):
+        if not os.path.exists(self.file_path):
+            return False
+        if self.max_bytes and os.path.getsize(self.file_path) >= self.max_bytes:
+            return True
+        if self.rotate_interval:
+            first_time = self.first_entry_time()
+            if first_time and (datetime.now() - first_time).total_seconds() >= self.rotate_interval:
+                return True
+        return False
+
+    def rotate(self):
+        """Shifts log.N to log.N+1, dropping anything past backup_count."""
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.file_path, index)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.file_path, index + 1))
+        if self.backup_count:
+            os.replace(self.file_path, self.file_path + '.1')
+        else:
+            os.remove(self.file_path)
+
+    def flush(self):
+        if not self.lines:
+            return
+        if self.should_rotate():
+            self.rotate()
+        write_log(self.lines, self.file_path)
+        self.lines = []
+
+
+def create_run_log(log_path, config, now=None):
+    """Creates the RunLog described by a server's config values."""
+    return RunLog(
+        log_path,
+        json_lines=config.get('log_format', 'text') == 'json',
+        max_bytes=config.get('log_max_bytes'),
+        rotate_interval=config.get('log_rotate_interval'),
+        backup_count=config.get('log_backup_count', 5),
+        now=now,
+    )
@@ -0,0 +1,122 @@
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class RunMetrics(object):
+    """
+    Collects stage timings, record counts and P4 command statistics for a
+    single server's pass. Counts and commands can be recorded from several
+    worker threads at once.
+    """
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.started = time.time()
+        self.stages = {}
+        self.counts = {}
+        self.rpcs = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.time() - start
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def record_rpc(self, command, seconds, failed=False):
+        with self.lock:
+            stats = self.rpcs.setdefault(command, {'calls': 0, 'seconds': 0.0, 'errors': 0})
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            if failed:
+                stats['errors'] += 1
+
+    def to_dict(self):
+        return {
+            'server': self.server_name,
+            'started': self.started,
+            'duration': time.time() - self.started,
+            'stages': self.stages,
+            'counts': self.counts,
+            'rpcs': self.rpcs,
+        }
+
+    def to_prometheus(self):
+        """Formats the metrics for the node exporter textfile collector."""
+        data = self.to_dict()
+        server = self.server_name
+        lines = [
+            '# TYPE timecop_run_duration_seconds gauge',
+            'timecop_run_duration_seconds{{server="{}"}} {:.6f}'.format(server, data['duration']),
+            '# TYPE timecop_last_run_timestamp_seconds gauge',
+            'timecop_last_run_timestamp_seconds{{server="{}"}} {:.0f}'.format(server, data['started']),
+            '# TYPE timecop_stage_duration_seconds gauge',
+        ]
+        for stage, seconds in sorted(self.stages.items()):
+            lines.append('timecop_stage_duration_seconds{{server="{}",stage="{}"}} {:.6f}'.format(server, stage, seconds))
+
+        lines.append('# TYPE timecop_records gauge')
+        for name, value in sorted(self.counts.items()):
+            lines.append('timecop_records{{server="{}",kind="{}"}} {}'.format(server, name, value))
+
+        # Each family's samples follow its TYPE line as one group.
+        for family, stat, value_format in (
+            ('timecop_rpc_calls', 'calls', '{}'),
+            ('timecop_rpc_errors', 'errors', '{}'),
+            ('timecop_rpc_duration_seconds', 'seconds', '{:.6f}'),
+        ):
+            lines.append('# TYPE {} gauge'.format(family))
+            for command, stats in sorted(self.rpcs.items()):
+                lines.append('{}{{server="{}",command="{}"}} {}'.format(
+                    family, server, command, value_format.format(stats[stat])
+                ))
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_path, metrics_format="json"):
+        """
+        Writes the metrics through a temporary file so collectors never read
+        a partially written file.
+        """
+        temp_path = output_path + ".tmp"
+        with open(temp_path, "w") as outfile:
+            if metrics_format == "prometheus":
+                outfile.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), outfile, indent=4, sort_keys=True)
+        os.replace(temp_path, output_path)
+
+
+class InstrumentedConnection(object):
+    """
+    Wraps a P4 connection so every run call is counted and timed in the
+    given RunMetrics. Everything else is passed through to the connection.
+    """
+
+    def __init__(self, connection, metrics):
+        self.connection = connection
+        self.metrics = metrics
+
+    def run(self, *args, **kwargs):
+        start = time.time()
+        try:
+            result = self.connection.run(*args, **kwargs)
+        except Exception:
+            self.metrics.record_rpc(args[0], time.time() - start, failed=True)
+            raise
+        self.metrics.record_rpc(args[0], time.time() - start)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
@@ -0,0 +1,198 @@
+from __future__ import print_function
+
+import json
+import os
+
+from p4_timecop.kernel import utils
+
+
+def format_duration(seconds):
+    """Formats a number of seconds as a rough "1d 4h 20m" style duration."""
+    minutes = max(int(seconds), 0) // 60
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if days:
+        parts.append('{}d'.format(days))
+    if hours:
+        parts.append('{}h'.format(hours))
+    if minutes or not parts:
+        parts.append('{}m'.format(minutes))
+    return ' '.join(parts)
+
+
+def group_by_user(expiring):
+    """
+    Regroups the expiring checkouts, keyed by depot path, into a list of
+    (depot path, checkout, seconds left) entries per user, soonest first.
+    """
+    user_files = {}
+    for file_path in expiring:
+        for checkout, seconds_left in expiring[file_path]:
+            if checkout.user not in user_files:
+                user_files[checkout.user] = []
+            user_files[checkout.user].append((file_path, checkout, seconds_left))
+
+    for entries in user_files.values():
+        entries.sort(key=lambda entry: entry[2])
+    return user_files
+
+
+def build_notice(server_name, user, entries, email=None, max_files=50):
+    """Builds the single batched notice sent to a user for a run."""
+    lines = [
+        'The following files you have locked on {} will be force reverted once their'.format(server_name),
+        'lock time limit is reached. Submit or revert them before then to keep your changes.',
+        '',
+    ]
+    for file_path, checkout, seconds_left in entries[:max_files]:
+        lines.append('  {} ({}) in about {}'.format(file_path, checkout.client, format_duration(seconds_left)))
+    if len(entries) > max_files:
+        lines.append('  ... and {} more'.format(len(entries) - max_files))
+
+    return {
+        'server': server_name,
+        'user': user,
+        'email': email,
+        'subject': '[timecop] {} locked files on {} will be reverted soon'.format(len(entries), server_name),
+        'body': '\n'.join(lines) + '\n',
+        'files': [
+            {'file': file_path, 'client': checkout.client, 'seconds_left': seconds_left}
+            for file_path, checkout, seconds_left in entries
+        ],
+    }
+
+
+class SmtpNotifier(object):
+    """
+    Mails each notice to the user's email address from the p4 user spec.
+    smtplib is only imported once a notice is sent, as with the webhook's
+    urllib, to keep them out of runs that never notify anyone.
+    """
+
+    def __init__(self, host='localhost', port=25, sender='timecop', username=None, password=None, starttls=False):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+
+    def send(self, notice):
+        import smtplib
+        from email.message import EmailMessage
+
+        if not notice['email']:
+            raise ValueError('no email address for {}'.format(notice['user']))
+
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = notice['email']
+        message['Subject'] = notice['subject']
+        message.set_content(notice['body'])
+
+        with smtplib.SMTP(self.host, self.port) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+
+class WebhookNotifier(object):
+    """Posts each notice as json to a webhook url."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, notice):
+        from urllib.request import Request, urlopen
+
+        request = Request(
+            self.url,
+            data=json.dumps(notice).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        urlopen(request, timeout=self.timeout).close()
+
+
+class SpoolNotifier(object):
+    """Writes each notice as a json file into a local spool directory."""
+
+    def __init__(self, spool_path):
+        self.spool_path = spool_path
+
+    def send(self, notice):
+        if not os.path.exists(self.spool_path):
+            os.makedirs(self.spool_path)
+        notice_path = os.path.join(self.spool_path, '{}_{}.json'.format(notice['server'], notice['user']))
+        with open(notice_path, 'w') as notice_file:
+            json.dump(notice, notice_file, indent=4, sort_keys=True)
+
+
+def get_notifier(config):
+    """
+    Returns the notifier named by a server's notify_method, or None when
+    notifications aren't configured.
+    """
+    method = config.get('notify_method')
+    if not method:
+        return None
+    if method == 'smtp':
+        return SmtpNotifier(**config.get('notify_smtp', {}))
+    if method == 'webhook':
+        return WebhookNotifier(config['notify_webhook_url'])
+    if method == 'spool':
+        return SpoolNotifier(config['notify_spool_dirpath'])
+    raise ValueError("Unknown notify method: {}".format(method))
+
+
+def lookup_emails(server, users):
+    """Reads the email addresses of the given users with a single p4 users call."""
+    try:
+        records = server.run('users', *sorted(users))
+    except utils.P4Exception as error:
+        print('failed to look up user emails: {}'.format(error))
+        return {}
+    return {
+        record['User']: record.get('Email')
+        for record in records
+        if isinstance(record, dict) and 'User' in record
+    }
+
+
+def send_notices(server, server_name, expiring, notifier, state, now, interval=86400, max_files=50):
+    """
+    Sends one batched notice per user with checkouts about to expire.
+
+    The time each user was last notified is kept in the state store, and a
+    user notified within the last interval seconds is skipped, so users
+    holding many locks get at most one notice per interval however often
+    timecop runs. A notice that fails to send is retried on the next run.
+
+    Returns the notices that were sent.
+    """
+    user_files = group_by_user(expiring)
+    notified = json.loads(state.get_meta('notified', '{}'))
+    notified = dict(
+        (user, sent_time) for user, sent_time in notified.items()
+        if now - sent_time < interval
+    )
+
+    due = [user for user in sorted(user_files) if user not in notified]
+    emails = lookup_emails(server, due) if due else {}
+
+    sent = []
+    for user in due:
+        notice = build_notice(server_name, user, user_files[user], emails.get(user), max_files)
+        try:
+            notifier.send(notice)
+        except (OSError, ValueError) as error:
+            print('failed to notify {}: {}'.format(user, error))
+            continue
+        notified[user] = now
+        sent.append(notice)
+
+    state.set_meta('notified', json.dumps(notified, sort_keys=True))
+    return sent
@@ -0,0 +1,58 @@
+from __future__ import print_function
+
+import math
+import os
+import time
+
+from p4_timecop.kernel.utils import (
+    read_json,
+    write_json
+)
+
+
+def average_revert_latency(metrics_path):
+    """Reads the average revert command time from a previous run's json metrics."""
+    if not metrics_path or not os.path.exists(metrics_path):
+        return None
+    try:
+        revert_stats = read_json(metrics_path).get('rpcs', {}).get('revert')
+    except ValueError:
+        return None
+    if not revert_stats or not revert_stats.get('calls'):
+        return None
+    return revert_stats['seconds'] / revert_stats['calls']
+
+
+def build_unlock_plan(server_name, to_be_unlocked, time_limit, chunk_size=100, revert_latency=None):
+    """
+    Describes the reverts a run would make, with the number of revert
+    commands perform_reverts would need and, when a per command latency is
+    known, an estimate of how long they would take.
+    """
+    clients = {}
+    for file_path in to_be_unlocked:
+        for checkout in to_be_unlocked[file_path]:
+            client_stats = clients.setdefault(checkout.client, {'checkouts': 0, 'rpcs': 0})
+            client_stats['checkouts'] += 1
+
+    for client_stats in clients.values():
+        client_stats['rpcs'] = int(math.ceil(client_stats['checkouts'] / float(chunk_size)))
+
+    estimated_rpcs = sum(client_stats['rpcs'] for client_stats in clients.values())
+    plan = {
+        'server': server_name,
+        'generated': time.time(),
+        'time_limit': time_limit,
+        'files': len(to_be_unlocked),
+        'checkouts': sum(client_stats['checkouts'] for client_stats in clients.values()),
+        'clients': clients,
+        'estimated_rpcs': estimated_rpcs,
+        'estimated_seconds': estimated_rpcs * revert_latency if revert_latency is not None else None,
+        'reverts': to_be_unlocked,
+    }
+    return plan
+
+
+def write_plan(plan, plan_path):
+    write_json(plan, plan_path)
+    print("{server}: {checkouts} checkouts in {files} files would be reverted with {estimated_rpcs} revert commands.".format(**plan))
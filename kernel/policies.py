@@ -0,0 +1,136 @@
+from __future__ import print_function
+
+from p4_timecop.kernel.utils import calc_limit
+from p4_timecop.kernel.filters import CachedMatcher
+
+
+def split_depot_prefix(path_prefix):
+    """
+    Splits a depot path prefix such as //art/... into the path components
+    it covers, so //art/..., //art/ and //art all cover the same files.
+    """
+    if not path_prefix:
+        return []
+    if path_prefix.endswith('...'):
+        path_prefix = path_prefix[:-3]
+    path_prefix = path_prefix.rstrip('/')
+    return path_prefix.split('/') if path_prefix else []
+
+
+class Policy(object):
+    """
+    A time limit, or an exemption from unlocking, for the checkouts under a
+    depot path prefix, optionally narrowed to a filetype regex and the
+    users of a group.
+    """
+
+    def __init__(self, limit=None, exempt=False, filetype=None, users=None, name=None):
+        self.limit = limit
+        self.exempt = exempt
+        self.filetype_matcher = CachedMatcher(filetype) if filetype else None
+        self.users = users
+        self.name = name
+
+    def specificity(self):
+        return (self.filetype_matcher is not None) + (self.users is not None)
+
+    def matches(self, checkout):
+        if self.users is not None and checkout.user not in self.users:
+            return False
+        if self.filetype_matcher and not self.filetype_matcher(checkout.type):
+            return False
+        return True
+
+
+class PrefixNode(object):
+    __slots__ = ('children', 'policies')
+
+    def __init__(self):
+        self.children = {}
+        self.policies = []
+
+
+class PolicyIndex(object):
+    """
+    Resolves the policy of a checkout through a trie of depot path
+    components, so finding the candidates for a path costs one step per
+    path component however many policies are configured.
+
+    The policy under the longest matching prefix wins. Policies on the same
+    prefix are tried with filetype and group narrowed ones first, then in
+    the order they were added.
+    """
+
+    def __init__(self):
+        self.root = PrefixNode()
+
+    def add(self, path_prefix, policy):
+        node = self.root
+        for component in split_depot_prefix(path_prefix):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = PrefixNode()
+            node = child
+        node.policies.append(policy)
+        node.policies.sort(key=lambda added: -added.specificity())
+
+    def candidates(self, file_path):
+        """Returns the policies covering file_path, most specific prefix first."""
+        nodes = [self.root]
+        for component in file_path.split('/'):
+            node = nodes[-1].children.get(component)
+            if node is None:
+                break
+            nodes.append(node)
+
+        found = []
+        for node in reversed(nodes):
+            found.extend(node.policies)
+        return found
+
+    def limits(self):
+        """Returns the time limit cutoff of every policy that isn't an exemption."""
+        limits = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            limits.extend(policy.limit for policy in node.policies if not policy.exempt)
+            nodes.extend(node.children.values())
+        return limits
+
+    def resolve(self, candidates, checkout):
+        """Picks the policy for a checkout from its path's candidates."""
+        for policy in candidates:
+            if policy.matches(checkout):
+                return policy
+        return None
+
+
+def policy_group_names(rules):
+    """Lists the groups the policy rules refer to."""
+    return sorted(set(rule['group'] for rule in rules if rule.get('group')))
+
+
+def build_policy_index(rules, now=None, group_users=None):
+    """
+    Compiles the time_limit_policies config into a PolicyIndex, converting
+    each rule's time limit to an epoch second cutoff relative to now.
+    group_users maps each group named by a rule to its users.
+    """
+    group_users = group_users or {}
+    index = PolicyIndex()
+    for position, rule in enumerate(rules):
+        exempt = bool(rule.get('exempt', False))
+        if not exempt and not rule.get('time_limit'):
+            raise ValueError("time_limit_policies entry {} needs a time_limit or exempt".format(position))
+
+        group_name = rule.get('group')
+        policy = Policy(
+            limit=None if exempt else calc_limit(rule['time_limit'], now),
+            exempt=exempt,
+            filetype=rule.get('filetype'),
+            users=group_users.get(group_name, set()) if group_name else None,
+            name=rule.get('name', rule.get('path', '//...')),
+        )
+        index.add(rule.get('path'), policy)
+    return index
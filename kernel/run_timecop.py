@@ -6,91 +6,468 @@ from __future__ import print_function
 
 from argparse import ArgumentParser
 import os
-import re
-from datetime import datetime
+import json
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from p4_timecop.kernel.utils import (
     write_json,
     read_json,
     load_server_config,
     setup_server_connection,
-    get_file_datetime,
+    get_file_timestamp,
+    build_checkout_index,
     calc_limit,
-    write_log
+    record_handler
 )
+from p4_timecop.kernel import utils
+from p4_timecop.kernel.checkout import Checkout
+from p4_timecop.kernel.journal import (
+    load_open_files,
+    update_from_journal,
+    journal_types_expired,
+    journal_end_offset
+)
+from p4_timecop.kernel.state import (
+    get_state_backend,
+    checkout_keys,
+    drop_orphaned_checkouts,
+    compaction_due,
+    record_history
+)
+from p4_timecop.kernel.groups import resolve_ignored_groups, resolve_groups
+from p4_timecop.kernel.policies import build_policy_index, policy_group_names
+from p4_timecop.kernel.filters import CachedMatcher, build_checkout_filter
+from p4_timecop.kernel.metrics import RunMetrics, InstrumentedConnection
+from p4_timecop.kernel.logger import create_run_log
+from p4_timecop.kernel.snapshot import (
+    SnapshotServer,
+    SnapshotRecorder,
+    read_snapshot_header,
+    snapshot_time
+)
+from p4_timecop.kernel.scheduler import schedule_reverts
+from p4_timecop.kernel.contention import build_contention_index, split_contended
+from p4_timecop.kernel.connection import RetryingConnection, ConnectionPool
+from p4_timecop.kernel.plan import build_unlock_plan, write_plan, average_revert_latency
+from p4_timecop.kernel.notify import get_notifier, send_notices
+from p4_timecop.kernel.config import (
+    DEFAULT_LOG_PATH,
+    DEFAULT_DATA_PATH,
+    validate_config,
+    resolve_path,
+    resolve_server_paths
+)
+
+def add_open_file(data_dict, open_file, checkout_index, seen, now=None):
+    """Ages a single opened record and files it under its depot path."""
+
+    depot_path = open_file['depotFile']
+    file_type = open_file['type']
+    client = open_file['client']
+    user = open_file['user']
+
+    key = (depot_path, client, user)
+    if key in seen:
+        return
+    seen.add(key)
+
+    timestamp = get_file_timestamp(depot_path, client, user, checkout_index, now)
+
+    if depot_path not in data_dict:
+        data_dict[depot_path] = []
+
+    data_dict[depot_path].append(Checkout(file_type, client, user, timestamp))
 
-def get_open_files_dict(server, existing_data=None):
-    """get_open_files doc string"""
+def get_open_files_dict(
+    server, existing_data=None, stream=False, paths=None, exclusive_only=False, now=None, checkout_index=None
+):
+    """
+    Gathers every opened file on the server keyed by depot path.
 
-    existing_data = existing_data or {}
+    When stream is set the opened records are handed over one at a time
+    through an output handler, so the raw result list is never held in memory.
+    A server that isn't backed by P4Python can supply its own handler through
+    a record_handler method.
+    The query can be narrowed on the server to the given depot paths, and to
+    exclusively opened files only with exclusive_only. A query that matches
+    nothing only warns "file(s) not opened anywhere", so warnings are not
+    raised. Newly seen checkouts
+    are stamped with now in epoch seconds, which defaults to the current time.
+    A checkout_index of existing_data can be given when it is already built.
+    """
+
+    now = int(time.time()) if now is None else now
+    if checkout_index is None:
+        checkout_index = build_checkout_index(existing_data or {})
+    seen = set()
     data_dict = {}
-    opened_files = server.run('opened', '-a')
 
-    for open_file in opened_files:
-        depot_path = open_file['depotFile']
-        file_type = open_file['type']
-        client = open_file['client']
-        user = open_file['user']
-        timestamp = get_file_datetime(depot_path, client, user, existing_data)
+    opened_args = ['opened', '-a']
+    if exclusive_only:
+        opened_args.append('-x')
+    opened_args.extend(paths or [])
 
+    if stream:
+        make_handler = getattr(server, 'record_handler', None) or record_handler
+        handler = make_handler(
+            lambda open_file: add_open_file(data_dict, open_file, checkout_index, seen, now)
+        )
+        server.run(*opened_args, handler=handler, exception_level=1)
+        return data_dict
+
+    for open_file in server.run(*opened_args, exception_level=1):
+        add_open_file(data_dict, open_file, checkout_index, seen, now)
 
-        checkout_dict = {
-                'type': file_type,
-                'client': client,
-                'user': user,
-                'timestamp': timestamp
-            }
-        
-        if depot_path not in data_dict:
-            data_dict[depot_path] = []
-        
-        if checkout_dict not in data_dict[depot_path]:
-            data_dict[depot_path].append(checkout_dict)
-        
     return data_dict
 
-def check_open_files(open_files, time_limit, ignored_users):
+
+def merge_open_files(shard_results):
+    """
+    Merges open file dicts gathered from separate shards, dropping any
+    checkout a shard overlapping another has already seen.
+    """
+    merged = {}
+    for data_dict in shard_results:
+        for depot_path, checkouts in data_dict.items():
+            if depot_path not in merged:
+                merged[depot_path] = checkouts
+                continue
+            known = set((checkout.client, checkout.user) for checkout in merged[depot_path])
+            for checkout in checkouts:
+                if (checkout.client, checkout.user) not in known:
+                    merged[depot_path].append(checkout)
+    return merged
+
+
+def get_sharded_open_files(
+    pool, shards, existing_data=None, stream=False, exclusive_only=False, now=None, metrics=None
+):
+    """
+    Splits the opened query into one query per shard, each shard being a
+    depot path or a list of depot paths, and runs them concurrently on the
+    pool's connections before merging the results. The commands are
+    recorded in metrics when it is given.
+    """
+    now = int(time.time()) if now is None else now
+    checkout_index = build_checkout_index(existing_data or {})
+
+    def scan_shard(shard):
+        paths = [shard] if isinstance(shard, str) else shard
+        with pool.connection() as connection:
+            if metrics is not None:
+                connection = InstrumentedConnection(connection, metrics)
+            return get_open_files_dict(
+                connection,
+                existing_data,
+                stream=stream,
+                paths=paths,
+                exclusive_only=exclusive_only,
+                now=now,
+                checkout_index=checkout_index
+            )
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        shard_results = list(executor.map(scan_shard, shards))
+    return merge_open_files(shard_results)
+
+
+def check_open_files(
+    open_files, time_limit, ignored_users, checkout_filter=None, counts=None, policies=None,
+    expiring=None, warn_window=0
+):
+    """
+    Collects the expired checkouts in a single pass, skipping ignored users
+    and anything the optional checkout_filter rejects. When a counts dict is
+    given the number of ignored, exempt, expired and filtered checkouts is
+    added to it.
+
+    When a PolicyIndex is given, each checkout is held to the time limit of
+    its policy, or skipped when its policy is an exemption, with time_limit
+    used for checkouts no policy covers.
+
+    When an expiring dict is given, the checkouts that will expire within
+    warn_window seconds are added to it in the same pass, keyed by depot
+    path, as (checkout, seconds left) pairs.
+    """
+    ignored = exempt = expired = filtered = 0
     to_do = {}
     for file_path in open_files:
-        for checkout_data in open_files[file_path]:        
-            if checkout_data['user'] in ignored_users:
-                print('skipping check {} due to ignored user {}'.format(file_path, checkout_data['user']))
-            elif checkout_data['timestamp'] <= time_limit:
+        if checkout_filter and not checkout_filter.matches_path(file_path):
+            filtered += len(open_files[file_path])
+            continue
+
+        candidates = policies.candidates(file_path) if policies else None
+        for checkout in open_files[file_path]:        
+            if checkout.user in ignored_users:
+                ignored += 1
+                print('skipping check {} due to ignored user {}'.format(file_path, checkout.user))
+                continue
+
+            limit = time_limit
+            if candidates:
+                policy = policies.resolve(candidates, checkout)
+                if policy is not None and policy.exempt:
+                    exempt += 1
+                    continue
+                if policy is not None:
+                    limit = policy.limit
+
+            if checkout.timestamp <= limit:
+                expired += 1
+                if checkout_filter and not checkout_filter.matches(checkout):
+                    filtered += 1
+                    continue
                 if file_path not in to_do:
                     to_do[file_path] = []
-                to_do[file_path].append(checkout_data)
+                to_do[file_path].append(checkout)
+            elif expiring is not None and checkout.timestamp - limit <= warn_window:
+                if checkout_filter and not checkout_filter.matches(checkout):
+                    continue
+                if file_path not in expiring:
+                    expiring[file_path] = []
+                expiring[file_path].append((checkout, checkout.timestamp - limit))
+
+    if counts is not None:
+        for name, value in (('ignored', ignored), ('exempt', exempt), ('expired', expired), ('filtered', filtered)):
+            counts[name] = counts.get(name, 0) + value
 
     return to_do
 
 
-def perform_reverts(server, data_dict):
-    results = []
+def revert_messages(server):
+    """
+    Maps each depot path named in the last command's errors and warnings,
+    which p4 writes as "<path> - <message>", to its message.
+    """
+    messages = {}
+    for message in list(getattr(server, 'warnings', None) or []) + list(getattr(server, 'errors', None) or []):
+        file_path, separator, text = str(message).partition(' - ')
+        if separator:
+            messages[file_path.strip()] = text.strip()
+    return messages
+
+
+def perform_reverts(server, data_dict, chunk_size=100, ops_per_second=None, time_budget=None):
+    """
+    Reverts the given checkouts grouped by client, sending each client's
+    files as multi-file revert commands of at most chunk_size files.
+
+    ops_per_second caps the rate of file reverts sent to the server, and
+    no new revert command is started once time_budget seconds have passed.
+    Checkouts left over are in neither result, so they carry over to the
+    next run.
+
+    Each file's outcome is read from the revert's results, errors and
+    warnings rather than from whether the command as a whole succeeded. A
+    file p4 reports as not opened, as a retried command does for the files
+    its first attempt reverted, no longer holds its lock and is counted as
+    reverted.
+
+    Returns a (reverted, failed) pair of dicts keyed by depot path in the
+    same layout as data_dict.
+    """
+    client_checkouts = {}
     for file_path in data_dict:
-        for checkout_data in data_dict[file_path]:
-            result = server.run('revert', '-C', checkout_data['client'], file_path)
-            results.append(result)
-    return results
+        for checkout in data_dict[file_path]:
+            client = checkout.client
+            if client not in client_checkouts:
+                client_checkouts[client] = []
+            client_checkouts[client].append((file_path, checkout))
+
+    start_time = time.time()
+    sent = 0
+    reverted = {}
+    failed = {}
+    for client, checkouts in client_checkouts.items():
+        for start in range(0, len(checkouts), chunk_size):
+            if time_budget is not None and time.time() - start_time >= time_budget:
+                print('revert time budget spent, leaving the rest for the next run')
+                return reverted, failed
+
+            if ops_per_second:
+                wait = start_time + sent / float(ops_per_second) - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+
+            chunk = checkouts[start:start + chunk_size]
+            file_paths = [file_path for file_path, _ in chunk]
+            sent += len(chunk)
+
+            try:
+                results = server.run('revert', '-C', client, *file_paths, exception_level=0)
+                messages = revert_messages(server)
+            except utils.P4Exception as error:
+                print('revert failed for client {}: {}'.format(client, error))
+                results = []
+                messages = {}
+
+            reverted_paths = set(
+                result['depotFile'] for result in results
+                if isinstance(result, dict) and 'depotFile' in result
+            )
+
+            for file_path, checkout in chunk:
+                message = messages.get(file_path)
+                if file_path in reverted_paths or (message and 'not opened' in message):
+                    outcome = reverted
+                else:
+                    outcome = failed
+                    if message:
+                        print('revert failed for {}: {}'.format(file_path, message))
+                if file_path not in outcome:
+                    outcome[file_path] = []
+                outcome[file_path].append(checkout)
+
+    return reverted, failed
+
+def split_by_client(data_dict, parts):
+    """
+    Splits the checkouts in data_dict into at most parts dicts of the same
+    layout, balancing the number of checkouts while keeping every client's
+    checkouts together so they still go out as multi-file revert commands.
+    """
+    client_counts = {}
+    for file_path in data_dict:
+        for checkout in data_dict[file_path]:
+            client_counts[checkout.client] = client_counts.get(checkout.client, 0) + 1
+
+    sizes = [0] * max(min(parts, len(client_counts)), 1)
+    client_part = {}
+    for client in sorted(client_counts, key=lambda client: -client_counts[client]):
+        part = sizes.index(min(sizes))
+        client_part[client] = part
+        sizes[part] += client_counts[client]
+
+    split = [{} for _ in sizes]
+    for file_path in data_dict:
+        for checkout in data_dict[file_path]:
+            part = split[client_part[checkout.client]]
+            if file_path not in part:
+                part[file_path] = []
+            part[file_path].append(checkout)
+    return [part for part in split if part]
+
+
+def perform_sharded_reverts(
+    pool, data_dict, chunk_size=100, ops_per_second=None, time_budget=None, metrics=None
+):
+    """
+    Runs perform_reverts concurrently on the pool's connections, with the
+    checkouts split by client across the workers and ops_per_second shared
+    between them. Returns the merged (reverted, failed) pair.
+    """
+    parts = split_by_client(data_dict, pool.size)
+    if ops_per_second and parts:
+        ops_per_second = ops_per_second / float(len(parts))
+
+    def revert_part(part):
+        with pool.connection() as connection:
+            if metrics is not None:
+                connection = InstrumentedConnection(connection, metrics)
+            return perform_reverts(
+                connection,
+                part,
+                chunk_size=chunk_size,
+                ops_per_second=ops_per_second,
+                time_budget=time_budget
+            )
+
+    reverted = {}
+    failed = {}
+    if not parts:
+        return reverted, failed
+    with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        for part_reverted, part_failed in executor.map(revert_part, parts):
+            for merged, part_result in ((reverted, part_reverted), (failed, part_failed)):
+                for file_path, checkouts in part_result.items():
+                    if file_path not in merged:
+                        merged[file_path] = []
+                    merged[file_path].extend(checkouts)
+    return reverted, failed
+
+
+def gather_live_names(server):
+    """
+    Reads the names of every client and user on the server, or returns
+    None when either can't be read.
+    """
+    try:
+        clients = set(
+            record['client'] for record in server.run('clients')
+            if isinstance(record, dict) and 'client' in record
+        )
+        users = set(
+            record['User'] for record in server.run('users', '-a')
+            if isinstance(record, dict) and 'User' in record
+        )
+    except utils.P4Exception as error:
+        print('failed to read clients and users: {}'.format(error))
+        return None
+    if not clients or not users:
+        return None
+    return clients, users
+
+
+def compact_state(server, state, open_files, now, interval=86400):
+    """
+    Drops the checkouts of deleted clients and users from open_files at most
+    once per interval seconds, returning the number dropped.
+    """
+    if not compaction_due(state, now, interval):
+        return 0
+
+    live_names = gather_live_names(server)
+    if live_names is None:
+        return 0
+    dropped = drop_orphaned_checkouts(open_files, *live_names)
+    state.set_meta('compacted', json.dumps(now))
+    return dropped
 
 
 def gather_ignored_users(server, config):
     ignored_usernames = set(config.get('ignored_usernames', []))
 
-    for group_name in config.get('ignored_groupnames', []):
-        group_spec = server.fetch_group(group_name)
-        group_users = set(group_spec['Users'])
-        ignored_usernames = ignored_usernames.union(group_users)
+    group_users = resolve_ignored_groups(
+        server,
+        config.get('ignored_groupnames', []),
+        cache_path=config.get('group_cache_filepath'),
+        cache_ttl=config.get('group_cache_ttl', 3600)
+    )
 
-    return ignored_usernames
+    return ignored_usernames.union(group_users)
+
+
+def gather_policies(server, config, now=None):
+    """
+    Builds the PolicyIndex for a server's time_limit_policies, resolving the
+    groups they refer to, or returns None when no policies are configured.
+    """
+    rules = config.get('time_limit_policies')
+    if not rules:
+        return None
+
+    group_users = resolve_groups(
+        server,
+        policy_group_names(rules),
+        cache_path=config.get('group_cache_filepath'),
+        cache_ttl=config.get('group_cache_ttl', 3600)
+    )
+    return build_policy_index(rules, now, group_users)
 
 
 def apply_filetype_filter(to_be_unlocked, filetype_filter):
+    matcher = CachedMatcher(filetype_filter)
     to_remove = set()
     for file_path in to_be_unlocked:
         filtered_list = []
 
-        for checkout_data in to_be_unlocked[file_path]:
-            if re.search(filetype_filter, checkout_data['type']):
-                filtered_list.append(checkout_data)
+        for checkout in to_be_unlocked[file_path]:
+            if matcher(checkout.type):
+                filtered_list.append(checkout)
         to_be_unlocked[file_path] = filtered_list
         
         if not filtered_list:
@@ -103,77 +480,621 @@ def apply_filetype_filter(to_be_unlocked, filetype_filter):
     return to_be_unlocked
 
 
-def main():
-    parser = ArgumentParser()
-    parser.add_argument("-c", "--config", default="../config.json")
-    parser.add_argument("-t", "--timelimit")
-    parser.add_argument("-d", "--data")
-    parser.add_argument("-l", "--log")
-    
-    parsed_args = parser.parse_args()
+def query_open_files(p4_connection, existing_data, server_values, now=None, pool=None, metrics=None):
+    """
+    Runs the full opened query, split by the configured shards across the
+    pool's connections when a pool is given.
+    """
+    if pool is not None and server_values.get("shards"):
+        return get_sharded_open_files(
+            pool,
+            server_values["shards"],
+            existing_data,
+            stream=server_values.get("stream_opened", False),
+            exclusive_only=server_values.get("opened_exclusive_only", False),
+            now=now,
+            metrics=metrics
+        )
+    return get_open_files_dict(
+        p4_connection,
+        existing_data,
+        stream=server_values.get("stream_opened", False),
+        paths=server_values.get("opened_paths"),
+        exclusive_only=server_values.get("opened_exclusive_only", False),
+        now=now
+    )
 
-    script_dir = os.path.dirname(__file__)
-    os.chdir(script_dir)
 
-    config = load_server_config(parsed_args.config)        
+def scan_open_files(
+    p4_connection, existing_data, server_values, data_path, now=None, pool=None, metrics=None,
+    expire_before=None, pending_writes=None
+):
+    """
+    Builds the current open file data, either from the server journal since
+    the last run or from a full opened query when a reconciliation is due.
 
-    for server_name, server_values in config.get("servers", {}).items():
-        log_path  = server_values.get('log_filepath', "../log.txt")
-        if parsed_args.log:
-            log_path = parsed_args.log
+    The journal state is written straight away, unless a pending_writes list
+    is given to collect it as a (data, path) pair. The caller then writes it
+    once the open file data it goes with has been saved, so a failed save
+    can't leave the journal offset past records that were never stored.
 
-        data_path  = server_values.get('data_filepath', "../data.json")
-        if parsed_args.data:
-            data_path = parsed_args.data
-        
-        limit_str  = server_values.get('file_lock_time_limit', "01:00:00:00")
-        if parsed_args.timelimit:
-            limit_str = parsed_args.timelimit
-        time_limit = calc_limit(limit_str)
+    Journal records only carry the server's numeric filetype code, so a
+    reconciliation is also made as soon as a checkout picked up from the
+    journal has been open since expire_before.
+    """
+    journal_path = server_values.get("journal_filepath")
+    if not journal_path:
+        return query_open_files(p4_connection, existing_data, server_values, now, pool, metrics)
 
-        existing_data = read_json(data_path)
-        
-        # updating previous data model to accomodate multiple checkouts per depot path
-        for depot_path in existing_data:  
-            if not isinstance(existing_data[depot_path], list):
-                existing_data[depot_path] = [existing_data[depot_path]]
+    journal_state_path = server_values.get("journal_state_filepath", data_path + ".journal")
+    journal_state = read_json(journal_state_path)
 
-        print("Connecting to server: {}".format(server_name))
-        p4_connection = setup_server_connection(**server_values['server'])
+    reconcile_interval = server_values.get("journal_reconcile_interval", 86400)
+    reconcile = time.time() - journal_state.get('reconciled', 0) >= reconcile_interval
+    if not reconcile:
+        open_files = load_open_files(existing_data)
+        offset = update_from_journal(
+            open_files,
+            journal_path,
+            journal_state.get('offset', 0),
+            columns=server_values.get("journal_columns")
+        )
+        if expire_before is not None and journal_types_expired(open_files, expire_before):
+            # The journal's open times are kept, only the filetypes are
+            # taken from the opened query.
+            print("Checkouts read from the journal are due, reconciling their filetypes.")
+            existing_data = open_files
+            reconcile = True
+        else:
+            journal_state['offset'] = offset
+    if reconcile:
+        journal_state['offset'] = journal_end_offset(journal_path)
+        journal_state['reconciled'] = time.time()
+        open_files = query_open_files(p4_connection, existing_data, server_values, now, pool, metrics)
 
-        ignored_users = gather_ignored_users(server=p4_connection, config=server_values)
-        
-        open_files = get_open_files_dict(p4_connection, existing_data)
-        to_be_unlocked = check_open_files(open_files, time_limit, ignored_users)
-        
-        filetype_filter = server_values.get("filetype_filter", None)
-        if filetype_filter:
-            to_be_unlocked = apply_filetype_filter(to_be_unlocked, filetype_filter)
-        
-        perform_reverts(p4_connection, to_be_unlocked)
+    if pending_writes is None:
+        write_json(journal_state, journal_state_path)
+    else:
+        pending_writes.append((journal_state, journal_state_path))
+    return open_files
+
+
+def drop_checkouts(open_files, data_dict):
+    """Removes the checkouts in data_dict from open_files, dropping emptied paths."""
+    for file_path in data_dict:
+        for checkout in data_dict[file_path]:
+            if checkout in open_files.get(file_path, []):
+                open_files[file_path].remove(checkout)
 
-        log_lines = []
-        for file_path in to_be_unlocked:
-            for checkout_data in to_be_unlocked[file_path]:
-                line = '{time}: {file_path} has been force reverted from {user}@{client}.\n'.format(
-                    time=datetime.now().strftime("%a %b %d %H:%M:%S %Y"), 
+        if file_path in open_files and not open_files[file_path]:
+            del open_files[file_path]
+
+
+def record_reverts(open_files, reverted, failed, run_log):
+    """
+    Drops reverted checkouts from open_files and logs an event for every
+    reverted and failed checkout.
+    """
+    for file_path in reverted:
+        for checkout in reverted[file_path]:
+            run_log.event(
+                'reverted',
+                '{file_path} has been force reverted from {user}@{client}.'.format(
+                    file_path=file_path,
+                    user=checkout.user, 
+                    client=checkout.client
+                ),
+                file=file_path,
+                user=checkout.user,
+                client=checkout.client,
+                type=checkout.type,
+                opened=checkout.timestamp
+            )
+
+
+    drop_checkouts(open_files, reverted)
+
+    for file_path in failed:
+        for checkout in failed[file_path]:
+            run_log.event(
+                'revert_failed',
+                '{file_path} failed to revert from {user}@{client}.'.format(
                     file_path=file_path,
-                    user=checkout_data['user'], 
-                    client=checkout_data['client']
+                    user=checkout.user, 
+                    client=checkout.client
+                ),
+                file=file_path,
+                user=checkout.user,
+                client=checkout.client,
+                type=checkout.type,
+                opened=checkout.timestamp
+            )
+
+
+def count_checkouts(data_dict):
+    return sum(len(checkouts) for checkouts in data_dict.values())
+
+
+def process_server(server_name, server_values, parsed_args, session=None):
+    """
+    Runs a full unlock pass against a single server.
+
+    When a session dict is given its connection and checkout state are reused
+    and updated in place, so repeated passes skip the login and data reload.
+    Stage timings, record counts and P4 command statistics are written to
+    metrics_filepath when it is configured.
+
+    A dry run, which is implied when a plan file or an opened snapshot is
+    given, stops after the checks and writes the planned reverts instead of
+    reverting anything or saving state.
+
+    The clock is read once per pass, so the time limit, the timestamps of new
+    checkouts and the log entries all agree.
+
+    When shards are configured, the opened query and the reverts are split
+    across shard_workers connections of their own, and their results are
+    merged into the one state update and log of the pass.
+    """
+    metrics = RunMetrics(server_name)
+    now = int(time.time())
+    dry_run = parsed_args.dry_run or bool(parsed_args.plan) or bool(parsed_args.snapshot)
+
+    log_path  = server_values.get('log_filepath', DEFAULT_LOG_PATH)
+    if parsed_args.log:
+        log_path = parsed_args.log.format(server=server_name)
+
+    data_path  = server_values.get('data_filepath', DEFAULT_DATA_PATH)
+    if parsed_args.data:
+        data_path = parsed_args.data.format(server=server_name)
+    
+    limit_str  = server_values.get('file_lock_time_limit', "01:00:00:00")
+    if parsed_args.timelimit:
+        limit_str = parsed_args.timelimit
+    time_limit = calc_limit(limit_str, now)
+
+    with metrics.stage('state_load'):
+        state = get_state_backend(
+            data_path,
+            server_values.get("state_backend", "json"),
+            server_values.get("state_filepath")
+        )
+        if session and session.get('open_files') is not None:
+            existing_data = session['open_files']
+        else:
+            existing_data = state.load()
+
+    history_days = server_values.get("history_days", 90)
+    previous_keys = checkout_keys(existing_data) if history_days and not dry_run else None
+
+    with metrics.stage('connect'):
+        p4_connection = session.get('connection') if session else None
+        if parsed_args.snapshot:
+            p4_connection = SnapshotServer(parsed_args.snapshot)
+        elif p4_connection is None or not p4_connection.connected():
+            print("Connecting to server: {}".format(server_name))
+            p4_connection = setup_server_connection(**server_values['server'])
+            if session is not None:
+                session['connection'] = p4_connection
+
+    retrying = None
+    if not parsed_args.snapshot:
+        retrying = RetryingConnection(
+            p4_connection,
+            lambda: setup_server_connection(**server_values['server']),
+            retries=server_values.get("rpc_retries", 3),
+            backoff=server_values.get("rpc_backoff", 1.0),
+            max_backoff=server_values.get("rpc_max_backoff", 30.0),
+            timeout=server_values.get("rpc_timeout")
+        )
+        p4_connection = retrying
+
+    pool = None
+    if server_values.get("shards") and not parsed_args.snapshot and not parsed_args.record_snapshot:
+        pool = session.get('pool') if session else None
+        if pool is None:
+            pool = ConnectionPool(
+                lambda: setup_server_connection(**server_values['server']),
+                size=server_values.get("shard_workers", len(server_values["shards"])),
+                retries=server_values.get("rpc_retries", 3),
+                backoff=server_values.get("rpc_backoff", 1.0),
+                max_backoff=server_values.get("rpc_max_backoff", 30.0),
+                timeout=server_values.get("rpc_timeout")
+            )
+            if session is not None:
+                session['pool'] = pool
+        pool_retries = sum(connection.retry_count for connection in pool.connections)
+
+    recorder = None
+    group_config = server_values
+    if parsed_args.snapshot:
+        # Group membership in a snapshot is as old as the snapshot, so it is
+        # kept out of the cache that real runs read.
+        group_config = dict(server_values, group_cache_filepath=None)
+    if parsed_args.record_snapshot:
+        recorder = SnapshotRecorder(
+            p4_connection,
+            parsed_args.record_snapshot.format(server=server_name),
+            server_name
+        )
+        p4_connection = recorder
+        group_config = dict(server_values, group_cache_filepath=None)
+    p4_connection = InstrumentedConnection(p4_connection, metrics)
+
+    with metrics.stage('groups'):
+        ignored_users = gather_ignored_users(server=p4_connection, config=group_config)
+        policies = gather_policies(p4_connection, group_config, now)
+
+    notifier = get_notifier(server_values)
+    expire_before = max([time_limit] + (policies.limits() if policies else []))
+    if notifier:
+        expire_before += server_values.get("notify_window", 14400)
+
+    # Written once the state has been saved, and never by a dry run.
+    pending_writes = []
+    with metrics.stage('opened'):
+        open_files = scan_open_files(
+            p4_connection,
+            existing_data,
+            server_values,
+            data_path,
+            now=now,
+            pool=pool,
+            metrics=metrics,
+            expire_before=expire_before,
+            pending_writes=pending_writes
+        )
+    if recorder:
+        recorder.close()
+    metrics.count('scanned', count_checkouts(open_files))
+    if previous_keys is not None:
+        scanned_keys = checkout_keys(open_files)
+        metrics.count('opened', len(scanned_keys - previous_keys))
+        metrics.count('closed', len(previous_keys - scanned_keys))
+        previous_keys = scanned_keys = None
+
+    expiring = {} if notifier else None
+    with metrics.stage('check'):
+        to_be_unlocked = check_open_files(
+            open_files,
+            time_limit,
+            ignored_users,
+            build_checkout_filter(server_values),
+            counts=metrics.counts,
+            policies=policies,
+            expiring=expiring,
+            warn_window=server_values.get("notify_window", 14400)
+        )
+    if notifier:
+        metrics.count('expiring', count_checkouts(expiring))
+
+    contention = None
+    feed_path = server_values.get("contention_feed_filepath")
+    if feed_path:
+        contention = build_contention_index(
+            feed_path,
+            since=now - server_values.get("contention_window", 86400)
+        )
+        if server_values.get("contention_only", False):
+            to_be_unlocked, uncontended = split_contended(to_be_unlocked, contention)
+            metrics.count('uncontended', count_checkouts(uncontended))
+
+    to_be_unlocked, deferred = schedule_reverts(
+        to_be_unlocked,
+        open_files,
+        server_values.get("max_reverts_per_run"),
+        contention
+    )
+    metrics.count('deferred', count_checkouts(deferred))
+
+    metrics_path = server_values.get("metrics_filepath")
+    chunk_size = server_values.get("revert_chunk_size", 100)
+    if dry_run:
+        state.close()
+        plan = build_unlock_plan(
+            server_name,
+            to_be_unlocked,
+            time_limit,
+            chunk_size,
+            average_revert_latency(metrics_path)
+        )
+        if parsed_args.plan:
+            write_plan(plan, parsed_args.plan.format(server=server_name))
+        print("Dry run completed, {} checkouts would be reverted.".format(plan['checkouts']))
+        if pool and session is None:
+            pool.close()
+        return
+
+    with metrics.stage('revert'):
+        if pool:
+            reverted, failed = perform_sharded_reverts(
+                pool,
+                to_be_unlocked,
+                chunk_size=chunk_size,
+                ops_per_second=server_values.get("revert_ops_per_second"),
+                time_budget=server_values.get("revert_time_budget"),
+                metrics=metrics
+            )
+        else:
+            reverted, failed = perform_reverts(
+                p4_connection,
+                to_be_unlocked,
+                chunk_size=chunk_size,
+                ops_per_second=server_values.get("revert_ops_per_second"),
+                time_budget=server_values.get("revert_time_budget")
+            )
+    if retrying:
+        metrics.count('retries', retrying.retry_count)
+        if session is not None:
+            session['connection'] = retrying.connection
+    if pool:
+        metrics.count('retries', sum(connection.retry_count for connection in pool.connections) - pool_retries)
+        if session is None:
+            pool.close()
+    metrics.count('reverted', count_checkouts(reverted))
+    metrics.count('failed', count_checkouts(failed))
+
+    run_log = create_run_log(log_path, server_values, now)
+    record_reverts(open_files, reverted, failed, run_log)
+    # The reverts have already happened, so their record is written before
+    # anything later in the run has a chance to fail.
+    with metrics.stage('log'):
+        run_log.flush()
+
+    try:
+        if notifier:
+            with metrics.stage('notify'):
+                notices = send_notices(
+                    p4_connection,
+                    server_name,
+                    expiring,
+                    notifier,
+                    state,
+                    now,
+                    interval=server_values.get("notify_interval", 86400),
+                    max_files=server_values.get("notify_max_files", 50)
+                )
+            metrics.count('notified', len(notices))
+            for notice in notices:
+                run_log.event(
+                    'notified',
+                    '{user} has been warned about {count} locked files.'.format(
+                        user=notice['user'],
+                        count=len(notice['files'])
+                    ),
+                    user=notice['user'],
+                    files=len(notice['files'])
                 )
 
-            log_lines.append(line)
-            if file_path in open_files:
-                del open_files[file_path]
+        with metrics.stage('compact'):
+            # A full opened query only returns checkouts of live clients and
+            # users, so only state kept up to date from the journal can hold
+            # orphans.
+            if server_values.get("journal_filepath"):
+                metrics.count('dropped', compact_state(
+                    p4_connection,
+                    state,
+                    open_files,
+                    now,
+                    server_values.get("compaction_interval", 86400)
+                ))
+            if history_days:
+                history_counts = dict(
+                    (name, metrics.counts.get(name, 0))
+                    for name in ('opened', 'closed', 'reverted', 'failed', 'dropped')
+                )
+                history_counts['open'] = count_checkouts(open_files)
+                record_history(state, now, history_counts, history_days)
+
+        with metrics.stage('state_save'):
+            state.save(open_files)
+            state.close()
+            for data, path in pending_writes:
+                write_json(data, path)
+        if session is not None:
+            session['open_files'] = open_files
+
+        run_log.event('completed', 'Auto Unlock Completed.', server=server_name)
+    finally:
+        with metrics.stage('log'):
+            run_log.flush()
+
+    if metrics_path:
+        metrics.write(metrics_path, server_values.get("metrics_format", "json"))
+    print("Auto Unlock Completed.")
+
+
+def close_session(session):
+    """Disconnects a session's connection and shard pool if they are still open."""
+    pool = session.pop('pool', None)
+    if pool is not None:
+        pool.close()
+
+    p4_connection = session.get('connection')
+    session['connection'] = None
+    if p4_connection is not None:
+        try:
+            if p4_connection.connected():
+                p4_connection.disconnect()
+        except utils.P4Exception as error:
+            print("Failed to disconnect cleanly: {}".format(error))
+
+
+def run_servers(servers, parsed_args, max_workers=1, sessions=None):
+    """
+    Processes every configured server, concurrently when max_workers is
+    above one. A failure on one server is reported without stopping the rest.
+
+    Returns a dict of server name to elapsed seconds.
+    """
+    sessions = sessions or {}
+
+    def timed_run(server_name, server_values):
+        start = time.time()
+        session = sessions.get(server_name)
+        try:
+            process_server(server_name, server_values, parsed_args, session=session)
+        except Exception as error:
+            print("Server {} failed: {}".format(server_name, error))
+            if session is not None:
+                close_session(session)
+        return time.time() - start
+
+    timings = {}
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                server_name: executor.submit(timed_run, server_name, server_values)
+                for server_name, server_values in servers.items()
+            }
+            for server_name, future in futures.items():
+                timings[server_name] = future.result()
+    else:
+        for server_name, server_values in servers.items():
+            timings[server_name] = timed_run(server_name, server_values)
+
+    for server_name, elapsed in timings.items():
+        print("{}: {:.2f}s".format(server_name, elapsed))
+
+    return timings
+
+
+def run_daemon(servers, parsed_args, max_workers=1, interval=300):
+    """
+    Re-scans every server each interval seconds, keeping connections and
+    checkout state alive between scans until SIGTERM or SIGINT is received.
+    """
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print("Received signal {}, shutting down after the current scan.".format(signum))
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    sessions = {server_name: {} for server_name in servers}
+    while not stop_event.is_set():
+        run_servers(servers, parsed_args, max_workers, sessions)
+        stop_event.wait(interval)
+
+    for session in sessions.values():
+        close_session(session)
+
+
+def replay_snapshots(snapshot_paths, servers, parsed_args):
+    """
+    Runs the scan and revert decision over a series of recorded snapshots in
+    the order they were recorded, treating each snapshot's recording time as
+    the current time. Checkouts that would be reverted are dropped before the
+    next snapshot, as a real run would have done.
+
+    Returns a summary dict per snapshot, which is also written to the plan
+    path when one is given.
+    """
+    ordered_paths = sorted(
+        snapshot_paths,
+        key=lambda snapshot_path: read_snapshot_header(snapshot_path).get('time', 0)
+    )
+
+    open_files = {}
+    results = []
+    for snapshot_path in ordered_paths:
+        header = read_snapshot_header(snapshot_path)
+        server_values = servers.get(header.get('server')) or next(iter(servers.values()), {})
+        now = snapshot_time(snapshot_path)
+        limit_str = parsed_args.timelimit or server_values.get('file_lock_time_limit', "01:00:00:00")
+
+        server = SnapshotServer(snapshot_path)
+        group_config = dict(server_values, group_cache_filepath=None)
+        ignored_users = gather_ignored_users(server, group_config)
+        policies = gather_policies(server, group_config, now)
+        open_files = get_open_files_dict(
+            server,
+            open_files,
+            stream=True,
+            paths=server_values.get("opened_paths"),
+            exclusive_only=server_values.get("opened_exclusive_only", False),
+            now=now
+        )
+        counts = {'scanned': count_checkouts(open_files)}
+        to_be_unlocked = check_open_files(
+            open_files,
+            calc_limit(limit_str, now),
+            ignored_users,
+            build_checkout_filter(server_values),
+            counts=counts,
+            policies=policies
+        )
+        counts['reverted'] = count_checkouts(to_be_unlocked)
+        drop_checkouts(open_files, to_be_unlocked)
+
+        print("{}: {scanned} open, {expired} expired, {reverted} would be reverted.".format(snapshot_path, **counts))
+        results.append(dict(counts, snapshot=snapshot_path, time=header.get('time')))
+
+    if parsed_args.plan:
+        write_json(results, parsed_args.plan)
+    return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-c", "--config", default="../config.json")
+    parser.add_argument("-t", "--timelimit")
+    parser.add_argument("-d", "--data")
+    parser.add_argument("-l", "--log")
+    parser.add_argument("-w", "--workers")
+    parser.add_argument("-D", "--daemon", action="store_true")
+    parser.add_argument("-i", "--interval")
+    parser.add_argument("-n", "--dry-run", action="store_true")
+    parser.add_argument("-p", "--plan")
+    parser.add_argument("-s", "--snapshot")
+    parser.add_argument("-r", "--record-snapshot")
+    parser.add_argument("-R", "--replay", nargs="+")
+    parser.add_argument("-C", "--check-config", action="store_true")
+    
+    parsed_args = parser.parse_args()
+
+    # Relative paths have always been taken from the script directory, they
+    # are resolved from it rather than changing the working directory.
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in ('config', 'data', 'log', 'plan', 'snapshot', 'record_snapshot'):
+        setattr(parsed_args, name, resolve_path(getattr(parsed_args, name), script_dir))
+    if parsed_args.replay:
+        parsed_args.replay = [resolve_path(path, script_dir) for path in parsed_args.replay]
 
-        write_log(log_lines, log_path)
+    config = load_server_config(parsed_args.config)
+    errors = validate_config(config)
+    several_servers = isinstance(config, dict) and len(config.get('servers') or ()) > 1
+    # A replay writes a single report to --plan rather than one per server.
+    per_server_args = ('data', 'log', 'record_snapshot') + (() if parsed_args.replay else ('plan',))
+    for name in per_server_args:
+        value = getattr(parsed_args, name)
+        if several_servers and value and '{server}' not in value:
+            errors.append("--{}: needs a {{server}} placeholder when several servers are configured".format(
+                name.replace('_', '-')
+            ))
+    for error in errors:
+        print("Config error: {}".format(error))
+    if parsed_args.check_config:
+        if not errors:
+            print("{} is valid, {} servers configured.".format(parsed_args.config, len(config['servers'])))
+        sys.exit(1 if errors else 0)
+    if errors:
+        sys.exit(1)
 
-        write_json(open_files, data_path)
+    config['servers'] = dict(
+        (server_name, resolve_server_paths(server_values, script_dir, server_name if several_servers else None))
+        for server_name, server_values in config['servers'].items()
+    )
 
-        line = '{time}: Auto Unlock Completed.\n'.format(
-                time=datetime.now().strftime("%a %b %d %H:%M:%S %Y"))
-        write_log([line], log_path)
-        print("Auto Unlock Completed.")
+    max_workers = int(parsed_args.workers or config.get("max_workers", 1))
+    if parsed_args.replay:
+        replay_snapshots(parsed_args.replay, config.get("servers", {}), parsed_args)
+    elif parsed_args.daemon:
+        interval = float(parsed_args.interval or config.get("daemon_interval", 300))
+        run_daemon(config.get("servers", {}), parsed_args, max_workers, interval)
+    else:
+        run_servers(config.get("servers", {}), parsed_args, max_workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+from __future__ import print_function
+
+
+def count_contention(open_files, file_path, user, contention=None):
+    """
+    Counts the other users that also have file_path open, or are recorded in
+    the contention index as blocked on it.
+    """
+    users = set(
+        checkout.user for checkout in open_files.get(file_path, [])
+        if checkout.user != user
+    )
+    if contention and file_path in contention:
+        users.update(contention[file_path] - {user})
+    return len(users)
+
+
+def schedule_reverts(to_be_unlocked, open_files, max_reverts=None, contention=None):
+    """
+    Orders the expired checkouts oldest lock first, with files that other
+    users also have open or are blocked on ahead of uncontended ones of the
+    same age, and keeps at most max_reverts of them for this run.
+
+    Returns (scheduled, deferred) dicts keyed by depot path. Deferred
+    checkouts stay in the open file data, so they are picked up again on
+    the next run.
+    """
+    entries = []
+    for file_path in to_be_unlocked:
+        for checkout in to_be_unlocked[file_path]:
+            users_waiting = count_contention(open_files, file_path, checkout.user, contention)
+            entries.append((checkout.timestamp, -users_waiting, file_path, checkout))
+
+    entries.sort(key=lambda entry: entry[:3])
+    if max_reverts is not None:
+        scheduled_entries, deferred_entries = entries[:max_reverts], entries[max_reverts:]
+    else:
+        scheduled_entries, deferred_entries = entries, []
+
+    scheduled = {}
+    for _, _, file_path, checkout in scheduled_entries:
+        scheduled.setdefault(file_path, []).append(checkout)
+
+    deferred = {}
+    for _, _, file_path, checkout in deferred_entries:
+        deferred.setdefault(file_path, []).append(checkout)
+
+    return scheduled, deferred
@@ -0,0 +1,137 @@
+from __future__ import print_function
+
+import gzip
+import json
+import re
+import time
+
+from p4_timecop.kernel.utils import record_handler
+
+EXCLUSIVE_TYPE_REGEX = re.compile(r'\+\w*l')
+
+
+def iter_snapshot_records(snapshot_path, kind=None):
+    """
+    Streams (kind, record) pairs from a gzip compressed json lines snapshot,
+    optionally limited to a single kind of record.
+    """
+    with gzip.open(snapshot_path, 'rt', encoding='utf-8') as snapshot_file:
+        for line in snapshot_file:
+            record_kind, record = json.loads(line)
+            if kind is None or record_kind == kind:
+                yield record_kind, record
+
+
+def read_snapshot_header(snapshot_path):
+    """
+    Returns the header a snapshot was recorded with, holding the server name
+    and recording time, or an empty dict for snapshots without one.
+    """
+    for record_kind, record in iter_snapshot_records(snapshot_path):
+        return record if record_kind == 'header' else {}
+    return {}
+
+
+def snapshot_time(snapshot_path):
+    """Returns the time a snapshot was recorded in whole epoch seconds."""
+    recorded = read_snapshot_header(snapshot_path).get('time')
+    return int(recorded) if recorded is not None else None
+
+
+class SnapshotRecorder(object):
+    """
+    Wraps a P4 connection and copies every opened and groups record that
+    passes through it into a gzip compressed json lines snapshot, so a run
+    can be recorded without making any extra queries.
+    """
+
+    RECORDED_COMMANDS = ('opened', 'groups')
+
+    def __init__(self, connection, snapshot_path, server_name=None):
+        self.connection = connection
+        self.snapshot_path = snapshot_path
+        self.snapshot_file = gzip.open(snapshot_path, 'wt', encoding='utf-8')
+        self.write('header', {'server': server_name, 'time': time.time()})
+
+    def write(self, kind, record):
+        self.snapshot_file.write(json.dumps([kind, record]) + '\n')
+
+    def run(self, *args, **kwargs):
+        command = args[0]
+        if command not in self.RECORDED_COMMANDS:
+            return self.connection.run(*args, **kwargs)
+
+        handler = kwargs.get('handler')
+        if handler:
+            def record_and_forward(record):
+                self.write(command, record)
+                handler.outputStat(record)
+            kwargs['handler'] = record_handler(record_and_forward)
+            return self.connection.run(*args, **kwargs)
+
+        results = self.connection.run(*args, **kwargs)
+        for record in results:
+            if isinstance(record, dict):
+                self.write(command, record)
+        return results
+
+    def close(self):
+        self.snapshot_file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class CallbackHandler(object):
+    """Hands each snapshot record to a callback, without needing P4Python."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def outputStat(self, stat):
+        self.callback(stat)
+
+
+class SnapshotServer(object):
+    """
+    Stands in for a P4 connection by answering the read-only commands
+    timecop issues from a recorded snapshot. Reverts are refused, so a
+    snapshot can only drive a dry run.
+    """
+
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+
+    def record_handler(self, callback):
+        """Creates the handler streamed opened records are passed through."""
+        return CallbackHandler(callback)
+
+    def run(self, *args, **kwargs):
+        command = args[0]
+        if command == 'opened':
+            return self.run_opened(args[1:], kwargs.get('handler'))
+        if command == 'groups':
+            return [record for _, record in iter_snapshot_records(self.snapshot_path, 'groups')]
+        raise ValueError("'{}' can not be answered from a snapshot".format(command))
+
+    def run_opened(self, args, handler=None):
+        exclusive_only = '-x' in args
+        prefixes = [arg[:-3] if arg.endswith('...') else arg for arg in args if arg.startswith('//')]
+
+        results = []
+        for _, record in iter_snapshot_records(self.snapshot_path, 'opened'):
+            if exclusive_only and not EXCLUSIVE_TYPE_REGEX.search(record['type']):
+                continue
+            if prefixes and not any(record['depotFile'].startswith(prefix) for prefix in prefixes):
+                continue
+            if handler:
+                handler.outputStat(record)
+            else:
+                results.append(record)
+        return results
+
+    def connected(self):
+        return True
+
+    def disconnect(self):
+        pass
@@ -0,0 +1,295 @@
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import time
+
+from p4_timecop.kernel.utils import (
+    read_json,
+    write_json,
+    parse_timestamp
+)
+from p4_timecop.kernel.checkout import Checkout, checkouts_from_data
+
+# Bumped whenever the stored checkout layout changes, so older data is
+# upgraded on its first load rather than checked on every load.
+STATE_VERSION = 2
+
+CHECKOUTS_TABLE = (
+    "CREATE TABLE {}checkouts ("
+    "depot_path TEXT, client TEXT, user TEXT, type TEXT, timestamp INTEGER, "
+    "PRIMARY KEY (depot_path, client, user))"
+)
+
+
+def upgrade_legacy_data(existing_data):
+    """
+    Updates the previous data models, which held a single checkout dict per
+    depot path and formatted timestamp strings, to the list layout that
+    accommodates multiple checkouts with epoch second timestamps.
+    """
+    for depot_path in existing_data:
+        if not isinstance(existing_data[depot_path], list):
+            existing_data[depot_path] = [existing_data[depot_path]]
+        for checkout_data in existing_data[depot_path]:
+            if not isinstance(checkout_data['timestamp'], int):
+                checkout_data['timestamp'] = parse_timestamp(checkout_data['timestamp'])
+    return existing_data
+
+
+def replace_json(data, path):
+    """
+    Writes to a temporary file beside path and swaps it into place, so a
+    crash mid-write leaves the previous file intact.
+    """
+    temp_path = path + ".tmp"
+    write_json(data, temp_path)
+    os.replace(temp_path, path)
+
+
+class JsonStateBackend(object):
+    """
+    Keeps the checkout data in a single json file, converting between the
+    file's dicts and Checkout records as it loads and saves. Other run state
+    is kept in a small json file beside it with .meta appended, which is read
+    once and written once, after the data, when it has changed.
+    """
+
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.meta_path = data_path + ".meta"
+        self.meta = None
+        self.meta_changed = False
+
+    def read_meta(self):
+        if self.meta is None:
+            try:
+                self.meta = read_json(self.meta_path)
+            except ValueError as error:
+                print("Ignoring unreadable {}: {}".format(self.meta_path, error))
+                self.meta = {}
+        return self.meta
+
+    def get_meta(self, key, default=None):
+        return self.read_meta().get(key, default)
+
+    def set_meta(self, key, value):
+        self.read_meta()[key] = value
+        self.meta_changed = True
+
+    def write_meta(self):
+        if self.meta_changed:
+            replace_json(self.meta, self.meta_path)
+            self.meta_changed = False
+
+    def load(self):
+        """Loads the data, upgrading older layouts until it has been saved once."""
+        existing_data = read_json(self.data_path)
+        if self.get_meta('version') != STATE_VERSION:
+            existing_data = upgrade_legacy_data(existing_data)
+        return checkouts_from_data(existing_data)
+
+    def save(self, open_files):
+        """Replaces the data file, then the meta file when it has changed."""
+        replace_json(open_files, self.data_path)
+        if self.get_meta('version') != STATE_VERSION:
+            self.set_meta('version', STATE_VERSION)
+        self.write_meta()
+
+    def close(self):
+        self.write_meta()
+
+
+class SqliteStateBackend(object):
+    """
+    Keeps the checkout data in a sqlite database with one row per checkout.
+    Saving only touches the rows that changed since the data was loaded, and
+    commits any meta changes in the same transaction.
+    """
+
+    def __init__(self, db_path, legacy_path=None):
+        self.db_path = db_path
+        self.legacy_path = legacy_path
+        self.rows = None
+        self.pending_meta = {}
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.execute(CHECKOUTS_TABLE.format("IF NOT EXISTS "))
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+        self.migrate_legacy_timestamps()
+
+    def migrate_legacy_timestamps(self):
+        """
+        Rebuilds a checkouts table written by older versions, which kept the
+        timestamps as formatted text, with epoch second timestamps.
+        """
+        columns = self.connection.execute("PRAGMA table_info(checkouts)").fetchall()
+        if any(column[1] == 'timestamp' and column[2] == 'INTEGER' for column in columns):
+            return
+
+        legacy_rows = self.connection.execute(
+            "SELECT depot_path, client, user, type, timestamp FROM checkouts"
+        ).fetchall()
+        with self.connection:
+            self.connection.execute("DROP TABLE checkouts")
+            self.connection.execute(CHECKOUTS_TABLE.format(""))
+            self.connection.executemany(
+                "INSERT INTO checkouts (depot_path, client, user, type, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [row[:4] + (parse_timestamp(row[4]),) for row in legacy_rows]
+            )
+
+    def get_meta(self, key, default=None):
+        if key in self.pending_meta:
+            return self.pending_meta[key]
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.pending_meta[key] = value
+
+    def write_meta(self):
+        self.connection.executemany(
+            "REPLACE INTO meta (key, value) VALUES (?, ?)", list(self.pending_meta.items())
+        )
+        self.pending_meta = {}
+
+    def migrate_legacy_data(self):
+        """Imports an existing json data file the first time the database is used."""
+        if self.get_meta('migrated') or not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+
+        print("Migrating {} to {}".format(self.legacy_path, self.db_path))
+        legacy_data = upgrade_legacy_data(read_json(self.legacy_path))
+        self.rows = {}
+        self.set_meta('migrated', self.legacy_path)
+        self.save(checkouts_from_data(legacy_data))
+
+    def read_rows(self):
+        rows = {}
+        for depot_path, client, user, file_type, timestamp in self.connection.execute(
+            "SELECT depot_path, client, user, type, timestamp FROM checkouts"
+        ):
+            rows[(depot_path, client, user)] = (file_type, timestamp)
+        return rows
+
+    def load(self):
+        self.migrate_legacy_data()
+        self.rows = self.read_rows()
+
+        open_files = {}
+        for (depot_path, client, user), (file_type, timestamp) in self.rows.items():
+            if depot_path not in open_files:
+                open_files[depot_path] = []
+            open_files[depot_path].append(Checkout(file_type, client, user, timestamp))
+        return open_files
+
+    def save(self, open_files):
+        if self.rows is None:
+            self.rows = self.read_rows()
+
+        new_rows = {}
+        for depot_path, checkouts in open_files.items():
+            for checkout in checkouts:
+                new_rows[(depot_path, checkout.client, checkout.user)] = (checkout.type, checkout.timestamp)
+
+        removed = [key for key in self.rows if key not in new_rows]
+        changed = [
+            key + value for key, value in new_rows.items()
+            if self.rows.get(key) != value
+        ]
+
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM checkouts WHERE depot_path = ? AND client = ? AND user = ?",
+                removed
+            )
+            self.connection.executemany(
+                "REPLACE INTO checkouts (depot_path, client, user, type, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                changed
+            )
+            self.write_meta()
+        self.rows = new_rows
+
+    def close(self):
+        if self.pending_meta:
+            with self.connection:
+                self.write_meta()
+        self.connection.close()
+
+
+def checkout_keys(open_files):
+    """Returns the (depot path, client, user) key of every checkout."""
+    return set(
+        (depot_path, checkout.client, checkout.user)
+        for depot_path, checkouts in open_files.items()
+        for checkout in checkouts
+    )
+
+
+def drop_orphaned_checkouts(open_files, clients, users):
+    """
+    Drops the checkouts held by clients or users that no longer exist on
+    the server, along with any paths left empty. Returns the number dropped.
+    """
+    dropped = 0
+    for depot_path in list(open_files):
+        checkouts = [
+            checkout for checkout in open_files[depot_path]
+            if checkout.client in clients and checkout.user in users
+        ]
+        dropped += len(open_files[depot_path]) - len(checkouts)
+        if checkouts:
+            open_files[depot_path] = checkouts
+        else:
+            del open_files[depot_path]
+    return dropped
+
+
+def compaction_due(state, now, interval=86400):
+    """Decides whether the last compaction of the state is interval seconds old."""
+    return now - json.loads(state.get_meta('compacted', '0')) >= interval
+
+
+def read_history(state):
+    """Returns the per day summary counts kept in the state store."""
+    return json.loads(state.get_meta('history', '{}'))
+
+
+def record_history(state, now, counts, keep_days=90):
+    """
+    Adds a run's counts to the summary for its day in the state store,
+    keeping the last keep_days days. The number of checkouts still open is
+    taken from the day's latest run rather than added up.
+    """
+    history = read_history(state)
+    day = time.strftime("%Y-%m-%d", time.localtime(now))
+    summary = history.setdefault(day, {})
+    for name, value in counts.items():
+        if name == 'open':
+            summary[name] = value
+        else:
+            summary[name] = summary.get(name, 0) + value
+
+    for old_day in sorted(history)[:max(len(history) - keep_days, 0)]:
+        del history[old_day]
+    state.set_meta('history', json.dumps(history, sort_keys=True))
+    return history
+
+
+def get_state_backend(data_path, backend="json", state_path=None):
+    """
+    Returns the state backend for a server. The sqlite backend keeps its
+    database beside the json data file unless state_path is given, and
+    imports that json file the first time it is used.
+    """
+    if backend == "sqlite":
+        db_path = state_path or os.path.splitext(data_path)[0] + ".db"
+        return SqliteStateBackend(db_path, legacy_path=data_path)
+    if backend != "json":
+        raise ValueError("Unknown state backend: {}".format(backend))
+    return JsonStateBackend(data_path)
@@ -3,10 +3,37 @@ from __future__ import print_function
 import json
 import re
 import os
-from datetime import datetime, timedelta
-from P4 import P4
+import time
+from datetime import datetime
+from functools import lru_cache
 import codecs
 
+from p4_timecop.kernel.checkout import Checkout
+
+LEGACY_TIMESTAMP_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+# P4Python is only imported once something actually talks to a server, so
+# config checks and replays of recorded snapshots run without loading it.
+P4 = None
+
+
+def import_p4():
+    """Imports the P4Python module on first use and returns it."""
+    global P4
+    import P4 as p4python
+    if P4 is None:
+        P4 = p4python.P4
+    return p4python
+
+
+def __getattr__(name):
+    """Resolves P4Exception, OutputHandler and RecordHandler on first access."""
+    if name in ('P4Exception', 'OutputHandler'):
+        return getattr(import_p4(), name)
+    if name == 'RecordHandler':
+        return record_handler_class()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
 
 def load_server_config(config_path="config.json"):
     return read_json(config_path)
@@ -23,6 +50,7 @@ def setup_server_connection(port=None, user=None, password=None, charset="none")
         print("passwd:", password)
         print('Password not provided, attempting to use local ticket')
 
+    import_p4()
     p4 = P4()
 
     p4.charset = charset
@@ -38,14 +66,46 @@ def setup_server_connection(port=None, user=None, password=None, charset="none")
     return p4
 
 
+@lru_cache(maxsize=None)
+def record_handler_class():
+    """
+    Defines the RecordHandler output handler, which needs P4Python's
+    OutputHandler as its base, the first time it is asked for.
+    """
+    OutputHandler = import_p4().OutputHandler
+
+    class RecordHandler(OutputHandler):
+        """
+        Hands each tagged record to a callback as it arrives instead of
+        letting P4 collect the whole result list in memory.
+        """
+
+        def __init__(self, callback):
+            OutputHandler.__init__(self)
+            self.callback = callback
+
+        def outputStat(self, stat):
+            self.callback(stat)
+            return OutputHandler.HANDLED
+
+    return RecordHandler
+
+
+def record_handler(callback):
+    """Creates a RecordHandler that passes each record to callback."""
+    return record_handler_class()(callback)
+
+
 def set_default(obj):
     """
-    Converts any set to a list type object.
+    Converts any set to a list type object, and checkout records to dicts.
     """
     if isinstance(obj, set):
         return list(obj)
+    elif isinstance(obj, Checkout):
+        return obj.to_dict()
     elif isinstance(obj, datetime):
-        return obj.strftime("%a %b %d %H:%M:%S %Y")
+        return to_epoch(obj)
     return obj
 
 
@@ -76,17 +136,52 @@ def write_log(lines=None, file_path=''):
         outfile.writelines(lines)
 
 
-def get_file_datetime(file_path, client, user, existing_data):
+def to_epoch(value):
+    """Converts a local datetime to whole epoch seconds."""
+    return int(time.mktime(value.timetuple()))
+
+
+def parse_timestamp(timestamp):
+    """
+    Converts a saved timestamp to whole epoch seconds. Timestamps are stored
+    as epoch seconds, but data written by older versions holds them as
+    "%a %b %d %H:%M:%S %Y" strings, which are converted once as they load.
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+    if isinstance(timestamp, datetime):
+        return to_epoch(timestamp)
+    if isinstance(timestamp, float) or timestamp.isdigit():
+        return int(timestamp)
+    return to_epoch(datetime.strptime(timestamp, LEGACY_TIMESTAMP_FORMAT))
+
+
+def build_checkout_index(existing_data):
+    """
+    Indexes the loaded checkouts' timestamps by (depot path, client, user).
+    """
+    checkout_index = {}
+    for file_path, checkouts in existing_data.items():
+        for checkout in checkouts:
+            checkout_index[(file_path, checkout.client, checkout.user)] = checkout.timestamp
+    return checkout_index
+
 
-    for checkout_data in existing_data.get(file_path, []):
-        if checkout_data['client'] == client and checkout_data['user'] == user:
-            return datetime.strptime(checkout_data['timestamp'], "%a %b %d %H:%M:%S %Y")
-    return datetime.now()
+def get_file_timestamp(file_path, client, user, checkout_index, now=None):
 
+    timestamp = checkout_index.get((file_path, client, user))
+    if timestamp is None:
+        return int(time.time()) if now is None else now
+    return timestamp
 
-def calc_limit(time_limit):
-    now = datetime.now()
+
+def calc_limit(time_limit, now=None):
+    """
+    Returns the epoch second before which a checkout has been held for
+    longer than the Day:Hour:Minute:Second time_limit.
+    """
+    now = int(time.time()) if now is None else now
     days, hours, minutes, seconds = time_limit.split(':')
-    delta = timedelta(days=int(days), hours=int(hours), minutes=int(minutes), seconds=(int(seconds)))
+    delta = ((int(days) * 24 + int(hours)) * 60 + int(minutes)) * 60 + int(seconds)
     limit = now - delta
-    return limit
\ No newline at end of file
+    return limit
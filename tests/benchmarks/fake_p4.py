@@ -0,0 +1,118 @@
+"""
+A scriptable stand-in for a P4 connection that generates a synthetic server
+with a configurable number of depots, clients, users and open files.
+"""
+
+from __future__ import print_function
+
+import random
+import time
+
+from p4_timecop.kernel.checkout import Checkout
+
+
+class FakeP4(object):
+    """
+    Answers the commands timecop issues from generated data. Every call to
+    run sleeps for latency seconds to simulate the round trip to the server.
+    """
+
+    def __init__(
+        self,
+        open_files=10000,
+        depots=10,
+        clients=500,
+        users=200,
+        multi_checkout_ratio=0.1,
+        exclusive_ratio=0.5,
+        groups=20,
+        latency=0.0,
+        seed=0,
+    ):
+        self.open_files = open_files
+        self.depots = depots
+        self.clients = clients
+        self.users = users
+        self.multi_checkout_ratio = multi_checkout_ratio
+        self.exclusive_ratio = exclusive_ratio
+        self.groups = groups
+        self.latency = latency
+        self.seed = seed
+        self.rpc_count = 0
+        self.is_connected = True
+
+    def opened_records(self):
+        """Yields the opened records, generated the same way on every call."""
+        rng = random.Random(self.seed)
+        unique_files = max(1, int(self.open_files * (1 - self.multi_checkout_ratio)))
+
+        for index in range(self.open_files):
+            file_index = index if index < unique_files else rng.randrange(unique_files)
+            user_index = rng.randrange(self.users)
+            file_type = 'binary+l' if rng.random() < self.exclusive_ratio else 'text'
+            yield {
+                'depotFile': '//depot{}/dir{}/file{}.uasset'.format(
+                    file_index % self.depots, file_index // 1000, file_index
+                ),
+                'type': file_type,
+                'client': 'ws_{}_{}'.format(user_index, rng.randrange(self.clients // self.users or 1)),
+                'user': 'user{}'.format(user_index),
+            }
+
+    def existing_data(self, now, known_ratio=0.5, max_age=3 * 86400):
+        """
+        Builds loaded checkout records for a share of the open files, with
+        epoch second timestamps spread over max_age seconds before now.
+        """
+        rng = random.Random(self.seed + 1)
+        existing_data = {}
+        for record in self.opened_records():
+            if rng.random() >= known_ratio:
+                continue
+            timestamp = now - rng.randrange(max_age)
+            existing_data.setdefault(record['depotFile'], []).append(
+                Checkout(record['type'], record['client'], record['user'], timestamp)
+            )
+        return existing_data
+
+    def run(self, *args, **kwargs):
+        self.rpc_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        command = args[0]
+        if command == 'opened':
+            return self.run_opened(args[1:], kwargs.get('handler'))
+        if command == 'revert':
+            return [{'depotFile': file_path} for file_path in args[3:]]
+        if command == 'groups':
+            return [
+                {'group': 'group{}'.format(index % self.groups), 'user': 'user{}'.format(index),
+                 'isSubGroup': '0', 'isOwner': '0', 'isUser': '1'}
+                for index in range(self.users)
+            ]
+        if command == 'depots':
+            return [{'name': 'depot{}'.format(index)} for index in range(self.depots)]
+        return []
+
+    def run_opened(self, args, handler=None):
+        exclusive_only = '-x' in args
+        prefixes = [arg.rstrip('.') for arg in args if arg.startswith('//')]
+
+        results = []
+        for record in self.opened_records():
+            if exclusive_only and '+l' not in record['type']:
+                continue
+            if prefixes and not any(record['depotFile'].startswith(prefix) for prefix in prefixes):
+                continue
+            if handler:
+                handler.outputStat(record)
+            else:
+                results.append(record)
+        return results
+
+    def connected(self):
+        return self.is_connected
+
+    def disconnect(self):
+        self.is_connected = False
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+"""
+Times the timecop pipeline stages against a synthetic server.
+
+    python tests/benchmarks/run_benchmarks.py --sizes 10000 100000 1000000
+
+Each stage is reported with its wall time, throughput in records per second
+and peak memory allocated while it ran. With --shards the opened query and
+reverts are also timed split by depot across that many pooled connections.
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from fake_p4 import FakeP4
+
+from p4_timecop.kernel.run_timecop import (
+    get_open_files_dict,
+    get_sharded_open_files,
+    check_open_files,
+    apply_filetype_filter,
+    perform_reverts,
+    perform_sharded_reverts,
+)
+from p4_timecop.kernel.state import get_state_backend
+from p4_timecop.kernel.connection import ConnectionPool
+
+
+def measure(stage, records, function, *args, **kwargs):
+    """Runs function once, returning its result and a stats dict for the stage."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = {
+        'stage': stage,
+        'records': records,
+        'seconds': elapsed,
+        'records_per_second': records / elapsed if elapsed else 0.0,
+        'peak_mb': peak / (1024.0 * 1024.0),
+    }
+    return result, stats
+
+
+def count_checkouts(data_dict):
+    return sum(len(checkouts) for checkouts in data_dict.values())
+
+
+def run_benchmark(size, latency=0.0, stream=False, backends=('json', 'sqlite'), shards=0):
+    """Runs every stage against a synthetic server with size open files."""
+    server = FakeP4(open_files=size, latency=latency)
+    now = int(time.time())
+    existing_data = server.existing_data(now)
+    time_limit = now - 86400
+    results = []
+
+    open_files, stats = measure(
+        'get_open_files_dict', size, get_open_files_dict, server, existing_data, stream=stream, now=now
+    )
+    results.append(stats)
+    checkouts = count_checkouts(open_files)
+
+    to_be_unlocked, stats = measure(
+        'check_open_files', checkouts, check_open_files, open_files, time_limit, set()
+    )
+    results.append(stats)
+    expired = count_checkouts(to_be_unlocked)
+
+    to_be_unlocked, stats = measure(
+        'apply_filetype_filter', expired, apply_filetype_filter, to_be_unlocked, "\\+[^l]*l"
+    )
+    results.append(stats)
+
+    _, stats = measure(
+        'perform_reverts', count_checkouts(to_be_unlocked), perform_reverts, server, to_be_unlocked
+    )
+    stats['rpc_count'] = server.rpc_count
+    results.append(stats)
+
+    if shards:
+        depot_shards = [
+            ['//depot{}/...'.format(depot) for depot in range(shard, server.depots, shards)]
+            for shard in range(shards)
+        ]
+        pool = ConnectionPool(lambda: FakeP4(open_files=size, latency=latency), size=shards)
+        _, stats = measure(
+            'get_sharded_open_files', size, get_sharded_open_files,
+            pool, depot_shards, existing_data, stream=stream, now=now
+        )
+        results.append(stats)
+        _, stats = measure(
+            'perform_sharded_reverts', count_checkouts(to_be_unlocked), perform_sharded_reverts,
+            pool, to_be_unlocked
+        )
+        results.append(stats)
+        pool.close()
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for backend in backends:
+            data_path = os.path.join(temp_dir, 'data_{}.json'.format(backend))
+            state = get_state_backend(data_path, backend)
+            _, stats = measure('state_write_{}'.format(backend), checkouts, state.save, open_files)
+            results.append(stats)
+            state.close()
+
+            state = get_state_backend(data_path, backend)
+            _, stats = measure('state_read_{}'.format(backend), checkouts, state.load)
+            results.append(stats)
+            state.close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+    return results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-s", "--sizes", nargs="+", default=["10000", "100000", "1000000"])
+    parser.add_argument("-l", "--latency", default="0")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--shards", default="0")
+    parser.add_argument("-o", "--output")
+
+    parsed_args = parser.parse_args()
+
+    report = {}
+    for size in parsed_args.sizes:
+        print("{} open files".format(size))
+        results = run_benchmark(
+            int(size), float(parsed_args.latency), parsed_args.stream, shards=int(parsed_args.shards)
+        )
+        for stats in results:
+            print("    {stage:<24} {seconds:>9.3f}s {records_per_second:>12.0f} rec/s {peak_mb:>9.1f} MB".format(**stats))
+        report[size] = results
+
+    if parsed_args.output:
+        with open(parsed_args.output, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import pytest
+
+from fake_p4 import FakeP4
+from run_benchmarks import run_benchmark
+
+
+def test_fake_p4_opened():
+    server = FakeP4(open_files=100, depots=4, multi_checkout_ratio=0.2)
+
+    records = server.run('opened', '-a')
+    paths = set(record['depotFile'] for record in records)
+
+    assert len(records) == 100
+    assert len(paths) < 100
+    assert records == list(server.opened_records())
+    assert server.rpc_count == 1
+
+
+def test_fake_p4_opened_narrowed():
+    server = FakeP4(open_files=100, depots=4)
+    streamed = []
+
+    class Handler(object):
+        def outputStat(self, record):
+            streamed.append(record)
+
+    result = server.run('opened', '-a', '-x', '//depot1/...', handler=Handler())
+
+    assert result == []
+    assert streamed
+    assert all(record['depotFile'].startswith('//depot1/') for record in streamed)
+    assert all('+l' in record['type'] for record in streamed)
+
+
+def test_fake_p4_existing_data():
+    now = 1708456705
+    server = FakeP4(open_files=100)
+
+    existing_data = server.existing_data(now, known_ratio=1.0)
+
+    assert sum(len(checkouts) for checkouts in existing_data.values()) == 100
+
+
+def test_run_benchmark():
+    results = run_benchmark(200)
+    stages = [stats['stage'] for stats in results]
+
+    assert stages == [
+        'get_open_files_dict',
+        'check_open_files',
+        'apply_filetype_filter',
+        'perform_reverts',
+        'state_write_json',
+        'state_read_json',
+        'state_write_sqlite',
+        'state_read_sqlite',
+    ]
+    assert all(stats['seconds'] >= 0 for stats in results)
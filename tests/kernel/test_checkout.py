@@ -0,0 +1,45 @@
+import pytest
+
+from p4_timecop.kernel.checkout import (
+    Checkout,
+    checkouts_from_data
+)
+
+NOW = 1708456705
+
+
+def test_checkout():
+    checkout = Checkout('binary+l', 'ws_' + 'a', 'rmaff' + 'esoli', NOW)
+
+    other = Checkout('binary' + '+l', 'ws_a', 'rmaffesoli', NOW)
+
+    assert checkout.client is other.client
+    assert checkout.user is other.user
+    assert checkout.type is other.type
+    assert not hasattr(checkout, '__dict__')
+    assert checkout == Checkout('binary+l', 'ws_a', 'rmaffesoli', NOW)
+    assert checkout != Checkout('binary+l', 'ws_a', 'rmaffesoli', NOW + 1)
+    assert checkout != checkout.to_dict()
+    assert repr(checkout) == "Checkout('binary+l', 'ws_a', 'rmaffesoli', 1708456705)"
+
+
+def test_checkout_dict_round_trip():
+    checkout_data = {'type': 'binary+l', 'client': 'ws_a', 'user': 'rmaffesoli', 'timestamp': NOW}
+
+    assert Checkout.from_dict(checkout_data).to_dict() == checkout_data
+
+
+def test_checkouts_from_data():
+    data = {
+        '//art/chair.fbx': [
+            {'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': NOW},
+            {'type': 'binary+l', 'client': 'ws_b', 'user': 'modeler', 'timestamp': NOW},
+        ]
+    }
+
+    assert checkouts_from_data(data) == {
+        '//art/chair.fbx': [
+            Checkout('binary+l', 'ws_a', 'painter', NOW),
+            Checkout('binary+l', 'ws_b', 'modeler', NOW),
+        ]
+    }
@@ -0,0 +1,171 @@
+import pytest
+import os
+
+from p4_timecop.kernel.config import (
+    validate_config,
+    validate_server,
+    resolve_path,
+    resolve_server_paths
+)
+
+SERVER = {'port': 'ssl:helix:1666', 'user': 'timecop', 'password': None, 'charset': 'none'}
+
+
+def test_validate_config():
+    config = {
+        'max_workers': 2,
+        'servers': {
+            'commit': {
+                'server': SERVER,
+                'file_lock_time_limit': '01:00:00:00',
+                'filetype_filter': '\\+[^l]*l',
+                'revert_chunk_size': 100,
+                'time_limit_policies': [
+                    {'path': '//art/...', 'time_limit': '00:08:00:00'},
+                    {'path': '//art/shared/...', 'exempt': True},
+                ],
+                'notify_method': 'smtp',
+                'notify_smtp': {'host': 'mail.studio.com', 'port': 587, 'starttls': True},
+            }
+        }
+    }
+
+    assert validate_config(config) == []
+
+
+@pytest.mark.parametrize(
+    "config,expected_errors",
+    [
+        ([], ["expected the config to be an object, got []"]),
+        ({}, ["servers: no servers are configured"]),
+        (
+            {
+                'servers': {
+                    'commit': {'server': SERVER, 'data_filepath': '../data.json'},
+                    'edge': {'server': SERVER, 'data_filepath': '../shared/../data.json', 'log_filepath': '../edge.txt'},
+                }
+            },
+            ["servers.edge.data_filepath: ../shared/../data.json is already used by servers.commit"]
+        ),
+        (
+            {
+                'servers': {
+                    'commit': {'server': SERVER, 'group_cache_filepath': '../groups.json'},
+                    'edge': {'server': SERVER, 'group_cache_filepath': '../groups.json'},
+                }
+            },
+            ["servers.edge.group_cache_filepath: ../groups.json is already used by servers.commit"]
+        ),
+        (
+            {'max_workers': 0, 'servers': {'commit': 'ssl:helix:1666'}},
+            [
+                "max_workers: expected a whole number of at least 1, got 0",
+                "servers.commit: expected an object, got 'ssl:helix:1666'",
+            ]
+        ),
+    ],
+)
+def test_validate_config_errors(config, expected_errors):
+    assert validate_config(config) == expected_errors
+
+
+@pytest.mark.parametrize(
+    "values,expected_errors",
+    [
+        ({}, ["servers.commit.server: missing connection settings"]),
+        ({'server': {'port': 'ssl:helix:1666'}}, ["servers.commit.server.user: missing"]),
+        (
+            {'server': SERVER, 'file_lock_time_limit': '1 day'},
+            ["servers.commit.file_lock_time_limit: expected a Day:Hour:Minute:Second time limit such as 01:00:00:00, got '1 day'"]
+        ),
+        (
+            {'server': SERVER, 'file_lock_timelimit': '01:00:00:00'},
+            ["servers.commit.file_lock_timelimit: unknown setting"]
+        ),
+        (
+            {'server': SERVER, 'user_filter': '(unclosed'},
+            ["servers.commit.user_filter: expected a valid regex (missing ), unterminated subpattern at position 0), got '(unclosed'"]
+        ),
+        (
+            {'server': SERVER, 'stream_opened': 'yes', 'revert_chunk_size': True},
+            [
+                "servers.commit.revert_chunk_size: expected a whole number of at least 1, got True",
+                "servers.commit.stream_opened: expected true or false, got 'yes'",
+            ]
+        ),
+        (
+            {'server': SERVER, 'history_days': 7.5, 'compaction_interval': -1},
+            [
+                "servers.commit.compaction_interval: expected a number of at least 0, got -1",
+                "servers.commit.history_days: expected a whole number of at least 0, got 7.5",
+            ]
+        ),
+        (
+            {'server': SERVER, 'state_backend': 'postgres'},
+            ["servers.commit.state_backend: expected one of json, sqlite, got 'postgres'"]
+        ),
+        (
+            {'server': SERVER, 'time_limit_policies': [{'path': '//art/...'}, 'exempt']},
+            [
+                'servers.commit.time_limit_policies[0]: needs a time_limit or "exempt": true',
+                "servers.commit.time_limit_policies[1]: expected an object, got 'exempt'",
+            ]
+        ),
+        (
+            {'server': SERVER, 'journal_columns': {'depotFile': -1}},
+            ["servers.commit.journal_columns.depotFile: expected a whole number of at least 0, got -1"]
+        ),
+        (
+            {'server': SERVER, 'shards': ['//art/...', ['//code/...', 7]], 'shard_workers': 0},
+            [
+                "servers.commit.shard_workers: expected a whole number of at least 1, got 0",
+                "servers.commit.shards: expected a list of depot paths, or lists of depot paths, got ['//art/...', ['//code/...', 7]]",
+            ]
+        ),
+        (
+            {'server': SERVER, 'shards': ['//art/...'], 'opened_paths': ['//code/...']},
+            ["servers.commit.shards: replaces opened_paths, set one or the other"]
+        ),
+        (
+            {'server': SERVER, 'notify_method': 'webhook'},
+            ["servers.commit.notify_webhook_url: needed by the webhook notify_method"]
+        ),
+        (
+            {'server': SERVER, 'notify_method': 'smtp', 'notify_smtp': {'hostname': 'mail'}},
+            ["servers.commit.notify_smtp.hostname: unknown setting"]
+        ),
+    ],
+)
+def test_validate_server(values, expected_errors):
+    assert validate_server('commit', values) == expected_errors
+
+
+def test_resolve_path():
+    assert resolve_path('../log.txt', '/opt/timecop/kernel') == '/opt/timecop/kernel/../log.txt'
+    assert resolve_path('/var/log/timecop.txt', '/opt/timecop/kernel') == '/var/log/timecop.txt'
+    assert resolve_path(None, '/opt/timecop/kernel') is None
+
+
+def test_resolve_server_paths():
+    base_dir = os.path.join(os.sep, 'opt', 'timecop', 'kernel')
+    values = {'server': SERVER, 'metrics_filepath': '/var/lib/timecop/metrics.json', 'journal_filepath': 'journal'}
+
+    resolved = resolve_server_paths(values, base_dir)
+
+    assert resolved == {
+        'server': SERVER,
+        'log_filepath': os.path.join(base_dir, '../log.txt'),
+        'data_filepath': os.path.join(base_dir, '../data.json'),
+        'metrics_filepath': '/var/lib/timecop/metrics.json',
+        'journal_filepath': os.path.join(base_dir, 'journal'),
+    }
+    assert 'log_filepath' not in values
+
+
+def test_resolve_server_paths_named():
+    base_dir = os.path.join(os.sep, 'opt', 'timecop', 'kernel')
+
+    resolved = resolve_server_paths({'server': SERVER, 'log_filepath': '/var/log/edge.txt'}, base_dir, 'edge')
+
+    assert resolved['log_filepath'] == '/var/log/edge.txt'
+    assert resolved['data_filepath'] == os.path.join(base_dir, '../data_edge.json')
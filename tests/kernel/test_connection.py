@@ -0,0 +1,187 @@
+import pytest
+import threading
+
+from p4_timecop.kernel.connection import (
+    is_transient_error,
+    CommandTimeout,
+    RetryingConnection,
+    ConnectionPool
+)
+from p4_timecop.kernel.utils import P4Exception
+
+
+class MockP4(object):
+    def __init__(self, errors=None, result=None):
+        self.errors = list(errors or [])
+        self.result = result if result is not None else ['result']
+        self.is_connected = True
+        self.run_count = 0
+        self.keep_alive = None
+
+    def run(self, *args, **kwargs):
+        self.run_count += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+    def connected(self):
+        return self.is_connected
+
+    def disconnect(self):
+        self.is_connected = False
+
+    def setbreak(self, keep_alive):
+        self.keep_alive = keep_alive
+
+
+@pytest.mark.parametrize(
+    "message,connected,expected_result",
+    [
+        ('TCP receive failed.\nread: socket: Connection reset by peer', True, True),
+        ('Your session has expired, please login again.', True, True),
+        ('file(s) not opened on this client.', True, False),
+        ('file(s) not opened on this client.', False, True),
+    ],
+)
+def test_is_transient_error(message, connected, expected_result):
+    connection = MockP4()
+    connection.is_connected = connected
+
+    assert is_transient_error(P4Exception(message), connection) == expected_result
+
+
+def test_command_timeout(mocker):
+    mocker.patch('p4_timecop.kernel.connection.time.time', return_value=100.0)
+    keep_alive = CommandTimeout()
+
+    assert keep_alive.isAlive()
+    keep_alive.deadline = 150.0
+    assert keep_alive.isAlive()
+    keep_alive.deadline = 50.0
+    assert not keep_alive.isAlive()
+
+
+def test_retrying_connection(mocker):
+    m_sleep = mocker.patch('p4_timecop.kernel.connection.time.sleep')
+    first = MockP4(errors=[P4Exception('TCP send failed.')])
+    second = MockP4(errors=[P4Exception('Partner exited unexpectedly.')])
+    third = MockP4()
+    fresh_connections = [second, third]
+
+    connection = RetryingConnection(first, lambda: fresh_connections.pop(0), backoff=1.0)
+
+    assert connection.run('opened', '-a') == ['result']
+    assert connection.retry_count == 2
+    assert connection.connection is third
+    assert not first.is_connected
+    assert m_sleep.call_args_list == [mocker.call(1.0), mocker.call(2.0)]
+
+
+def test_retrying_connection_gives_up(mocker):
+    mocker.patch('p4_timecop.kernel.connection.time.sleep')
+    errors = [P4Exception('TCP receive failed.') for _ in range(3)]
+    connection = RetryingConnection(MockP4(errors=errors), lambda: MockP4(errors=errors), retries=2)
+
+    with pytest.raises(P4Exception):
+        connection.run('opened', '-a')
+    assert connection.retry_count == 2
+
+
+def test_retrying_connection_permanent_error(mocker):
+    m_sleep = mocker.patch('p4_timecop.kernel.connection.time.sleep')
+    raw_connection = MockP4(errors=[P4Exception('Invalid option: -Z.')])
+    connection = RetryingConnection(raw_connection, lambda: MockP4())
+
+    with pytest.raises(P4Exception):
+        connection.run('opened', '-Z')
+    m_sleep.assert_not_called()
+    assert raw_connection.run_count == 1
+
+
+class QuietP4(MockP4):
+    """Leaves its errors on the connection, as P4 does at exception_level 0."""
+
+    def __init__(self, messages):
+        MockP4.__init__(self)
+        self.messages = messages
+
+    def run(self, *args, **kwargs):
+        self.run_count += 1
+        self.errors = self.messages
+        return self.result
+
+
+@pytest.mark.parametrize(
+    "messages,expected_retries",
+    [
+        (['TCP receive failed.'], 1),
+        (['//art/chair.fbx - can\'t revert, file is locked.'], 0),
+    ],
+)
+def test_retrying_connection_exception_level_0(mocker, messages, expected_retries):
+    mocker.patch('p4_timecop.kernel.connection.time.sleep')
+    connection = RetryingConnection(QuietP4(messages), lambda: QuietP4([]), retries=1)
+
+    assert connection.run('revert', '//art/chair.fbx', exception_level=0) == ['result']
+    assert connection.retry_count == expected_retries
+
+
+def test_retrying_connection_timeout():
+    raw_connection = MockP4()
+    connection = RetryingConnection(raw_connection, lambda: MockP4(), timeout=60)
+
+    connection.run('opened', '-a')
+
+    assert raw_connection.keep_alive is connection.keep_alive
+    assert connection.keep_alive.deadline is None
+    assert connection.connected()
+
+
+def test_connection_pool():
+    created = []
+
+    def connect():
+        created.append(MockP4())
+        return created[-1]
+
+    pool = ConnectionPool(connect, size=2)
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+    with pool.connection() as third:
+        assert third in (first, second)
+
+    assert len(created) == 2
+
+    pool.close()
+    assert not any(connection.is_connected for connection in created)
+
+
+def test_connection_pool_waits_for_idle():
+    pool = ConnectionPool(MockP4, size=1)
+    used = []
+
+    def worker():
+        with pool.connection() as connection:
+            used.append(connection)
+
+    with pool.connection() as held:
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+
+    thread.join(1)
+    assert used == [held]
+
+
+def test_connection_pool_connect_failure():
+    def connect():
+        raise P4Exception('Connect to server failed')
+
+    pool = ConnectionPool(connect, size=1)
+    with pytest.raises(P4Exception):
+        with pool.connection():
+            pass
+
+    assert pool.reserved == 0
@@ -0,0 +1,77 @@
+import pytest
+import json
+
+from p4_timecop.kernel.contention import (
+    read_contention_feed,
+    build_contention_index,
+    blocked_users,
+    split_contended
+)
+from p4_timecop.kernel.checkout import Checkout
+
+NOW = 1708456705
+
+
+def checkout(user):
+    return Checkout('binary+l', 'ws_' + user, user, NOW - 86400)
+
+
+def write_feed(feed_path, lines):
+    feed_path.write_text(''.join(
+        (line if isinstance(line, str) else json.dumps(line)) + '\n' for line in lines
+    ))
+
+
+def test_read_contention_feed(tmp_path):
+    feed_path = tmp_path / 'contention.jsonl'
+    write_feed(feed_path, [
+        {'depotFile': '//art/chair.fbx', 'user': 'modeler', 'time': NOW},
+        {'depotFile': '//art/old.fbx', 'user': 'modeler', 'time': NOW - 7200},
+        {'depotFile': '//art/table.fbx', 'user': 'rigger'},
+        {'user': 'rigger'},
+        'not json',
+    ])
+
+    results = list(read_contention_feed(str(feed_path), since=NOW - 3600))
+
+    assert results == [
+        ('//art/chair.fbx', 'modeler', NOW),
+        ('//art/table.fbx', 'rigger', None),
+    ]
+
+
+def test_read_contention_feed_missing(tmp_path):
+    assert list(read_contention_feed(str(tmp_path / 'missing.jsonl'))) == []
+    assert list(read_contention_feed(None)) == []
+
+
+def test_build_contention_index(tmp_path):
+    feed_path = tmp_path / 'contention.jsonl'
+    write_feed(feed_path, [
+        {'depotFile': '//art/chair.fbx', 'user': 'modeler', 'time': NOW},
+        {'depotFile': '//art/chair.fbx', 'user': 'rigger', 'time': NOW},
+        {'depotFile': '//art/chair.fbx', 'user': 'modeler', 'time': NOW},
+    ])
+
+    contention = build_contention_index(str(feed_path))
+
+    assert contention == {'//art/chair.fbx': {'modeler', 'rigger'}}
+    assert blocked_users(contention, '//art/chair.fbx', 'modeler') == {'rigger'}
+    assert blocked_users(contention, '//art/table.fbx', 'modeler') == set()
+
+
+def test_split_contended():
+    to_be_unlocked = {
+        '//art/chair.fbx': [checkout('painter')],
+        '//art/table.fbx': [checkout('painter')],
+        '//art/lamp.fbx': [checkout('modeler')],
+    }
+    contention = {'//art/chair.fbx': {'modeler'}, '//art/lamp.fbx': {'modeler'}}
+
+    contended, uncontended = split_contended(to_be_unlocked, contention)
+
+    assert contended == {'//art/chair.fbx': [checkout('painter')]}
+    assert uncontended == {
+        '//art/table.fbx': [checkout('painter')],
+        '//art/lamp.fbx': [checkout('modeler')],
+    }
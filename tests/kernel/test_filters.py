@@ -0,0 +1,58 @@
+import pytest
+
+from p4_timecop.kernel.filters import (
+    CachedMatcher,
+    translate_depot_pattern,
+    CheckoutFilter,
+    build_checkout_filter
+)
+from p4_timecop.kernel.checkout import Checkout
+
+
+def test_cached_matcher():
+    matcher = CachedMatcher("\\+[^l]*l")
+
+    assert matcher('binary+l')
+    assert matcher('binary+l')
+    assert not matcher('text')
+    assert matcher.results == {'binary+l': True, 'text': False}
+
+
+@pytest.mark.parametrize(
+    "pattern,file_path,expected_result",
+    [
+        ('//art/...', '//art/props/chair.fbx', True),
+        ('//art/*.fbx', '//art/chair.fbx', True),
+        ('//art/*.fbx', '//art/props/chair.fbx', False),
+        ('//art/....fbx', '//art/props/chair.fbx', True),
+        ('//code/...', '//art/props/chair.fbx', False),
+    ],
+)
+def test_translate_depot_pattern(pattern, file_path, expected_result):
+    regex = translate_depot_pattern(pattern) + '$'
+
+    assert bool(CachedMatcher(regex).regex.match(file_path)) == expected_result
+
+
+def test_checkout_filter():
+    checkout_filter = CheckoutFilter(
+        filetype_filter="\\+[^l]*l",
+        user_filter="^art_",
+        client_filter="_mainline$",
+        path_filters=['//art/...', '//shared/*.uasset']
+    )
+
+    assert checkout_filter.matches_path('//art/props/chair.fbx')
+    assert checkout_filter.matches_path('//shared/level.uasset')
+    assert not checkout_filter.matches_path('//shared/sub/level.uasset')
+    assert checkout_filter.matches(Checkout('binary+l', 'bob_mainline', 'art_bob', 0))
+    assert not checkout_filter.matches(Checkout('binary', 'bob_mainline', 'art_bob', 0))
+    assert not checkout_filter.matches(Checkout('binary+l', 'bob_mainline', 'bob', 0))
+    assert not checkout_filter.matches(Checkout('binary+l', 'bob_dev', 'art_bob', 0))
+
+
+def test_build_checkout_filter():
+    checkout_filter = build_checkout_filter({})
+
+    assert checkout_filter.matches_path('//any/path.txt')
+    assert checkout_filter.matches(Checkout('text', 'client', 'user', 0))
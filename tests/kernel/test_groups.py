@@ -0,0 +1,90 @@
+import pytest
+
+from p4_timecop.kernel.groups import (
+    fetch_group_memberships,
+    resolve_group_users,
+    resolve_groups,
+    resolve_ignored_groups
+)
+from p4_timecop.kernel.utils import read_json
+
+
+class MockP4(object):
+    def __init__(self, groups=None):
+        self.groups = groups or []
+        self.run_count = 0
+
+    def run(self, *args):
+        self.run_count += 1
+        return self.groups
+
+
+GROUP_RECORDS = [
+    {'group': 'artists', 'user': 'painter', 'isSubGroup': '0', 'isOwner': '0', 'isUser': '1'},
+    {'group': 'artists', 'user': 'lead', 'isSubGroup': '0', 'isOwner': '1', 'isUser': '0'},
+    {'group': 'artists', 'user': 'animators', 'isSubGroup': '1', 'isOwner': '0', 'isUser': '0'},
+    {'group': 'animators', 'user': 'rigger', 'isSubGroup': '0', 'isOwner': '0', 'isUser': '1'},
+    {'group': 'animators', 'user': 'artists', 'isSubGroup': '1', 'isOwner': '0', 'isUser': '0'},
+]
+
+
+def test_fetch_group_memberships():
+    result = fetch_group_memberships(MockP4(GROUP_RECORDS))
+
+    assert result == {
+        'artists': {'users': {'painter'}, 'subgroups': {'animators'}},
+        'animators': {'users': {'rigger'}, 'subgroups': {'artists'}},
+    }
+
+
+@pytest.mark.parametrize(
+    "group_name,expected_result",
+    [
+        ('artists', {'painter', 'rigger'}),
+        ('animators', {'painter', 'rigger'}),
+        ('missing', set()),
+    ],
+)
+def test_resolve_group_users(group_name, expected_result):
+    memberships = fetch_group_memberships(MockP4(GROUP_RECORDS))
+
+    assert resolve_group_users(memberships, group_name) == expected_result
+
+
+def test_resolve_ignored_groups_cache(tmp_path):
+    cache_path = str(tmp_path / 'groups.json')
+    server = MockP4(GROUP_RECORDS)
+
+    first = resolve_ignored_groups(server, ['animators'], cache_path=cache_path)
+    second = resolve_ignored_groups(server, ['animators'], cache_path=cache_path)
+
+    assert first == second == {'painter', 'rigger'}
+    assert server.run_count == 1
+    assert read_json(cache_path)['groups'] == {'animators': ['painter', 'rigger']}
+
+    resolve_ignored_groups(server, ['artists'], cache_path=cache_path)
+    assert server.run_count == 2
+
+    resolve_ignored_groups(server, ['artists'], cache_path=cache_path, cache_ttl=0)
+    assert server.run_count == 3
+
+
+def test_resolve_groups_keeps_cached_groups(tmp_path):
+    cache_path = str(tmp_path / 'groups.json')
+    server = MockP4(GROUP_RECORDS + [{'group': 'leads', 'user': 'lead', 'isSubGroup': '0', 'isUser': '1'}])
+
+    resolve_groups(server, ['animators'], cache_path=cache_path)
+    result = resolve_groups(server, ['leads'], cache_path=cache_path)
+
+    assert result == {'leads': {'lead'}}
+    assert sorted(read_json(cache_path)['groups']) == ['animators', 'leads']
+
+    resolve_groups(server, ['animators', 'leads'], cache_path=cache_path)
+    assert server.run_count == 2
+
+
+def test_resolve_ignored_groups_empty():
+    server = MockP4(GROUP_RECORDS)
+
+    assert resolve_ignored_groups(server, []) == set()
+    assert server.run_count == 0
@@ -0,0 +1,131 @@
+import pytest
+
+from p4_timecop.kernel.journal import (
+    split_journal_line,
+    read_journal_transactions,
+    load_open_files,
+    apply_journal_records,
+    update_from_journal,
+    journal_types_expired,
+    journal_end_offset
+)
+from p4_timecop.kernel.checkout import Checkout
+
+JOURNAL_LINES = [
+    '@pv@ 9 @db.working@ @//ws_a/path.fbx@ @//depot/path.fbx@ @ws_a@ @rmaffesoli@ 1 1 0 262403 1 0\n',
+    '@pv@ 9 @db.have@ @//ws_a/other.fbx@ @//depot/other.fbx@ 1 0 0\n',
+    '@ex@ 1234 1708456705\n',
+    '@dv@ 9 @db.working@ @//ws_b/gone.fbx@ @//depot/gone.fbx@ @ws_b@ @other_user@ 1 1 0 262403 1 0\n',
+    '@ex@ 1235 1708460305\n',
+]
+
+
+@pytest.mark.parametrize(
+    "line,expected_result",
+    [
+        ('@ex@ 1234 1708456705\n', ['ex', '1234', '1708456705']),
+        ('@pv@ 9 @db.working@ @//a b/c@@d@ 1\n', ['pv', '9', 'db.working', '//a b/c@d', '1']),
+        ('', []),
+    ],
+)
+def test_split_journal_line(line, expected_result):
+    assert split_journal_line(line) == expected_result
+
+
+def test_read_journal_transactions(tmp_path):
+    journal_path = tmp_path / 'journal'
+    journal_path.write_text(''.join(JOURNAL_LINES) + '@pv@ 9 @db.working@ @//ws_c/open.fbx@')
+
+    results = list(read_journal_transactions(str(journal_path)))
+
+    assert len(results) == 2
+    assert results[0][0] == 1708456705
+    assert results[0][1] == [('pv', '//depot/path.fbx', 'ws_a', 'rmaffesoli', '262403')]
+    assert results[1][1] == [('dv', '//depot/gone.fbx', 'ws_b', 'other_user', '262403')]
+    assert results[1][2] == len(''.join(JOURNAL_LINES).encode('utf-8'))
+
+
+def test_read_journal_transactions_rotated(tmp_path):
+    journal_path = tmp_path / 'journal'
+    journal_path.write_text(''.join(JOURNAL_LINES[:3]))
+
+    results = list(read_journal_transactions(str(journal_path), offset=100000))
+
+    assert len(results) == 1
+
+
+def test_read_journal_transactions_missing(tmp_path):
+    assert list(read_journal_transactions(str(tmp_path / 'missing'))) == []
+
+
+def test_load_open_files():
+    existing_data = {
+        '//depot/path.fbx': [Checkout('binary+l', 'ws_a', 'rmaffesoli', 1708456705)]
+    }
+
+    result = load_open_files(existing_data)
+    result['//depot/path.fbx'].append(Checkout('binary+l', 'ws_b', 'other_user', 1708456705))
+
+    assert result['//depot/path.fbx'][0] is existing_data['//depot/path.fbx'][0]
+    assert len(existing_data['//depot/path.fbx']) == 1
+
+
+def test_apply_journal_records():
+    existing_date = 1708282800
+    transaction_time = 1708456705
+    open_files = {
+        '//depot/kept.fbx': [
+            Checkout('binary+l', 'ws_a', 'rmaffesoli', existing_date)
+        ],
+        '//depot/gone.fbx': [
+            Checkout('binary+l', 'ws_b', 'other_user', existing_date)
+        ],
+    }
+    records = [
+        ('rv', '//depot/kept.fbx', 'ws_a', 'rmaffesoli', '262403'),
+        ('dv', '//depot/gone.fbx', 'ws_b', 'other_user', '262403'),
+        ('pv', '//depot/new.fbx', 'ws_a', 'rmaffesoli', '262403'),
+    ]
+
+    apply_journal_records(open_files, records, transaction_time)
+
+    assert open_files == {
+        '//depot/kept.fbx': [
+            Checkout('binary+l', 'ws_a', 'rmaffesoli', existing_date)
+        ],
+        '//depot/new.fbx': [
+            Checkout('262403', 'ws_a', 'rmaffesoli', transaction_time)
+        ],
+    }
+
+
+def test_update_from_journal(tmp_path):
+    journal_path = tmp_path / 'journal'
+    journal_path.write_text(''.join(JOURNAL_LINES))
+    open_files = {}
+
+    offset = update_from_journal(open_files, str(journal_path))
+
+    assert offset == journal_end_offset(str(journal_path))
+    assert list(open_files) == ['//depot/path.fbx']
+    assert open_files['//depot/path.fbx'][0].timestamp == 1708456705
+
+
+@pytest.mark.parametrize(
+    "expire_before,expected_result",
+    [
+        (1708456704, False),
+        (1708456705, True),
+    ],
+)
+def test_journal_types_expired(expire_before, expected_result):
+    open_files = {
+        '//depot/scanned.fbx': [Checkout('binary+l', 'ws_a', 'rmaffesoli', 1708282800)],
+        '//depot/journal.fbx': [Checkout('262403', 'ws_a', 'rmaffesoli', 1708456705)],
+    }
+
+    assert journal_types_expired(open_files, expire_before) == expected_result
+
+
+def test_journal_end_offset(tmp_path):
+    assert journal_end_offset(str(tmp_path / 'missing')) == 0
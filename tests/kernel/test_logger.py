@@ -0,0 +1,120 @@
+import pytest
+import json
+import os
+
+from p4_timecop.kernel.logger import (
+    RunLog,
+    create_run_log
+)
+
+import datetime
+import time
+
+
+class mydatetime(datetime.datetime):
+    @classmethod
+    def now(cls):
+        return datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
+
+
+def test_run_log_text(mocker, tmp_path):
+    mocker.patch('p4_timecop.kernel.logger.datetime', mydatetime)
+    log_path = str(tmp_path / 'log.txt')
+    run_log = RunLog(log_path)
+
+    run_log.event('reverted', '//a/file.txt has been force reverted from user@client.', file='//a/file.txt')
+    run_log.event('completed', 'Auto Unlock Completed.')
+    assert not os.path.exists(log_path)
+
+    run_log.flush()
+
+    with open(log_path) as log_file:
+        assert log_file.readlines() == [
+            'Tue Feb 20 19:18:25 2024: //a/file.txt has been force reverted from user@client.\n',
+            'Tue Feb 20 19:18:25 2024: Auto Unlock Completed.\n',
+        ]
+    assert run_log.lines == []
+
+
+def test_run_log_json_lines(mocker, tmp_path):
+    mocker.patch('p4_timecop.kernel.logger.datetime', mydatetime)
+    log_path = str(tmp_path / 'log.jsonl')
+    run_log = RunLog(log_path, json_lines=True)
+
+    run_log.event('reverted', 'reverted message', file='//a/file.txt', user='user', client='client')
+    run_log.flush()
+
+    with open(log_path) as log_file:
+        record = json.loads(log_file.readline())
+    assert record == {
+        'time': '2024-02-20T19:18:25',
+        'event': 'reverted',
+        'message': 'reverted message',
+        'file': '//a/file.txt',
+        'user': 'user',
+        'client': 'client',
+    }
+
+
+def test_run_log_run_time(tmp_path):
+    log_path = str(tmp_path / 'log.txt')
+    now = datetime.datetime(2024, 2, 20, 19, 18, 25)
+    run_log = RunLog(log_path, now=int(time.mktime(now.timetuple())))
+
+    run_log.event('completed', 'Auto Unlock Completed.')
+
+    assert run_log.lines == ['Tue Feb 20 19:18:25 2024: Auto Unlock Completed.\n']
+
+
+def test_run_log_size_rotation(tmp_path):
+    log_path = str(tmp_path / 'log.txt')
+    run_log = RunLog(log_path, max_bytes=10, backup_count=2)
+
+    for index in range(3):
+        run_log.event('completed', 'run {}'.format(index))
+        run_log.flush()
+
+    assert sorted(os.listdir(str(tmp_path))) == ['log.txt', 'log.txt.1', 'log.txt.2']
+    with open(log_path) as log_file:
+        assert log_file.read().endswith('run 2\n')
+    with open(log_path + '.2') as log_file:
+        assert log_file.read().endswith('run 0\n')
+
+
+@pytest.mark.parametrize(
+    "first_line,should_rotate",
+    [
+        ('Sun Feb 18 19:18:25 2024: Auto Unlock Completed.\n', True),
+        ('Tue Feb 20 19:00:00 2024: Auto Unlock Completed.\n', False),
+        ('{"event": "completed", "time": "2024-02-18T19:18:25.000001"}\n', True),
+        ('not a log line\n', False),
+    ],
+)
+def test_run_log_time_rotation(mocker, tmp_path, first_line, should_rotate):
+    mocker.patch('p4_timecop.kernel.logger.datetime', mydatetime)
+    log_path = tmp_path / 'log.txt'
+    log_path.write_text(first_line)
+    run_log = RunLog(str(log_path), rotate_interval=86400)
+
+    assert run_log.should_rotate() == should_rotate
+
+
+def test_run_log_rotation_without_backups(tmp_path):
+    log_path = tmp_path / 'log.txt'
+    log_path.write_text('old contents\n')
+    run_log = RunLog(str(log_path), max_bytes=1, backup_count=0)
+
+    run_log.event('completed', 'new contents')
+    run_log.flush()
+
+    assert os.listdir(str(tmp_path)) == ['log.txt']
+    assert log_path.read_text().endswith('new contents\n')
+
+
+def test_create_run_log():
+    run_log = create_run_log('log.txt', {'log_format': 'json', 'log_max_bytes': 1024, 'log_backup_count': 3})
+
+    assert run_log.json_lines
+    assert run_log.max_bytes == 1024
+    assert run_log.rotate_interval is None
+    assert run_log.backup_count == 3
@@ -0,0 +1,108 @@
+import pytest
+import json
+
+from p4_timecop.kernel.metrics import (
+    RunMetrics,
+    InstrumentedConnection
+)
+
+
+class MockP4(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.port = 'ssl:helix:1666'
+
+    def run(self, *args, **kwargs):
+        if self.error:
+            raise self.error
+        return ['result']
+
+
+def test_run_metrics():
+    metrics = RunMetrics('commit')
+
+    with metrics.stage('opened'):
+        pass
+    with metrics.stage('opened'):
+        pass
+    metrics.count('scanned', 10)
+    metrics.count('scanned', 5)
+    metrics.record_rpc('opened', 0.5)
+    metrics.record_rpc('opened', 0.25, failed=True)
+
+    result = metrics.to_dict()
+
+    assert result['server'] == 'commit'
+    assert list(result['stages']) == ['opened']
+    assert result['counts'] == {'scanned': 15}
+    assert result['rpcs'] == {'opened': {'calls': 2, 'seconds': 0.75, 'errors': 1}}
+
+
+def test_run_metrics_prometheus():
+    metrics = RunMetrics('commit')
+    metrics.count('reverted', 3)
+    metrics.record_rpc('revert', 0.5)
+
+    result = metrics.to_prometheus()
+
+    assert 'timecop_records{server="commit",kind="reverted"} 3\n' in result
+    assert 'timecop_rpc_calls{server="commit",command="revert"} 1\n' in result
+    assert 'timecop_rpc_duration_seconds{server="commit",command="revert"} 0.500000\n' in result
+
+
+def test_run_metrics_prometheus_families_grouped():
+    metrics = RunMetrics('commit')
+    metrics.record_rpc('opened', 1.0)
+    metrics.record_rpc('revert', 0.5, failed=True)
+
+    lines = metrics.to_prometheus().splitlines()
+
+    families = []
+    for line in lines:
+        family = line.split()[2] if line.startswith('# TYPE') else line.split('{')[0]
+        if not families or families[-1] != family:
+            families.append(family)
+    assert len(families) == len(set(families))
+    start = lines.index('# TYPE timecop_rpc_errors gauge')
+    assert lines[start:start + 3] == [
+        '# TYPE timecop_rpc_errors gauge',
+        'timecop_rpc_errors{server="commit",command="opened"} 0',
+        'timecop_rpc_errors{server="commit",command="revert"} 1',
+    ]
+
+
+@pytest.mark.parametrize("metrics_format", ["json", "prometheus"])
+def test_run_metrics_write(tmp_path, metrics_format):
+    output_path = str(tmp_path / 'metrics')
+    metrics = RunMetrics('commit')
+    metrics.count('scanned', 1)
+
+    metrics.write(output_path, metrics_format)
+
+    with open(output_path) as metrics_file:
+        content = metrics_file.read()
+    if metrics_format == 'json':
+        assert json.loads(content)['counts'] == {'scanned': 1}
+    else:
+        assert 'timecop_records{server="commit",kind="scanned"} 1' in content
+    assert not (tmp_path / 'metrics.tmp').exists()
+
+
+def test_instrumented_connection():
+    metrics = RunMetrics('commit')
+    connection = InstrumentedConnection(MockP4(), metrics)
+
+    assert connection.run('opened', '-a') == ['result']
+    assert connection.port == 'ssl:helix:1666'
+    assert metrics.rpcs['opened']['calls'] == 1
+    assert metrics.rpcs['opened']['errors'] == 0
+
+
+def test_instrumented_connection_error():
+    metrics = RunMetrics('commit')
+    connection = InstrumentedConnection(MockP4(error=RuntimeError('offline')), metrics)
+
+    with pytest.raises(RuntimeError):
+        connection.run('revert', '-C', 'client', '//a/file.txt')
+
+    assert metrics.rpcs['revert']['errors'] == 1
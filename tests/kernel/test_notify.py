@@ -0,0 +1,175 @@
+import pytest
+import json
+
+from p4_timecop.kernel.notify import (
+    format_duration,
+    group_by_user,
+    build_notice,
+    SmtpNotifier,
+    WebhookNotifier,
+    SpoolNotifier,
+    get_notifier,
+    lookup_emails,
+    send_notices
+)
+from p4_timecop.kernel.state import JsonStateBackend
+from p4_timecop.kernel.checkout import Checkout
+from p4_timecop.kernel.utils import P4Exception
+
+NOW = 1708456705
+EXPIRING = {
+    '//art/chair.fbx': [
+        (Checkout('binary+l', 'ws_a', 'painter', NOW - 80000), 6400),
+        (Checkout('binary+l', 'ws_b', 'modeler', NOW - 85000), 1400),
+    ],
+    '//art/table.fbx': [
+        (Checkout('binary+l', 'ws_a', 'painter', NOW - 86000), 400),
+    ],
+}
+
+
+class MockP4(object):
+    def __init__(self, users=None, error=None):
+        self.users = users or []
+        self.error = error
+        self.calls = []
+
+    def run(self, *args, **kwargs):
+        self.calls.append(args)
+        if self.error:
+            raise self.error
+        return self.users
+
+
+class MockNotifier(object):
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.sent = []
+
+    def send(self, notice):
+        if notice['user'] in self.failing:
+            raise OSError('connection refused')
+        self.sent.append(notice)
+
+
+@pytest.mark.parametrize(
+    "seconds,expected",
+    [
+        (0, '0m'),
+        (-30, '0m'),
+        (400, '6m'),
+        (7260, '2h 1m'),
+        (90000, '1d 1h'),
+    ],
+)
+def test_format_duration(seconds, expected):
+    assert format_duration(seconds) == expected
+
+
+def test_group_by_user():
+    user_files = group_by_user(EXPIRING)
+
+    assert sorted(user_files) == ['modeler', 'painter']
+    assert [entry[0] for entry in user_files['painter']] == ['//art/table.fbx', '//art/chair.fbx']
+
+
+def test_build_notice():
+    entries = group_by_user(EXPIRING)['painter']
+
+    notice = build_notice('commit', 'painter', entries, 'painter@studio.com', max_files=1)
+
+    assert notice['email'] == 'painter@studio.com'
+    assert notice['subject'] == '[timecop] 2 locked files on commit will be reverted soon'
+    assert '  //art/table.fbx (ws_a) in about 6m\n' in notice['body']
+    assert '//art/chair.fbx' not in notice['body']
+    assert '... and 1 more' in notice['body']
+    assert len(notice['files']) == 2
+
+
+def test_smtp_notifier(mocker):
+    m_smtp = mocker.patch('smtplib.SMTP')
+    notifier = SmtpNotifier('mail.studio.com', 587, 'timecop@studio.com', 'timecop', 'secret', starttls=True)
+    notice = build_notice('commit', 'painter', group_by_user(EXPIRING)['painter'], 'painter@studio.com')
+
+    notifier.send(notice)
+
+    m_smtp.assert_called_once_with('mail.studio.com', 587)
+    smtp = m_smtp.return_value.__enter__.return_value
+    smtp.starttls.assert_called_once()
+    smtp.login.assert_called_once_with('timecop', 'secret')
+    message = smtp.send_message.call_args[0][0]
+    assert message['To'] == 'painter@studio.com'
+    assert message['Subject'] == notice['subject']
+
+    with pytest.raises(ValueError):
+        notifier.send(dict(notice, email=None))
+
+
+def test_webhook_notifier(mocker):
+    m_urlopen = mocker.patch('urllib.request.urlopen')
+    notice = build_notice('commit', 'painter', group_by_user(EXPIRING)['painter'])
+
+    WebhookNotifier('https://hooks.studio.com/timecop').send(notice)
+
+    request = m_urlopen.call_args[0][0]
+    assert request.full_url == 'https://hooks.studio.com/timecop'
+    assert json.loads(request.data.decode('utf-8')) == notice
+
+
+def test_spool_notifier(tmp_path):
+    spool_path = str(tmp_path / 'spool')
+    notice = build_notice('commit', 'painter', group_by_user(EXPIRING)['painter'])
+
+    SpoolNotifier(spool_path).send(notice)
+
+    with open(str(tmp_path / 'spool' / 'commit_painter.json')) as notice_file:
+        assert json.load(notice_file) == notice
+
+
+@pytest.mark.parametrize(
+    "config,expected_type",
+    [
+        ({}, type(None)),
+        ({'notify_method': 'smtp', 'notify_smtp': {'host': 'mail.studio.com'}}, SmtpNotifier),
+        ({'notify_method': 'webhook', 'notify_webhook_url': 'https://hooks.studio.com'}, WebhookNotifier),
+        ({'notify_method': 'spool', 'notify_spool_dirpath': '../spool'}, SpoolNotifier),
+    ],
+)
+def test_get_notifier(config, expected_type):
+    assert isinstance(get_notifier(config), expected_type)
+
+
+def test_get_notifier_unknown():
+    with pytest.raises(ValueError):
+        get_notifier({'notify_method': 'carrier_pigeon'})
+
+
+def test_lookup_emails():
+    server = MockP4([{'User': 'painter', 'Email': 'painter@studio.com'}, 'warning'])
+
+    assert lookup_emails(server, {'painter', 'modeler'}) == {'painter': 'painter@studio.com'}
+    assert server.calls == [('users', 'modeler', 'painter')]
+    assert lookup_emails(MockP4(error=P4Exception('no such user')), {'painter'}) == {}
+
+
+def test_send_notices_throttled(tmp_path):
+    state = JsonStateBackend(str(tmp_path / 'data.json'))
+    server = MockP4([{'User': 'painter', 'Email': 'painter@studio.com'}])
+    notifier = MockNotifier(failing=('modeler',))
+
+    sent = send_notices(server, 'commit', EXPIRING, notifier, state, NOW, interval=3600)
+
+    assert [notice['user'] for notice in sent] == ['painter']
+    assert sent[0]['email'] == 'painter@studio.com'
+    assert json.loads(state.get_meta('notified')) == {'painter': NOW}
+
+    notifier.failing = ()
+    sent = send_notices(server, 'commit', EXPIRING, notifier, state, NOW + 600, interval=3600)
+
+    assert [notice['user'] for notice in sent] == ['modeler']
+
+    sent = send_notices(server, 'commit', EXPIRING, notifier, state, NOW + 3600, interval=3600)
+
+    assert [notice['user'] for notice in sent] == ['painter']
+    assert json.loads(state.get_meta('notified')) == {'modeler': NOW + 600, 'painter': NOW + 3600}
+    assert len(notifier.sent) == 3
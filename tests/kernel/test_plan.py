@@ -0,0 +1,62 @@
+import pytest
+
+from p4_timecop.kernel.plan import (
+    average_revert_latency,
+    build_unlock_plan,
+    write_plan
+)
+from p4_timecop.kernel.utils import read_json, write_json
+from p4_timecop.kernel.checkout import Checkout
+
+
+def checkout(client):
+    return Checkout('binary+l', client, 'rmaffesoli', 1708370305)
+
+
+def test_average_revert_latency(tmp_path):
+    metrics_path = str(tmp_path / 'metrics.json')
+    write_json({'rpcs': {'revert': {'calls': 4, 'seconds': 2.0, 'errors': 0}}}, metrics_path)
+
+    assert average_revert_latency(metrics_path) == 0.5
+    assert average_revert_latency(str(tmp_path / 'missing.json')) is None
+    assert average_revert_latency(None) is None
+
+
+def test_average_revert_latency_unreadable(tmp_path):
+    metrics_path = tmp_path / 'metrics.prom'
+    metrics_path.write_text('timecop_records{server="commit",kind="scanned"} 1\n')
+
+    assert average_revert_latency(str(metrics_path)) is None
+
+
+def test_build_unlock_plan():
+    time_limit = 1708370305
+    to_be_unlocked = {
+        '//a/file1.txt': [checkout('client_a'), checkout('client_b')],
+        '//a/file2.txt': [checkout('client_a')],
+        '//a/file3.txt': [checkout('client_a')],
+    }
+
+    plan = build_unlock_plan('commit', to_be_unlocked, time_limit, chunk_size=2, revert_latency=0.5)
+
+    assert plan['files'] == 3
+    assert plan['checkouts'] == 4
+    assert plan['clients'] == {
+        'client_a': {'checkouts': 3, 'rpcs': 2},
+        'client_b': {'checkouts': 1, 'rpcs': 1},
+    }
+    assert plan['estimated_rpcs'] == 3
+    assert plan['estimated_seconds'] == 1.5
+    assert plan['reverts'] is to_be_unlocked
+
+
+def test_write_plan(tmp_path):
+    plan_path = str(tmp_path / 'plan.json')
+    plan = build_unlock_plan('commit', {'//a/file1.txt': [checkout('client_a')]}, 1708370305)
+
+    write_plan(plan, plan_path)
+
+    result = read_json(plan_path)
+    assert result['time_limit'] == 1708370305
+    assert result['reverts'] == {'//a/file1.txt': [checkout('client_a').to_dict()]}
+    assert result['estimated_seconds'] is None
@@ -0,0 +1,100 @@
+import pytest
+
+from p4_timecop.kernel.policies import (
+    split_depot_prefix,
+    Policy,
+    PolicyIndex,
+    policy_group_names,
+    build_policy_index
+)
+from p4_timecop.kernel.checkout import Checkout
+
+NOW = 1708456705
+
+
+def checkout(user='painter', file_type='binary+l'):
+    return Checkout(file_type, 'ws_' + user, user, NOW)
+
+
+@pytest.mark.parametrize(
+    "path_prefix,expected_result",
+    [
+        ('//art/...', ['', '', 'art']),
+        ('//art/', ['', '', 'art']),
+        ('//art/chars', ['', '', 'art', 'chars']),
+        ('//...', []),
+        (None, []),
+    ],
+)
+def test_split_depot_prefix(path_prefix, expected_result):
+    assert split_depot_prefix(path_prefix) == expected_result
+
+
+def test_policy_matches():
+    policy = Policy(limit=NOW, filetype='\\+[^l]*l', users={'lead'})
+
+    assert policy.matches(checkout('lead'))
+    assert not policy.matches(checkout('painter'))
+    assert not policy.matches(checkout('lead', 'binary'))
+    assert Policy(limit=NOW).matches(checkout())
+
+
+def test_policy_index_longest_prefix():
+    index = PolicyIndex()
+    everything = Policy(name='everything')
+    art = Policy(name='art')
+    chars = Policy(name='chars')
+    index.add('//...', everything)
+    index.add('//art/...', art)
+    index.add('//art/chars/...', chars)
+
+    assert index.candidates('//art/chars/hero.fbx') == [chars, art, everything]
+    assert index.candidates('//art/charset.fbx') == [art, everything]
+    assert index.candidates('//code/main.cpp') == [everything]
+
+
+def test_policy_index_specificity():
+    index = PolicyIndex()
+    plain = Policy(name='plain')
+    leads = Policy(users={'lead'}, name='leads')
+    index.add('//art/...', plain)
+    index.add('//art/...', leads)
+
+    candidates = index.candidates('//art/chair.fbx')
+
+    assert candidates == [leads, plain]
+    assert index.resolve(candidates, checkout('lead')) is leads
+    assert index.resolve(candidates, checkout('painter')) is plain
+    assert index.resolve(PolicyIndex().candidates('//art/chair.fbx'), checkout()) is None
+
+
+def test_policy_group_names():
+    rules = [{'group': 'leads'}, {'path': '//art/...'}, {'group': 'artists'}, {'group': 'leads'}]
+
+    assert policy_group_names(rules) == ['artists', 'leads']
+
+
+def test_build_policy_index():
+    index = build_policy_index(
+        [
+            {'path': '//art/...', 'time_limit': '00:08:00:00'},
+            {'path': '//art/shared/...', 'exempt': True},
+            {'group': 'missing', 'time_limit': '03:00:00:00'},
+        ],
+        NOW,
+    )
+
+    art = index.candidates('//art/chair.fbx')[0]
+    shared = index.candidates('//art/shared/palette.png')[0]
+    fallback = index.candidates('//code/main.cpp')[0]
+
+    assert art.limit == NOW - 8 * 3600
+    assert shared.exempt and shared.limit is None
+    assert fallback.users == set()
+    assert not fallback.matches(checkout())
+    assert sorted(index.limits()) == [NOW - 3 * 86400, NOW - 8 * 3600]
+
+
+def test_build_policy_index_invalid():
+    with pytest.raises(ValueError):
+        build_policy_index([{'path': '//art/...'}], NOW)
@@ -0,0 +1,75 @@
+import pytest
+
+from p4_timecop.kernel.scheduler import (
+    count_contention,
+    schedule_reverts
+)
+from p4_timecop.kernel.checkout import Checkout
+
+OLDEST = 1708197505
+OLDER = 1708283905
+
+
+def checkout(user, timestamp):
+    return Checkout('binary+l', 'ws_' + user, user, timestamp)
+
+
+OPEN_FILES = {
+    '//art/quiet.fbx': [checkout('painter', OLDER)],
+    '//art/contended.fbx': [checkout('modeler', OLDER), checkout('rigger', OLDER), checkout('animator', OLDER)],
+    '//art/oldest.fbx': [checkout('painter', OLDEST)],
+}
+
+
+def test_count_contention():
+    assert count_contention(OPEN_FILES, '//art/contended.fbx', 'modeler') == 2
+    assert count_contention(OPEN_FILES, '//art/quiet.fbx', 'painter') == 0
+    assert count_contention(OPEN_FILES, '//art/missing.fbx', 'painter') == 0
+
+
+def test_count_contention_blocked():
+    contention = {'//art/quiet.fbx': {'painter', 'modeler', 'rigger'}, '//art/contended.fbx': {'rigger'}}
+
+    assert count_contention(OPEN_FILES, '//art/quiet.fbx', 'painter', contention) == 2
+    assert count_contention(OPEN_FILES, '//art/contended.fbx', 'modeler', contention) == 2
+
+
+def test_schedule_reverts():
+    to_be_unlocked = {
+        '//art/quiet.fbx': [checkout('painter', OLDER)],
+        '//art/contended.fbx': [checkout('modeler', OLDER)],
+        '//art/oldest.fbx': [checkout('painter', OLDEST)],
+    }
+
+    scheduled, deferred = schedule_reverts(to_be_unlocked, OPEN_FILES)
+
+    assert list(scheduled) == ['//art/oldest.fbx', '//art/contended.fbx', '//art/quiet.fbx']
+    assert deferred == {}
+
+
+def test_schedule_reverts_limited():
+    to_be_unlocked = {
+        '//art/quiet.fbx': [checkout('painter', OLDER)],
+        '//art/contended.fbx': [checkout('modeler', OLDER)],
+        '//art/oldest.fbx': [checkout('painter', OLDEST)],
+    }
+
+    scheduled, deferred = schedule_reverts(to_be_unlocked, OPEN_FILES, max_reverts=2)
+
+    assert scheduled == {
+        '//art/oldest.fbx': [checkout('painter', OLDEST)],
+        '//art/contended.fbx': [checkout('modeler', OLDER)],
+    }
+    assert deferred == {'//art/quiet.fbx': [checkout('painter', OLDER)]}
+
+
+def test_schedule_reverts_blocked():
+    to_be_unlocked = {
+        '//art/quiet.fbx': [checkout('painter', OLDER)],
+        '//art/contended.fbx': [checkout('modeler', OLDER)],
+    }
+    contention = {'//art/quiet.fbx': {'rigger', 'animator', 'lighter'}}
+
+    scheduled, _ = schedule_reverts(to_be_unlocked, OPEN_FILES, contention=contention)
+
+    assert list(scheduled) == ['//art/quiet.fbx', '//art/contended.fbx']
@@ -0,0 +1,123 @@
+import pytest
+import gzip
+import json
+
+from p4_timecop.kernel.snapshot import (
+    iter_snapshot_records,
+    read_snapshot_header,
+    snapshot_time,
+    SnapshotRecorder,
+    SnapshotServer
+)
+
+SNAPSHOT_RECORDS = [
+    ['opened', {'depotFile': '//art/chair.fbx', 'type': 'binary+Fl', 'client': 'ws_a', 'user': 'painter'}],
+    ['opened', {'depotFile': '//code/main.cpp', 'type': 'text', 'client': 'ws_b', 'user': 'coder'}],
+    ['groups', {'group': 'artists', 'user': 'painter', 'isSubGroup': '0', 'isOwner': '0', 'isUser': '1'}],
+]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / 'snapshot.jsonl.gz')
+    with gzip.open(path, 'wt', encoding='utf-8') as snapshot_file:
+        for record in SNAPSHOT_RECORDS:
+            snapshot_file.write(json.dumps(record) + '\n')
+    return path
+
+
+def test_iter_snapshot_records(snapshot_path):
+    assert list(iter_snapshot_records(snapshot_path)) == [tuple(record) for record in SNAPSHOT_RECORDS]
+    assert len(list(iter_snapshot_records(snapshot_path, 'opened'))) == 2
+
+
+@pytest.mark.parametrize(
+    "args,expected_paths",
+    [
+        (('opened', '-a'), ['//art/chair.fbx', '//code/main.cpp']),
+        (('opened', '-a', '-x'), ['//art/chair.fbx']),
+        (('opened', '-a', '//code/...'), ['//code/main.cpp']),
+    ],
+)
+def test_snapshot_server_opened(snapshot_path, args, expected_paths):
+    server = SnapshotServer(snapshot_path)
+
+    result = server.run(*args)
+
+    assert [record['depotFile'] for record in result] == expected_paths
+
+
+def test_snapshot_server_opened_handler(snapshot_path):
+    streamed = []
+
+    class Handler(object):
+        def outputStat(self, record):
+            streamed.append(record)
+
+    server = SnapshotServer(snapshot_path)
+
+    assert server.run('opened', '-a', handler=Handler()) == []
+    assert len(streamed) == 2
+
+
+def test_snapshot_server_groups(snapshot_path):
+    server = SnapshotServer(snapshot_path)
+
+    assert server.run('groups') == [SNAPSHOT_RECORDS[2][1]]
+    assert server.connected()
+
+
+def test_snapshot_server_revert(snapshot_path):
+    server = SnapshotServer(snapshot_path)
+
+    with pytest.raises(ValueError):
+        server.run('revert', '-C', 'ws_a', '//art/chair.fbx')
+
+
+class MockP4(object):
+    def __init__(self, records=None):
+        self.records = records or {}
+        self.port = 'ssl:helix:1666'
+
+    def run(self, *args, **kwargs):
+        records = self.records.get(args[0], [])
+        handler = kwargs.get('handler')
+        if handler:
+            for record in records:
+                handler.outputStat(record)
+            return []
+        return records
+
+
+def test_snapshot_header(snapshot_path):
+    assert read_snapshot_header(snapshot_path) == {}
+    assert snapshot_time(snapshot_path) is None
+
+
+def test_snapshot_recorder(mocker, tmp_path):
+    mocker.patch('p4_timecop.kernel.snapshot.time.time', return_value=1708456705)
+    snapshot_path = str(tmp_path / 'recorded.jsonl.gz')
+    connection = MockP4({
+        'opened': [SNAPSHOT_RECORDS[0][1], SNAPSHOT_RECORDS[1][1]],
+        'groups': [SNAPSHOT_RECORDS[2][1]],
+        'revert': [{'depotFile': '//art/chair.fbx'}],
+    })
+    streamed = []
+
+    class Handler(object):
+        def outputStat(self, record):
+            streamed.append(record)
+
+    recorder = SnapshotRecorder(connection, snapshot_path, 'commit')
+    recorder.run('opened', '-a', handler=Handler())
+    groups = recorder.run('groups')
+    recorder.run('revert', '-C', 'ws_a', '//art/chair.fbx')
+    recorder.close()
+
+    assert streamed == [SNAPSHOT_RECORDS[0][1], SNAPSHOT_RECORDS[1][1]]
+    assert groups == [SNAPSHOT_RECORDS[2][1]]
+    assert recorder.port == 'ssl:helix:1666'
+    assert read_snapshot_header(snapshot_path) == {'server': 'commit', 'time': 1708456705}
+    assert snapshot_time(snapshot_path) == 1708456705
+    assert list(iter_snapshot_records(snapshot_path, 'opened')) == [tuple(record) for record in SNAPSHOT_RECORDS[:2]]
+    assert SnapshotServer(snapshot_path).run('groups') == groups
@@ -0,0 +1,263 @@
+import pytest
+
+from p4_timecop.kernel.state import (
+    upgrade_legacy_data,
+    JsonStateBackend,
+    SqliteStateBackend,
+    STATE_VERSION,
+    drop_orphaned_checkouts,
+    compaction_due,
+    read_history,
+    record_history,
+    get_state_backend
+)
+from p4_timecop.kernel.utils import read_json, write_json
+from p4_timecop.kernel.checkout import Checkout
+
+import datetime
+import json
+import os
+import sqlite3
+import time
+
+CHECKOUT = {
+    'type': 'binary+l',
+    'client': 'client',
+    'user': 'rmaffesoli',
+    'timestamp': int(time.mktime(datetime.datetime(2024, 2, 20, 19, 18, 25).timetuple()))
+}
+LEGACY_CHECKOUT = dict(CHECKOUT, timestamp='Tue Feb 20 19:18:25 2024')
+RECORD = Checkout.from_dict(CHECKOUT)
+NEWER_RECORD = Checkout.from_dict(dict(CHECKOUT, timestamp=CHECKOUT['timestamp'] + 86400))
+
+
+def test_upgrade_legacy_data():
+    existing_data = {
+        '//a/legacy/path.txt': dict(LEGACY_CHECKOUT),
+        '//a/current/path.txt': [dict(CHECKOUT)],
+    }
+
+    result = upgrade_legacy_data(existing_data)
+
+    assert result == {
+        '//a/legacy/path.txt': [CHECKOUT],
+        '//a/current/path.txt': [CHECKOUT],
+    }
+
+
+def test_json_state_backend(tmp_path):
+    data_path = str(tmp_path / 'data.json')
+    write_json({'//a/legacy/path.txt': dict(LEGACY_CHECKOUT)}, data_path)
+    backend = JsonStateBackend(data_path)
+
+    assert backend.load() == {'//a/legacy/path.txt': [RECORD]}
+
+    backend.save({'//a/new/path.txt': [RECORD]})
+    backend.close()
+
+    assert read_json(data_path) == {'//a/new/path.txt': [CHECKOUT]}
+    assert not (tmp_path / 'data.json.tmp').exists()
+
+
+def test_json_state_backend_meta(tmp_path):
+    data_path = str(tmp_path / 'data.json')
+    backend = JsonStateBackend(data_path)
+
+    assert backend.get_meta('notified', '{}') == '{}'
+
+    backend.set_meta('notified', '{"painter": 1708456705}')
+    backend.set_meta('compacted', '1708456705')
+
+    assert not (tmp_path / 'data.json.meta').exists()
+
+    backend.close()
+
+    assert JsonStateBackend(data_path).get_meta('notified') == '{"painter": 1708456705}'
+    assert not (tmp_path / 'data.json').exists()
+    assert not (tmp_path / 'data.json.meta.tmp').exists()
+
+
+def test_json_state_backend_meta_batched(tmp_path, mocker):
+    data_path = str(tmp_path / 'data.json')
+    backend = JsonStateBackend(data_path)
+    m_replace = mocker.spy(os, 'replace')
+
+    backend.load()
+    backend.set_meta('notified', '{}')
+    backend.set_meta('history', '{}')
+    backend.save({'//a/new/path.txt': [RECORD]})
+    backend.close()
+
+    assert m_replace.call_args_list == [
+        mocker.call(data_path + '.tmp', data_path),
+        mocker.call(data_path + '.meta.tmp', data_path + '.meta'),
+    ]
+    assert read_json(data_path + '.meta') == {'notified': '{}', 'history': '{}', 'version': STATE_VERSION}
+
+
+def test_json_state_backend_meta_unreadable(tmp_path):
+    data_path = str(tmp_path / 'data.json')
+    write_json({'//a/new/path.txt': [CHECKOUT]}, data_path)
+    (tmp_path / 'data.json.meta').write_text('{"version": 2, "hist')
+    backend = JsonStateBackend(data_path)
+
+    assert backend.load() == {'//a/new/path.txt': [RECORD]}
+
+    backend.save(backend.load())
+
+    assert read_json(data_path + '.meta') == {'version': STATE_VERSION}
+
+
+def test_sqlite_state_backend_meta(tmp_path):
+    db_path = str(tmp_path / 'data.db')
+    backend = SqliteStateBackend(db_path)
+    backend.set_meta('notified', '{}')
+
+    assert backend.get_meta('notified') == '{}'
+    assert SqliteStateBackend(db_path).get_meta('notified') is None
+
+    backend.save({'//a/new/path.txt': [RECORD]})
+
+    assert SqliteStateBackend(db_path).get_meta('notified') == '{}'
+
+
+def test_json_state_backend_version(tmp_path, mocker):
+    data_path = str(tmp_path / 'data.json')
+    write_json({'//a/legacy/path.txt': dict(LEGACY_CHECKOUT)}, data_path)
+    backend = JsonStateBackend(data_path)
+    m_upgrade = mocker.patch(
+        'p4_timecop.kernel.state.upgrade_legacy_data', side_effect=upgrade_legacy_data
+    )
+
+    backend.save(backend.load())
+
+    assert backend.get_meta('version') == STATE_VERSION
+
+    assert JsonStateBackend(data_path).load() == {'//a/legacy/path.txt': [RECORD]}
+    m_upgrade.assert_called_once()
+
+
+def test_sqlite_state_backend(tmp_path):
+    db_path = str(tmp_path / 'data.db')
+    backend = SqliteStateBackend(db_path)
+
+    assert backend.load() == {}
+
+    backend.save({
+        '//a/kept/path.txt': [RECORD],
+        '//a/removed/path.txt': [RECORD],
+    })
+    backend.save({
+        '//a/kept/path.txt': [RECORD],
+        '//a/new/path.txt': [NEWER_RECORD],
+    })
+    backend.close()
+
+    reloaded = SqliteStateBackend(db_path)
+    assert reloaded.load() == {
+        '//a/kept/path.txt': [RECORD],
+        '//a/new/path.txt': [NEWER_RECORD],
+    }
+    reloaded.close()
+
+
+def test_sqlite_state_backend_legacy_timestamps(tmp_path):
+    db_path = str(tmp_path / 'data.db')
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute(
+            "CREATE TABLE checkouts ("
+            "depot_path TEXT, client TEXT, user TEXT, type TEXT, timestamp TEXT, "
+            "PRIMARY KEY (depot_path, client, user))"
+        )
+        connection.execute(
+            "INSERT INTO checkouts VALUES (?, ?, ?, ?, ?)",
+            ('//a/legacy/path.txt', 'client', 'rmaffesoli', 'binary+l', 'Tue Feb 20 19:18:25 2024')
+        )
+    connection.close()
+
+    backend = SqliteStateBackend(db_path)
+    assert backend.load() == {'//a/legacy/path.txt': [RECORD]}
+    backend.close()
+
+
+def test_sqlite_state_backend_migration(tmp_path):
+    data_path = str(tmp_path / 'data.json')
+    write_json({'//a/legacy/path.txt': dict(LEGACY_CHECKOUT)}, data_path)
+
+    backend = get_state_backend(data_path, 'sqlite')
+    assert backend.load() == {'//a/legacy/path.txt': [RECORD]}
+    backend.save({})
+    backend.close()
+
+    backend = get_state_backend(data_path, 'sqlite')
+    assert backend.load() == {}
+    assert backend.get_meta('migrated') == data_path
+    backend.close()
+
+
+def test_get_state_backend(tmp_path):
+    data_path = str(tmp_path / 'data.json')
+
+    assert isinstance(get_state_backend(data_path), JsonStateBackend)
+
+    backend = get_state_backend(data_path, 'sqlite', str(tmp_path / 'state.db'))
+    assert isinstance(backend, SqliteStateBackend)
+    assert backend.db_path == str(tmp_path / 'state.db')
+    backend.close()
+
+    with pytest.raises(ValueError):
+        get_state_backend(data_path, 'yaml')
+
+
+def test_drop_orphaned_checkouts():
+    open_files = {
+        '//a/kept/path.txt': [RECORD, Checkout('binary+l', 'deleted_client', 'rmaffesoli', RECORD.timestamp)],
+        '//a/orphaned/path.txt': [Checkout('binary+l', 'client', 'deleted_user', RECORD.timestamp)],
+    }
+
+    assert drop_orphaned_checkouts(open_files, {'client'}, {'rmaffesoli'}) == 2
+    assert open_files == {'//a/kept/path.txt': [RECORD]}
+
+
+def test_compaction_due(tmp_path):
+    backend = JsonStateBackend(str(tmp_path / 'data.json'))
+    now = RECORD.timestamp
+
+    assert compaction_due(backend, now, interval=3600)
+
+    backend.set_meta('compacted', json.dumps(now))
+
+    assert not compaction_due(backend, now + 3599, interval=3600)
+    assert compaction_due(backend, now + 3600, interval=3600)
+
+
+def test_record_history(tmp_path):
+    backend = JsonStateBackend(str(tmp_path / 'data.json'))
+    now = RECORD.timestamp
+    day = datetime.date.fromtimestamp(now)
+
+    record_history(backend, now, {'opened': 2, 'open': 5})
+    record_history(backend, now + 86400, {'opened': 3, 'open': 7}, keep_days=2)
+    history = record_history(backend, now + 2 * 86400, {'opened': 0, 'open': 7}, keep_days=2)
+
+    assert history == read_history(backend)
+    assert str(day) not in history
+    assert sorted(history) == [
+        str(day + datetime.timedelta(days=1)),
+        str(day + datetime.timedelta(days=2)),
+    ]
+
+    history = record_history(SqliteStateBackend(str(tmp_path / 'data.db')), now, {'opened': 2, 'open': 5})
+
+    assert history == {str(day): {'opened': 2, 'open': 5}}
+
+
+def test_record_history_sums_counts(tmp_path):
+    backend = JsonStateBackend(str(tmp_path / 'data.json'))
+    now = RECORD.timestamp
+
+    record_history(backend, now, {'opened': 2, 'reverted': 1, 'open': 5})
+    history = record_history(backend, now + 60, {'opened': 1, 'reverted': 0, 'open': 4})
+
+    assert history == {str(datetime.date.fromtimestamp(now)): {'opened': 3, 'reverted': 1, 'open': 4}}
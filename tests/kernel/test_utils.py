@@ -7,11 +7,27 @@ from p4_timecop.kernel.utils import (
     write_json,
     read_json,
     write_log,
-    get_file_datetime,
-    calc_limit
+    get_file_timestamp,
+    build_checkout_index,
+    parse_timestamp,
+    to_epoch,
+    calc_limit,
+    import_p4,
+    record_handler,
+    RecordHandler
 )
+from p4_timecop.kernel import utils
+from p4_timecop.kernel.checkout import Checkout
 
 import datetime
+import time
+
+NOW = 1708456705
+
+
+def epoch(*args):
+    return int(time.mktime(datetime.datetime(*args).timetuple()))
+
 
 class MockP4(object):
     def __init__(
@@ -31,12 +47,6 @@ class MockP4(object):
         self.run_login_called = True
 
 
-class mydatetime(datetime.datetime):
-    @classmethod
-    def now(cls):
-        return datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-    
-
 def test_load_server_config(mocker):
     m_read_json = mocker.patch("p4_timecop.kernel.utils.read_json")
 
@@ -71,11 +81,40 @@ def test_setup_server_connection(
         assert p4_connection.run_login_called == run_login_called
 
 
+def test_record_handler():
+    records = []
+    handler = RecordHandler(records.append)
+
+    result = handler.outputStat({'depotFile': '//a/fake/depot/file.txt'})
+
+    assert result == RecordHandler.HANDLED
+    assert records == [{'depotFile': '//a/fake/depot/file.txt'}]
+
+
+def test_record_handler_lazy():
+    records = []
+    handler = record_handler(records.append)
+
+    handler.outputStat({'depotFile': '//a/fake/depot/file.txt'})
+
+    assert isinstance(handler, RecordHandler)
+    assert isinstance(handler, import_p4().OutputHandler)
+    assert records == [{'depotFile': '//a/fake/depot/file.txt'}]
+
+
+def test_lazy_p4_names():
+    p4python = import_p4()
+
+    assert utils.P4Exception is p4python.P4Exception
+    assert utils.OutputHandler is p4python.OutputHandler
+    with pytest.raises(AttributeError):
+        utils.NotAP4Name
+
+
 def test_set_default():
-    expected_date = "Tue Feb 20 19:18:25 2024"
     test_set = {1, 2, 3}
     test_list = [1, 2, 3]
-    test_date = datetime.datetime.strptime(expected_date, "%a %b %d %H:%M:%S %Y")
+    test_date = datetime.datetime(2024, 2, 20, 19, 18, 25)
     
     set_result = set_default(test_set)
     list_result = set_default(test_list)
@@ -83,10 +122,13 @@ def test_set_default():
 
     assert isinstance(set_result, list)
     assert isinstance(list_result, list)
-    assert isinstance(date_result, str)
+    assert isinstance(date_result, int)
     assert set_result == test_list
     assert list_result == test_list
-    assert date_result == expected_date
+    assert date_result == epoch(2024, 2, 20, 19, 18, 25)
+    assert set_default(Checkout('binary+l', 'client', 'user', NOW)) == {
+        'type': 'binary+l', 'client': 'client', 'user': 'user', 'timestamp': NOW
+    }
 
 
 def test_write_json(mocker):
@@ -123,13 +165,13 @@ def test_read_json(mocker):
 
 def test_write_log(mocker):
     m_open = mocker.patch(
-        "p4_timecop.kernel.utils.open", mocker.mock_open(read_data="{'fake':'data'}")
+        "p4_timecop.kernel.utils.codecs.open", mocker.mock_open(read_data="{'fake':'data'}")
     )
 
     write_log(lines=['test', 'lines'], file_path='/a/fake/file/path.json')
 
     open_calls = [
-        mocker.call('/a/fake/file/path.json', 'a'),
+        mocker.call('/a/fake/file/path.json', 'a', 'utf-8'),
         mocker.call().__enter__(),
         mocker.call().writelines(['test', 'lines']),
         mocker.call().__exit__(None, None, None)
@@ -139,33 +181,64 @@ def test_write_log(mocker):
 
 
 @pytest.mark.parametrize(
-    "file_path,expected_result",
+    "file_path,now,expected_result",
     [
-        ('//a/fake/depot/file/path1.json', "Tue Feb 20 19:18:25 2024"),
-        ('//a/fake/depot/file/path2.json', "Sun Feb 18 19:00:00 2024"),
+        ('//a/fake/depot/file/path1.json', None, NOW),
+        ('//a/fake/depot/file/path1.json', NOW - 60, NOW - 60),
+        ('//a/fake/depot/file/path2.json', None, NOW - 86400),
     ],
 )
-def test_file_datetime(mocker, file_path, expected_result):
-    mocker.patch('p4_timecop.kernel.utils.datetime', mydatetime)
+def test_file_timestamp(mocker, file_path, now, expected_result):
+    mocker.patch('p4_timecop.kernel.utils.time.time', return_value=NOW + 0.5)
+    checkout_index = {
+        ('//a/fake/depot/file/path2.json', 'local_lib', 'rmaffesoli'): NOW - 86400
+    }
+    
+    result = get_file_timestamp(file_path, 'local_lib', 'rmaffesoli', checkout_index, now)
+    assert isinstance(result, int)
+    assert result == expected_result
+
+
+def test_parse_timestamp():
+    expected_epoch = epoch(2024, 2, 20, 19, 18, 25)
+
+    assert parse_timestamp("Tue Feb 20 19:18:25 2024") == expected_epoch
+    assert parse_timestamp(datetime.datetime(2024, 2, 20, 19, 18, 25)) == expected_epoch
+    assert parse_timestamp(expected_epoch) == expected_epoch
+    assert parse_timestamp(str(expected_epoch)) == expected_epoch
+    assert parse_timestamp(expected_epoch + 0.5) == expected_epoch
+
+
+def test_to_epoch():
+    assert to_epoch(datetime.datetime.fromtimestamp(NOW)) == NOW
+
+
+def test_build_checkout_index():
     existing_data = {
-        '//a/fake/depot/file/path2.json': [
-            {
-                "type": "binary+Fl",
-                "client": "local_lib",
-                "user": "rmaffesoli",
-                "timestamp": "Sun Feb 18 19:00:00 2024"
-            }
+        '//a/fake/depot/file/path.json': [
+            Checkout("binary+Fl", "local_lib", "rmaffesoli", NOW - 86400),
+            Checkout("binary+Fl", "other_lib", "other_user", NOW),
         ]
     }
-    
-    result = get_file_datetime(file_path, 'local_lib', 'rmaffesoli', existing_data)
-    assert isinstance(result, datetime.datetime)
-    assert result.strftime("%a %b %d %H:%M:%S %Y") == expected_result
+
+    result = build_checkout_index(existing_data)
+
+    assert result == {
+        ('//a/fake/depot/file/path.json', 'local_lib', 'rmaffesoli'): NOW - 86400,
+        ('//a/fake/depot/file/path.json', 'other_lib', 'other_user'): NOW,
+    }
 
 
-def test_calc_limit(mocker):
-    mocker.patch('p4_timecop.kernel.utils.datetime', mydatetime)
-    expected_result = 'Mon Feb 19 19:18:25 2024'
-    result = calc_limit("1:00:00:00")
+@pytest.mark.parametrize(
+    "time_limit,now,expected_result",
+    [
+        ("1:00:00:00", None, NOW - 86400),
+        ("1:00:00:00", NOW - 100, NOW - 86500),
+        ("0:02:30:15", NOW, NOW - 9015),
+    ],
+)
+def test_calc_limit(mocker, time_limit, now, expected_result):
+    mocker.patch('p4_timecop.kernel.utils.time.time', return_value=NOW + 0.5)
+    result = calc_limit(time_limit, now)
 
-    assert result.strftime('%a %b %d %H:%M:%S %Y') == expected_result
\ No newline at end of file
+    assert result == expected_result
@@ -1,18 +1,43 @@
 import pytest
+import gzip
+import json
 import os
+import signal
+from argparse import Namespace
 from collections import namedtuple
+from p4_timecop.kernel import run_timecop
 from p4_timecop.kernel.run_timecop import (
     get_open_files_dict,
     perform_reverts,
     check_open_files,
     gather_ignored_users,
+    gather_policies,
     apply_filetype_filter,
+    merge_open_files,
+    get_sharded_open_files,
+    split_by_client,
+    perform_sharded_reverts,
+    gather_live_names,
+    compact_state,
+    scan_open_files,
+    process_server,
+    run_servers,
+    close_session,
+    run_daemon,
+    replay_snapshots,
     main,
 )
+from p4_timecop.kernel.utils import P4Exception, read_json, parse_timestamp
+from p4_timecop.kernel.filters import CheckoutFilter
+from p4_timecop.kernel.checkout import Checkout
+from p4_timecop.kernel.policies import build_policy_index
+from p4_timecop.kernel.connection import ConnectionPool
+from p4_timecop.kernel.metrics import RunMetrics
+from p4_timecop.kernel.state import JsonStateBackend
 
-import datetime
+SCRIPT_DIR = os.path.dirname(os.path.abspath(run_timecop.__file__))
 
-args_tuple = namedtuple('ArgsTuple', ['config', 'timelimit', 'data', 'log'])
+args_tuple = namedtuple('ArgsTuple', ['config', 'timelimit', 'data', 'log', 'workers', 'daemon', 'interval', 'dry_run', 'plan', 'snapshot', 'record_snapshot', 'replay'])
 
 class MockP4(object):
     def __init__(
@@ -22,15 +47,77 @@ class MockP4(object):
         self.run_return_value = None
         self.fetch_group_called = False
         self.fetch_group_return_value = None
+        self.is_connected = True
 
-    def run(self, *args):
+    def run(self, *args, **kwargs):
         self.run_called = True
+        handler = kwargs.get('handler')
+        if handler:
+            for record in self.run_return_value:
+                handler.outputStat(record)
+            return []
         return self.run_return_value
     
     def fetch_group(self, *args):
         self.fetch_group_called = True
         return self.fetch_group_return_value
 
+    def connected(self):
+        return self.is_connected
+
+    def disconnect(self):
+        self.is_connected = False
+
+class ShardP4(MockP4):
+    """Answers opened queries narrowed to depot paths and reverts everything asked for."""
+
+    def __init__(self, records):
+        MockP4.__init__(self)
+        self.records = records
+        self.commands = []
+
+    def run(self, *args, **kwargs):
+        self.commands.append(args)
+        if args[0] == 'revert':
+            return [{'depotFile': file_path} for file_path in args[3:]]
+        prefixes = [arg[:-3] for arg in args if arg.endswith('...')]
+        self.run_return_value = [
+            record for record in self.records
+            if not prefixes or any(record['depotFile'].startswith(prefix) for prefix in prefixes)
+        ]
+        if not self.run_return_value and kwargs.get('exception_level', 2) >= 2:
+            raise P4Exception('[Warning]: {} - file(s) not opened anywhere.'.format(' '.join(args[2:])))
+        return MockP4.run(self, *args, **kwargs)
+
+    def connected(self):
+        return True
+
+
+SHARD_RECORDS = [
+    {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+    {'depotFile': '//art/table.fbx', 'type': 'binary+l', 'client': 'ws_b', 'user': 'modeler'},
+    {'depotFile': '//code/main.cpp', 'type': 'text+l', 'client': 'ws_c', 'user': 'coder'},
+    {'depotFile': '//docs/readme.md', 'type': 'text+l', 'client': 'ws_c', 'user': 'coder'},
+]
+
+
+class NamesP4(MockP4):
+    """Answers clients and users queries, and opened queries with its records."""
+
+    def __init__(self, records, clients, users):
+        MockP4.__init__(self)
+        self.run_return_value = records
+        self.clients = clients
+        self.users = users
+
+    def run(self, *args, **kwargs):
+        if args[0] == 'clients':
+            return [{'client': client} for client in self.clients]
+        if args[0] == 'users':
+            return [{'User': user} for user in self.users]
+        return MockP4.run(self, *args, **kwargs)
+
+
 class MockArgumentParser(object):
     def __init__(self, args_dict=None):
         self.args_dict = args_dict or {}
@@ -46,15 +133,10 @@ class MockArgumentParser(object):
     def set_args(self, args_dict=None):
         self.args_dict = args_dict or {}
 
-class mydatetime(datetime.datetime):
-    @classmethod
-    def now(cls):
-        return datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-
 
 def test_get_open_files_dict(mocker):
-    existing_date = datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-    mock_get_file_datetime = mocker.patch('p4_timecop.kernel.run_timecop.get_file_datetime', return_value=existing_date)
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    mock_get_file_timestamp = mocker.patch('p4_timecop.kernel.run_timecop.get_file_timestamp', return_value=existing_date)
     server = MockP4()
     server.run_return_value = [
         {
@@ -69,83 +151,240 @@ def test_get_open_files_dict(mocker):
             'client': "client", 
             'user': 'rmaffesoli'
         },
+        {
+            'depotFile': '//an/existing/file/path.txt', 
+            'type': 'binary', 
+            'client': "client", 
+            'user': 'rmaffesoli'
+        },
     ]
 
     existing_data = {
         '//an/existing/file/path.txt': [
-            {
-                'type': 'binary', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': "Tue Feb 20 19:18:25 2024"
-            }
+            Checkout('binary', "client", 'rmaffesoli', existing_date)
         ]
 
     }
     
     expected_result = {
         '//an/existing/file/path.txt': [
-            {
-                'type': 'binary', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': existing_date
-            },
+            Checkout('binary', "client", 'rmaffesoli', existing_date),
         ],
         '//a/newly/openedfile/path.txt': [
-            {
-                'type': 'binary', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': existing_date
-            },
+            Checkout('binary', "client", 'rmaffesoli', existing_date),
         ]
     }
 
-    datetime_calls = [
-        mocker.call('//a/newly/openedfile/path.txt', 'client', 'rmaffesoli', existing_data),
-        mocker.call('//an/existing/file/path.txt', 'client', 'rmaffesoli', existing_data)
+    checkout_index = {
+        ('//an/existing/file/path.txt', 'client', 'rmaffesoli'): existing_date
+    }
+
+    timestamp_calls = [
+        mocker.call('//a/newly/openedfile/path.txt', 'client', 'rmaffesoli', checkout_index, 1708456705),
+        mocker.call('//an/existing/file/path.txt', 'client', 'rmaffesoli', checkout_index, 1708456705)
     ]
 
-    result = get_open_files_dict(server, existing_data=existing_data)
+    result = get_open_files_dict(server, existing_data=existing_data, now=1708456705)
     print(result)
 
-    mock_get_file_datetime.assert_has_calls(datetime_calls)
+    mock_get_file_timestamp.assert_has_calls(timestamp_calls)
+    assert mock_get_file_timestamp.call_count == 2
+    assert result == expected_result
+    assert server.run_called == True
+
+
+def test_get_open_files_dict_stream(mocker):
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    mocker.patch('p4_timecop.kernel.run_timecop.get_file_timestamp', return_value=existing_date)
+    server = MockP4()
+    server.run_return_value = [
+        {
+            'depotFile': '//a/shared/file/path.txt', 
+            'type': 'binary+l', 
+            'client': "client_a", 
+            'user': 'rmaffesoli'
+        },
+        {
+            'depotFile': '//a/shared/file/path.txt', 
+            'type': 'binary+l', 
+            'client': "client_b", 
+            'user': 'other_user'
+        },
+    ]
+
+    expected_result = {
+        '//a/shared/file/path.txt': [
+            Checkout('binary+l', "client_a", 'rmaffesoli', existing_date),
+            Checkout('binary+l', "client_b", 'other_user', existing_date),
+        ]
+    }
+
+    result = get_open_files_dict(server, existing_data={}, stream=True)
+
     assert result == expected_result
     assert server.run_called == True
 
 
+def test_get_open_files_dict_narrowed(mocker):
+    server = MockP4()
+    m_run = mocker.patch.object(server, 'run', return_value=[])
+
+    get_open_files_dict(server, paths=['//art/...', '//shared/...'], exclusive_only=True)
+
+    m_run.assert_called_once_with('opened', '-a', '-x', '//art/...', '//shared/...', exception_level=1)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_get_open_files_dict_narrowed_empty(stream):
+    server = ShardP4(SHARD_RECORDS)
+
+    result = get_open_files_dict(server, paths=['//quiet/...'], exclusive_only=True, stream=stream)
+
+    assert result == {}
+    assert server.commands == [('opened', '-a', '-x', '//quiet/...')]
+
+
+def test_scan_open_files_reconcile_empty(tmp_path):
+    server = ShardP4(SHARD_RECORDS)
+    server_values = {
+        'journal_filepath': str(tmp_path / 'journal'),
+        'opened_paths': ['//quiet/...'],
+    }
+    existing_data = {'//quiet/gone.fbx': [Checkout('binary+l', 'ws_a', 'painter', 1708456705)]}
+
+    open_files = scan_open_files(server, existing_data, server_values, str(tmp_path / 'data.json'), now=1708456705)
+
+    assert open_files == {}
+    assert 'reconciled' in read_json(str(tmp_path / 'data.json.journal'))
+
+
+def test_merge_open_files():
+    chair = Checkout('binary+l', 'ws_a', 'painter', 1708456705)
+    table = Checkout('binary+l', 'ws_b', 'modeler', 1708456705)
+
+    merged = merge_open_files([
+        {'//art/chair.fbx': [chair]},
+        {'//art/chair.fbx': [chair, table], '//art/table.fbx': [table]},
+    ])
+
+    assert merged == {'//art/chair.fbx': [chair, table], '//art/table.fbx': [table]}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_get_sharded_open_files(stream):
+    now = 1708456705
+    servers = []
+
+    def connect():
+        servers.append(ShardP4(SHARD_RECORDS))
+        return servers[-1]
+
+    pool = ConnectionPool(connect, size=2)
+    metrics = RunMetrics('commit')
+    existing_data = {'//art/chair.fbx': [Checkout('binary+l', 'ws_a', 'painter', now - 86400)]}
+
+    open_files = get_sharded_open_files(
+        pool, ['//art/...', ['//code/...', '//docs/...']], existing_data, stream=stream, now=now, metrics=metrics
+    )
+
+    assert sorted(open_files) == ['//art/chair.fbx', '//art/table.fbx', '//code/main.cpp', '//docs/readme.md']
+    assert open_files['//art/chair.fbx'][0].timestamp == now - 86400
+    assert open_files['//code/main.cpp'][0].timestamp == now
+    assert sorted(command for server in servers for command in server.commands) == [
+        ('opened', '-a', '//art/...'),
+        ('opened', '-a', '//code/...', '//docs/...'),
+    ]
+    assert 1 <= len(servers) <= 2
+    assert metrics.rpcs['opened']['calls'] == 2
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_get_sharded_open_files_quiet_shard(stream):
+    pool = ConnectionPool(lambda: ShardP4(SHARD_RECORDS), size=2)
+
+    open_files = get_sharded_open_files(pool, ['//art/...', '//quiet/...'], stream=stream, now=1708456705)
+
+    assert sorted(open_files) == ['//art/chair.fbx', '//art/table.fbx']
+
+
+def test_split_by_client():
+    data_dict = {
+        '//art/chair.fbx': [Checkout('binary+l', 'ws_a', 'painter', 1), Checkout('binary+l', 'ws_b', 'modeler', 1)],
+        '//art/table.fbx': [Checkout('binary+l', 'ws_a', 'painter', 1)],
+        '//code/main.cpp': [Checkout('text+l', 'ws_c', 'coder', 1)],
+    }
+
+    parts = split_by_client(data_dict, 2)
+
+    assert parts == [
+        {'//art/chair.fbx': [data_dict['//art/chair.fbx'][0]], '//art/table.fbx': data_dict['//art/table.fbx']},
+        {'//art/chair.fbx': [data_dict['//art/chair.fbx'][1]], '//code/main.cpp': data_dict['//code/main.cpp']},
+    ]
+    assert split_by_client(data_dict, 8) == [
+        {'//art/chair.fbx': [data_dict['//art/chair.fbx'][0]], '//art/table.fbx': data_dict['//art/table.fbx']},
+        {'//art/chair.fbx': [data_dict['//art/chair.fbx'][1]]},
+        {'//code/main.cpp': data_dict['//code/main.cpp']},
+    ]
+    assert split_by_client({}, 2) == []
+
+
+def test_perform_sharded_reverts(mocker):
+    servers = []
+
+    def connect():
+        servers.append(ShardP4(SHARD_RECORDS))
+        return servers[-1]
+
+    m_perform_reverts = mocker.spy(run_timecop, 'perform_reverts')
+    data_dict = {
+        '//art/chair.fbx': [Checkout('binary+l', 'ws_a', 'painter', 1)],
+        '//art/table.fbx': [Checkout('binary+l', 'ws_b', 'modeler', 1)],
+    }
+
+    reverted, failed = perform_sharded_reverts(ConnectionPool(connect, size=2), data_dict, ops_per_second=100)
+
+    assert reverted == data_dict
+    assert failed == {}
+    assert m_perform_reverts.call_count == 2
+    assert all(call[1]['ops_per_second'] == 50 for call in m_perform_reverts.call_args_list)
+    assert perform_sharded_reverts(ConnectionPool(connect, size=2), {}) == ({}, {})
+
+
+def test_perform_sharded_reverts_shared_path():
+    data_dict = {
+        '//art/chair.fbx': [
+            Checkout('binary+l', 'ws_a', 'painter', 1),
+            Checkout('binary+l', 'ws_b', 'modeler', 1),
+        ],
+    }
+
+    reverted, failed = perform_sharded_reverts(
+        ConnectionPool(lambda: ShardP4(SHARD_RECORDS), size=2), data_dict
+    )
+
+    assert sorted(checkout.client for checkout in reverted['//art/chair.fbx']) == ['ws_a', 'ws_b']
+    assert failed == {}
+
+
 def test_check_open_files():
-    time_limit = datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
+    time_limit = parse_timestamp("Tue Feb 20 19:18:25 2024")
 
     open_files = {
         '/a/file/path/to/be/unlocked': [
-            {
-                'user': 'user',
-                'timestamp': datetime.datetime.strptime("Sun Feb 18 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-            },
+            Checkout('binary+l', 'client', 'user', parse_timestamp("Sun Feb 18 19:18:25 2024")),
         ],
         '/a/file/path/to/be/ignored': [
-            {
-                'user': 'user',
-                'timestamp': datetime.datetime.strptime("Wed Feb 21 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-            },
+            Checkout('binary+l', 'client', 'user', parse_timestamp("Wed Feb 21 19:18:25 2024")),
         ],
         '/a/file/path/to/be/ignored2': [
-            {
-                'user': 'ignore',
-                'timestamp': datetime.datetime.strptime("Wed Feb 21 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-            },
+            Checkout('binary+l', 'client', 'ignore', parse_timestamp("Wed Feb 21 19:18:25 2024")),
         ]
     }
         
     expected_results = {
         '/a/file/path/to/be/unlocked':
         [
-            {
-                'user': 'user',
-                'timestamp': datetime.datetime.strptime("Sun Feb 18 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
-            },
+            Checkout('binary+l', 'client', 'user', parse_timestamp("Sun Feb 18 19:18:25 2024")),
         ]
     }
 
@@ -154,85 +393,235 @@ def test_check_open_files():
     assert results == expected_results
 
 
+def test_check_open_files_filtered():
+    time_limit = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    expired = parse_timestamp("Sun Feb 18 19:18:25 2024")
+
+    open_files = {
+        '//art/to/be/unlocked.fbx': [
+            Checkout('binary+l', 'ws_art', 'user', expired),
+            Checkout('binary', 'ws_art', 'user', expired),
+        ],
+        '//code/outside/path/filter.cpp': [
+            Checkout('text+l', 'ws_code', 'user', expired),
+        ],
+    }
+
+    checkout_filter = CheckoutFilter(filetype_filter="\\+[^l]*l", path_filters=['//art/...'])
+    counts = {}
+    results = check_open_files(open_files, time_limit, [], checkout_filter, counts=counts)
+
+    assert counts == {'ignored': 0, 'exempt': 0, 'expired': 2, 'filtered': 2}
+    assert results == {
+        '//art/to/be/unlocked.fbx': [
+            Checkout('binary+l', 'ws_art', 'user', expired),
+        ]
+    }
+
+
+def test_check_open_files_policies():
+    now = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    hours_ago = lambda hours: now - hours * 3600
+    policies = build_policy_index(
+        [
+            {'path': '//art/...', 'time_limit': '00:08:00:00'},
+            {'path': '//art/...', 'group': 'leads', 'time_limit': '02:00:00:00'},
+            {'path': '//art/shared/...', 'exempt': True},
+        ],
+        now,
+        {'leads': {'lead'}}
+    )
+    open_files = {
+        '//art/chair.fbx': [
+            Checkout('binary+l', 'ws_a', 'painter', hours_ago(10)),
+            Checkout('binary+l', 'ws_b', 'lead', hours_ago(10)),
+        ],
+        '//art/shared/palette.png': [
+            Checkout('binary+l', 'ws_a', 'painter', hours_ago(100)),
+        ],
+        '//code/main.cpp': [
+            Checkout('text+l', 'ws_c', 'coder', hours_ago(10)),
+        ],
+    }
+    counts = {}
+
+    results = check_open_files(open_files, now - 86400, [], counts=counts, policies=policies)
+
+    assert results == {'//art/chair.fbx': [open_files['//art/chair.fbx'][0]]}
+    assert counts == {'ignored': 0, 'exempt': 1, 'expired': 1, 'filtered': 0}
+
+
+def test_check_open_files_expiring():
+    now = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    open_files = {
+        '//art/chair.fbx': [
+            Checkout('binary+l', 'ws_a', 'painter', now - 86400 - 60),
+            Checkout('binary+l', 'ws_b', 'modeler', now - 86400 + 600),
+        ],
+        '//art/table.fbx': [
+            Checkout('binary+l', 'ws_a', 'painter', now - 3600),
+            Checkout('binary', 'ws_a', 'painter', now - 86400 + 600),
+        ],
+    }
+    checkout_filter = CheckoutFilter(filetype_filter="\\+[^l]*l")
+    expiring = {}
+
+    results = check_open_files(open_files, now - 86400, [], checkout_filter, expiring=expiring, warn_window=3600)
+
+    assert results == {'//art/chair.fbx': [open_files['//art/chair.fbx'][0]]}
+    assert expiring == {'//art/chair.fbx': [(open_files['//art/chair.fbx'][1], 600)]}
+
+
+def test_gather_policies(mocker):
+    server = MockP4()
+    server.run_return_value = [{'group': 'leads', 'user': 'lead', 'isSubGroup': '0', 'isUser': '1'}]
+    config = {'time_limit_policies': [{'path': '//art/...', 'group': 'leads', 'time_limit': '00:08:00:00'}]}
+
+    policies = gather_policies(server, config, 1708456705)
+    policy = policies.candidates('//art/chair.fbx')[0]
+
+    assert policy.users == {'lead'}
+    assert policy.limit == 1708456705 - 8 * 3600
+    assert gather_policies(server, {}) is None
+
+
 def test_perform_reverts():
     server = MockP4()
-    server.run_return_value = 'yup'
-    expected_results = ['yup']
-    data_dict = {'/a/fake/file/path.txt': [{'client': 'client'}]}
+    server.run_return_value = [{'depotFile': '/a/fake/file/path.txt'}]
+    data_dict = {
+        '/a/fake/file/path.txt': [Checkout('binary+l', 'client', 'user', 0)],
+        '/a/fake/file/locked.txt': [Checkout('binary+l', 'client', 'user', 0)],
+    }
     
-    results = perform_reverts(server, data_dict)
-    assert results == expected_results
+    reverted, failed = perform_reverts(server, data_dict)
+    assert reverted == {'/a/fake/file/path.txt': [Checkout('binary+l', 'client', 'user', 0)]}
+    assert failed == {'/a/fake/file/locked.txt': [Checkout('binary+l', 'client', 'user', 0)]}
     assert server.run_called == True
 
 
+def test_perform_reverts_outcomes(mocker):
+    server = MockP4()
+    server.warnings = ['//art/retried.fbx - file(s) not opened on this client.']
+    server.errors = ['//art/locked.fbx - can\'t revert, file is locked by another client.']
+    m_run = mocker.patch.object(server, 'run', return_value=[{'depotFile': '//art/chair.fbx'}, 'warning'])
+    data_dict = {
+        file_path: [Checkout('binary+l', 'client', 'user', 0)]
+        for file_path in ('//art/chair.fbx', '//art/retried.fbx', '//art/locked.fbx')
+    }
+
+    reverted, failed = perform_reverts(server, data_dict)
+
+    assert sorted(reverted) == ['//art/chair.fbx', '//art/retried.fbx']
+    assert list(failed) == ['//art/locked.fbx']
+    m_run.assert_called_once_with(
+        'revert', '-C', 'client', '//art/chair.fbx', '//art/retried.fbx', '//art/locked.fbx', exception_level=0
+    )
+
+
+def test_perform_reverts_chunked(mocker):
+    server = MockP4()
+    m_run = mocker.patch.object(server, 'run', return_value=[])
+    data_dict = {
+        '/a/fake/file/path1.txt': [Checkout('binary+l', 'client_a', 'user', 0), Checkout('binary+l', 'client_b', 'user', 0)],
+        '/a/fake/file/path2.txt': [Checkout('binary+l', 'client_a', 'user', 0)],
+        '/a/fake/file/path3.txt': [Checkout('binary+l', 'client_a', 'user', 0)],
+    }
+
+    perform_reverts(server, data_dict, chunk_size=2)
+
+    m_run.assert_has_calls([
+        mocker.call('revert', '-C', 'client_a', '/a/fake/file/path1.txt', '/a/fake/file/path2.txt', exception_level=0),
+        mocker.call('revert', '-C', 'client_a', '/a/fake/file/path3.txt', exception_level=0),
+        mocker.call('revert', '-C', 'client_b', '/a/fake/file/path1.txt', exception_level=0),
+    ])
+
+
+def test_perform_reverts_rate_limited(mocker):
+    clock = {'now': 1000.0}
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', side_effect=lambda: clock['now'])
+    m_sleep = mocker.patch(
+        'p4_timecop.kernel.run_timecop.time.sleep',
+        side_effect=lambda seconds: clock.__setitem__('now', clock['now'] + seconds)
+    )
+    server = MockP4()
+    server.run_return_value = []
+    data_dict = {'/a/fake/file/path{}.txt'.format(index): [Checkout('binary+l', 'client', 'user', 0)] for index in range(6)}
+
+    perform_reverts(server, data_dict, chunk_size=2, ops_per_second=2)
+
+    assert m_sleep.call_args_list == [mocker.call(1.0), mocker.call(1.0)]
+
+
+def test_perform_reverts_time_budget(mocker):
+    clock = {'now': 1000.0}
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', side_effect=lambda: clock['now'])
+    server = MockP4()
+
+    def slow_revert(*args, **kwargs):
+        clock['now'] += 5
+        return [{'depotFile': file_path} for file_path in args[3:]]
+
+    mocker.patch.object(server, 'run', side_effect=slow_revert)
+    data_dict = {'/a/fake/file/path{}.txt'.format(index): [Checkout('binary+l', 'client', 'user', 0)] for index in range(6)}
+
+    reverted, failed = perform_reverts(server, data_dict, chunk_size=2, time_budget=8)
+
+    assert len(reverted) == 4
+    assert failed == {}
+
+
+def test_perform_reverts_exception(mocker):
+    server = MockP4()
+    mocker.patch.object(server, 'run', side_effect=P4Exception('connection dropped'))
+    data_dict = {'/a/fake/file/path.txt': [Checkout('binary+l', 'client', 'user', 0)]}
+
+    reverted, failed = perform_reverts(server, data_dict)
+    assert reverted == {}
+    assert failed == data_dict
+
+
 def test_gather_ignored_users():
     server = MockP4()
-    server.fetch_group_return_value = {'Users': {'group_member'}}
+    server.run_return_value = [
+        {'group': 'group_name', 'user': 'group_member', 'isSubGroup': '0', 'isOwner': '0', 'isUser': '1'},
+        {'group': 'group_name', 'user': 'nested_group', 'isSubGroup': '1', 'isOwner': '0', 'isUser': '0'},
+        {'group': 'nested_group', 'user': 'nested_member', 'isSubGroup': '0', 'isOwner': '0', 'isUser': '1'},
+    ]
     config = {
         'ignored_usernames': ['single_user'],
         'ignored_groupnames': ['group_name']
     }
-    expected_results = {'single_user', 'group_member'}
+    expected_results = {'single_user', 'group_member', 'nested_member'}
     results = gather_ignored_users(server, config)
     
     assert results == expected_results
-    assert server.fetch_group_called
+    assert server.run_called
 
 
 def test_apply_filetype_filter():
-    existing_date = datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
     to_be_unlocked = {
         '//an/existing/file/to_be_unlocked_binary.txt': [
-            {
-                'type': 'binary+l', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': existing_date
-            },
+            Checkout('binary+l', "client", 'rmaffesoli', existing_date),
         ],
         '//a/newly/openedfile/to_be_filtered_binary.txt': [
-            {
-                'type': 'binary', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': existing_date
-            },
+            Checkout('binary', "client", 'rmaffesoli', existing_date),
         ],
         '//a/newly/openedfile/to_be_filtered_text.txt': [
-            {
-                'type': 'text', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': existing_date
-            },
+            Checkout('text', "client", 'rmaffesoli', existing_date),
         ],
         '//a/newly/openedfile/to_be_unlocked_text.txt': [
-            {
-                'type': 'text+l', 
-                'client': "client", 
-                'user': 'rmaffesoli',
-                'timestamp': existing_date
-            },
+            Checkout('text+l', "client", 'rmaffesoli', existing_date),
         ]
     }
     pattern = "\\+[^l]*l"
 
     expected_results = {
         '//a/newly/openedfile/to_be_unlocked_text.txt': [
-            {
-                'client': 'client', 
-                'timestamp': datetime.datetime(2024, 2, 20, 19, 18, 25), 
-                'type': 'text+l', 
-                'user': 'rmaffesoli'
-            }
+            Checkout('text+l', 'client', 'rmaffesoli', existing_date)
         ], 
         '//an/existing/file/to_be_unlocked_binary.txt': [
-            {
-                'client': 'client', 
-                'timestamp': datetime.datetime(2024, 2, 20, 19, 18, 25), 
-                'type': 'binary+l', 
-                'user': 'rmaffesoli'
-            }
+            Checkout('binary+l', 'client', 'rmaffesoli', existing_date)
         ]
     }
 
@@ -240,10 +629,480 @@ def test_apply_filetype_filter():
     assert results == expected_results
 
 
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_run_servers(mocker, max_workers):
+    def fake_process_server(server_name, server_values, parsed_args, session=None):
+        if server_name == 'broken':
+            raise RuntimeError('connection refused')
+
+    m_process_server = mocker.patch(
+        'p4_timecop.kernel.run_timecop.process_server',
+        side_effect=fake_process_server
+    )
+    servers = {'broken': {}, 'edge': {}, 'commit': {}}
+
+    timings = run_servers(servers, 'parsed_args', max_workers)
+
+    assert sorted(timings) == ['broken', 'commit', 'edge']
+    assert m_process_server.call_count == 3
+    m_process_server.assert_any_call('commit', {}, 'parsed_args', session=None)
+
+
+def test_run_servers_closes_failed_session(mocker):
+    mocker.patch(
+        'p4_timecop.kernel.run_timecop.process_server',
+        side_effect=RuntimeError('connection dropped')
+    )
+    server = MockP4()
+    sessions = {'commit': {'connection': server, 'open_files': {}}}
+
+    run_servers({'commit': {}}, 'parsed_args', 1, sessions)
+
+    assert sessions['commit']['connection'] is None
+    assert server.is_connected == False
+
+
+def test_close_session(mocker):
+    server = MockP4()
+    pool = mocker.Mock()
+    session = {'connection': server, 'pool': pool}
+
+    close_session(session)
+
+    assert session['connection'] is None
+    assert 'pool' not in session
+    assert server.is_connected == False
+    pool.close.assert_called_once()
+
+
+def test_run_daemon(mocker):
+    handlers = {}
+    mocker.patch(
+        'p4_timecop.kernel.run_timecop.signal.signal',
+        side_effect=lambda signum, handler: handlers.__setitem__(signum, handler)
+    )
+    server = MockP4()
+
+    def fake_run_servers(servers, parsed_args, max_workers, sessions):
+        sessions['commit']['connection'] = server
+        handlers[signal.SIGTERM](signal.SIGTERM, None)
+
+    m_run_servers = mocker.patch(
+        'p4_timecop.kernel.run_timecop.run_servers',
+        side_effect=fake_run_servers
+    )
+
+    run_daemon({'commit': {}}, 'parsed_args', 1, 0)
+
+    m_run_servers.assert_called_once()
+    assert server.is_connected == False
+
+
+def test_process_server_session(mocker, tmp_path):
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    mocker.patch('p4_timecop.kernel.run_timecop.calc_limit', return_value=existing_date)
+    m_get_state_backend = mocker.patch('p4_timecop.kernel.run_timecop.get_state_backend')
+    m_get_state_backend.return_value.get_meta.side_effect = lambda key, default=None: default
+    m_setup_server_connection = mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection')
+    mocker.patch('p4_timecop.kernel.logger.write_log')
+    server = MockP4()
+    server.run_return_value = []
+    open_files = {
+        '//an/existing/file/path.txt': [
+            Checkout('binary+l', "client", 'rmaffesoli', parse_timestamp('Tue Feb 20 19:18:25 2024'))
+        ]
+    }
+    session = {'connection': server, 'open_files': open_files}
+    given_args = args_tuple("a/config/path.json", None, None, None, None, True, None, False, None, None, None, None)
+    metrics_path = str(tmp_path / 'metrics.json')
+
+    process_server('commit', {'server': {}, 'metrics_filepath': metrics_path}, given_args, session=session)
+
+    m_get_state_backend.return_value.load.assert_not_called()
+    m_get_state_backend.return_value.save.assert_called_once_with({})
+    m_setup_server_connection.assert_not_called()
+    assert session['connection'] is server
+    assert session['open_files'] == {}
+    metrics = read_json(metrics_path)
+    assert metrics['counts']['scanned'] == 0
+    assert metrics['rpcs']['opened']['calls'] == 1
+
+
+def test_process_server_journal(mocker, tmp_path):
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    mocker.patch('p4_timecop.kernel.run_timecop.calc_limit', return_value=existing_date)
+    server = MockP4()
+    server.run_return_value = []
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    mocker.patch('p4_timecop.kernel.logger.write_log')
+    m_get_open_files_dict = mocker.patch('p4_timecop.kernel.run_timecop.get_open_files_dict', return_value={})
+    m_update_from_journal = mocker.patch('p4_timecop.kernel.run_timecop.update_from_journal', return_value=42)
+
+    data_path = str(tmp_path / 'data.json')
+    journal_state_path = str(tmp_path / 'data.json.journal')
+    server_values = {'server': {}, 'journal_filepath': str(tmp_path / 'journal')}
+    given_args = args_tuple("a/config/path.json", None, data_path, str(tmp_path / 'log.txt'), None, False, None, False, None, None, None, None)
+
+    process_server('commit', server_values, given_args)
+
+    m_get_open_files_dict.assert_called_once()
+    m_update_from_journal.assert_not_called()
+
+    process_server('commit', server_values, given_args)
+
+    m_get_open_files_dict.assert_called_once()
+    m_update_from_journal.assert_called_once()
+    assert read_json(journal_state_path)['offset'] == 42
+
+
+def test_process_server_journal_types_expired(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = MockP4()
+    server.run_return_value = [
+        {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+    ]
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    m_perform_reverts = mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts', return_value=({}, {}))
+
+    journal_path = tmp_path / 'journal'
+    journal_path.write_text(
+        '@pv@ 9 @db.working@ @//ws_a/chair.fbx@ @//art/chair.fbx@ @ws_a@ @painter@ 1 1 0 262403 1 0\n'
+        '@ex@ 1234 {}\n'.format(now - 7200)
+    )
+    data_path = tmp_path / 'data.json'
+    data_path.write_text('{}')
+    (tmp_path / 'data.json.journal').write_text(json.dumps({'offset': 0, 'reconciled': now - 60}))
+    server_values = {'server': {}, 'journal_filepath': str(journal_path), 'file_lock_time_limit': '00:01:00:00'}
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(tmp_path / 'log.txt'), None, False, None, False, None, None, None, None)
+
+    process_server('commit', server_values, given_args)
+
+    assert server.run_called
+    assert m_perform_reverts.call_args[0][1] == {'//art/chair.fbx': [Checkout('binary+l', 'ws_a', 'painter', now - 7200)]}
+    assert read_json(str(data_path) + '.journal') == {'offset': journal_path.stat().st_size, 'reconciled': now}
+
+
+def test_process_server_journal_save_failure(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = MockP4()
+    server.run_return_value = []
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+
+    journal_path = tmp_path / 'journal'
+    journal_path.write_text(
+        '@pv@ 9 @db.working@ @//ws_a/chair.fbx@ @//art/chair.fbx@ @ws_a@ @painter@ 1 1 0 262403 1 0\n'
+        '@ex@ 1234 {}\n'.format(now - 60)
+    )
+    data_path = tmp_path / 'data.json'
+    data_path.write_text('{}')
+    journal_state_path = tmp_path / 'data.json.journal'
+    journal_state_path.write_text(json.dumps({'offset': 0, 'reconciled': now - 60}))
+    server_values = {'server': {}, 'journal_filepath': str(journal_path)}
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(tmp_path / 'log.txt'), None, False, None, False, None, None, None, None)
+
+    real_replace = os.replace
+    m_replace = mocker.patch('p4_timecop.kernel.state.os.replace', side_effect=OSError('disk full'))
+    with pytest.raises(OSError):
+        process_server('commit', server_values, given_args)
+
+    assert read_json(str(journal_state_path))['offset'] == 0
+
+    m_replace.side_effect = real_replace
+    process_server('commit', server_values, given_args)
+
+    assert list(read_json(str(data_path))) == ['//art/chair.fbx']
+    assert read_json(str(journal_state_path))['offset'] == journal_path.stat().st_size
+
+
+def test_process_server_dry_run(mocker, tmp_path):
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
+    mocker.patch('p4_timecop.kernel.run_timecop.calc_limit', return_value=existing_date)
+    m_setup_server_connection = mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection')
+    m_perform_reverts = mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts')
+    m_get_state_backend = mocker.patch('p4_timecop.kernel.run_timecop.get_state_backend')
+    m_get_state_backend.return_value.load.return_value = {
+        '//an/expired/file.txt': [
+            Checkout('binary+l', "client", 'rmaffesoli', parse_timestamp('Sun Feb 18 19:18:25 2024'))
+        ]
+    }
+    m_snapshot_server = mocker.patch('p4_timecop.kernel.run_timecop.SnapshotServer', return_value=MockP4())
+    m_snapshot_server.return_value.run_return_value = [
+        {
+            'depotFile': '//an/expired/file.txt', 
+            'type': 'binary+l', 
+            'client': "client", 
+            'user': 'rmaffesoli'
+        },
+    ]
+    log_path = tmp_path / 'log.txt'
+    plan_path = str(tmp_path / '{server}_plan.json')
+    given_args = args_tuple("a/config/path.json", None, None, str(log_path), None, False, None, False, plan_path, 'snapshot.jsonl.gz', None, None)
+
+    m_gather_ignored_users = mocker.spy(run_timecop, 'gather_ignored_users')
+    m_gather_policies = mocker.spy(run_timecop, 'gather_policies')
+
+    process_server('commit', {'server': {}, 'group_cache_filepath': str(tmp_path / 'groups.json')}, given_args)
+
+    assert m_gather_ignored_users.call_args[1]['config']['group_cache_filepath'] is None
+    assert m_gather_policies.call_args[0][1]['group_cache_filepath'] is None
+    m_snapshot_server.assert_called_once_with('snapshot.jsonl.gz')
+    m_setup_server_connection.assert_not_called()
+    m_perform_reverts.assert_not_called()
+    m_get_state_backend.return_value.save.assert_not_called()
+    assert not log_path.exists()
+    plan = read_json(str(tmp_path / 'commit_plan.json'))
+    assert plan['checkouts'] == 1
+    assert plan['estimated_rpcs'] == 1
+
+
+def test_process_server_contention_only(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = MockP4()
+    server.run_return_value = [
+        {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+        {'depotFile': '//art/table.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+    ]
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    m_perform_reverts = mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts', return_value=({}, {}))
+    mocker.patch('p4_timecop.kernel.logger.write_log')
+
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps({
+        depot_path: [{'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': now - 2 * 86400}]
+        for depot_path in ('//art/chair.fbx', '//art/table.fbx')
+    }))
+    feed_path = tmp_path / 'contention.jsonl'
+    feed_path.write_text(json.dumps({'depotFile': '//art/chair.fbx', 'user': 'modeler', 'time': now - 60}) + '\n')
+    server_values = {
+        'server': {},
+        'contention_feed_filepath': str(feed_path),
+        'contention_only': True,
+        'metrics_filepath': str(tmp_path / 'metrics.json'),
+    }
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(tmp_path / 'log.txt'), None, False, None, False, None, None, None, None)
+
+    process_server('commit', server_values, given_args)
+
+    assert list(m_perform_reverts.call_args[0][1]) == ['//art/chair.fbx']
+    assert read_json(server_values['metrics_filepath'])['counts']['uncontended'] == 1
+
+
+def test_process_server_notify(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = MockP4()
+    server.run_return_value = [
+        {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+        {'depotFile': '//art/table.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+    ]
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    m_perform_reverts = mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts', return_value=({}, {}))
+
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps({
+        '//art/chair.fbx': [{'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': now - 2 * 86400}],
+        '//art/table.fbx': [{'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': now - 86400 + 600}],
+    }))
+    log_path = tmp_path / 'log.txt'
+    spool_path = tmp_path / 'spool'
+    server_values = {
+        'server': {},
+        'notify_method': 'spool',
+        'notify_spool_dirpath': str(spool_path),
+        'notify_window': 3600,
+    }
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(log_path), None, False, None, False, None, None, None, None)
+
+    process_server('commit', server_values, given_args)
+    process_server('commit', server_values, given_args)
+
+    assert list(m_perform_reverts.call_args[0][1]) == ['//art/chair.fbx']
+    notice = read_json(str(spool_path / 'commit_painter.json'))
+    assert [entry['file'] for entry in notice['files']] == ['//art/table.fbx']
+    assert read_json(str(data_path) + '.meta')['notified'] == json.dumps({'painter': now})
+    assert log_path.read_text().count('painter has been warned about 1 locked files.') == 1
+
+
+@pytest.mark.parametrize(
+    "server,expected_names",
+    [
+        (NamesP4([], ['ws_a'], ['painter']), ({'ws_a'}, {'painter'})),
+        (NamesP4([], [], ['painter']), None),
+    ],
+)
+def test_gather_live_names(server, expected_names):
+    assert gather_live_names(server) == expected_names
+
+
+def test_gather_live_names_error(mocker):
+    server = MockP4()
+    mocker.patch.object(server, 'run', side_effect=P4Exception('connection lost'))
+
+    assert gather_live_names(server) is None
+
+
+def test_compact_state(tmp_path):
+    now = 1708456705
+    state = JsonStateBackend(str(tmp_path / 'data.json'))
+    server = NamesP4([], ['ws_a'], ['painter'])
+    open_files = {
+        '//art/chair.fbx': [Checkout('binary+l', 'ws_a', 'painter', now)],
+        '//art/table.fbx': [Checkout('binary+l', 'ws_gone', 'painter', now)],
+    }
+
+    assert compact_state(server, state, open_files, now, interval=3600) == 1
+    assert list(open_files) == ['//art/chair.fbx']
+    assert state.get_meta('compacted') == json.dumps(now)
+
+    open_files['//art/table.fbx'] = [Checkout('binary+l', 'ws_gone', 'painter', now)]
+
+    assert compact_state(server, state, open_files, now + 600, interval=3600) == 0
+    assert '//art/table.fbx' in open_files
+
+
+def test_process_server_history(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = NamesP4(
+        [
+            {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+            {'depotFile': '//art/lamp.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+            {'depotFile': '//art/sofa.fbx', 'type': 'binary+l', 'client': 'ws_b', 'user': 'painter'},
+        ],
+        ['ws_a'],
+        ['painter']
+    )
+    m_gather_live_names = mocker.spy(run_timecop, 'gather_live_names')
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts', return_value=({}, {}))
+
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps({
+        '//art/chair.fbx': [{'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': now - 600}],
+        '//art/table.fbx': [{'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': now - 600}],
+    }))
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(tmp_path / 'log.txt'), None, False, None, False, None, None, None, None)
+
+    process_server('commit', {'server': {}, 'history_days': 30}, given_args)
+
+    assert sorted(read_json(str(data_path))) == ['//art/chair.fbx', '//art/lamp.fbx', '//art/sofa.fbx']
+    history = JsonStateBackend(str(data_path))
+    assert list(json.loads(history.get_meta('history')).values()) == [
+        {'opened': 2, 'closed': 1, 'reverted': 0, 'failed': 0, 'dropped': 0, 'open': 3}
+    ]
+    m_gather_live_names.assert_not_called()
+
+
+def test_process_server_journal_compaction(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = NamesP4([], ['ws_a'], ['painter'])
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts', return_value=({}, {}))
+
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps({
+        '//art/chair.fbx': [{'type': 'binary+l', 'client': 'ws_a', 'user': 'painter', 'timestamp': now - 600}],
+        '//art/sofa.fbx': [{'type': 'binary+l', 'client': 'ws_gone', 'user': 'painter', 'timestamp': now - 600}],
+    }))
+    (tmp_path / 'data.json.journal').write_text(json.dumps({'offset': 0, 'reconciled': now - 60}))
+    server_values = {'server': {}, 'journal_filepath': str(tmp_path / 'journal'), 'history_days': 30}
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(tmp_path / 'log.txt'), None, False, None, False, None, None, None, None)
+
+    process_server('commit', server_values, given_args)
+
+    assert list(read_json(str(data_path))) == ['//art/chair.fbx']
+    history = JsonStateBackend(str(data_path))
+    assert list(json.loads(history.get_meta('history')).values())[0]['dropped'] == 1
+    assert history.get_meta('compacted') == json.dumps(now)
+
+
+def test_process_server_sharded(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    servers = []
+
+    def connect(**kwargs):
+        servers.append(ShardP4(SHARD_RECORDS))
+        return servers[-1]
+
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', side_effect=connect)
+
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps({
+        record['depotFile']: [{'type': record['type'], 'client': record['client'], 'user': record['user'], 'timestamp': now - 2 * 86400}]
+        for record in SHARD_RECORDS
+        if record['depotFile'] != '//docs/readme.md'
+    }))
+    log_path = tmp_path / 'log.txt'
+    server_values = {
+        'server': {},
+        'shards': ['//art/...', '//code/...', '//docs/...'],
+        'shard_workers': 2,
+        'metrics_filepath': str(tmp_path / 'metrics.json'),
+    }
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(log_path), None, False, None, False, None, None, None, None)
+    session = {}
+
+    process_server('commit', server_values, given_args, session=session)
+
+    assert list(read_json(str(data_path))) == ['//docs/readme.md']
+    assert log_path.read_text().count('has been force reverted') == 3
+    metrics = read_json(server_values['metrics_filepath'])
+    assert metrics['rpcs']['opened']['calls'] == 3
+    assert metrics['rpcs']['revert']['calls'] == 3
+    assert metrics['counts']['reverted'] == 3
+    assert 1 <= len(session['pool'].connections) <= 2
+    assert len(servers) == 1 + len(session['pool'].connections)
+
+    close_session(session)
+
+
+def write_snapshot(snapshot_path, recorded, records):
+    with gzip.open(snapshot_path, 'wt', encoding='utf-8') as snapshot_file:
+        snapshot_file.write(json.dumps(['header', {'server': 'commit', 'time': recorded}]) + '\n')
+        for record in records:
+            snapshot_file.write(json.dumps(['opened', record]) + '\n')
+
+
+def test_replay_snapshots(mocker, tmp_path):
+    m_import_p4 = mocker.patch('p4_timecop.kernel.utils.import_p4')
+    m_record_handler = mocker.patch('p4_timecop.kernel.run_timecop.record_handler')
+    day = 86400
+    start = 1708456705
+    chair = {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'}
+    table = {'depotFile': '//art/table.fbx', 'type': 'binary+l', 'client': 'ws_b', 'user': 'modeler'}
+    snapshots = [
+        (str(tmp_path / 'third.jsonl.gz'), start + 2 * day, [chair, table]),
+        (str(tmp_path / 'first.jsonl.gz'), start, [chair]),
+        (str(tmp_path / 'second.jsonl.gz'), start + day // 2, [chair, table]),
+    ]
+    for snapshot_path, recorded, records in snapshots:
+        write_snapshot(snapshot_path, recorded, records)
+
+    report_path = str(tmp_path / 'replay.json')
+    given_args = args_tuple("a/config/path.json", None, None, None, None, False, None, False, report_path, None, None, None)
+    servers = {'commit': {'file_lock_time_limit': '01:00:00:00'}}
+
+    results = replay_snapshots([snapshot_path for snapshot_path, _, _ in snapshots], servers, given_args)
+
+    assert [result['snapshot'] for result in results] == [
+        snapshots[1][0], snapshots[2][0], snapshots[0][0]
+    ]
+    assert [result['scanned'] for result in results] == [1, 2, 2]
+    assert [result['reverted'] for result in results] == [0, 0, 2]
+    assert read_json(report_path) == results
+    m_import_p4.assert_not_called()
+    m_record_handler.assert_not_called()
+
+
 def test_main(mocker):
 
-    given_args = args_tuple("a/config/path.json", "1:00:00:00", 'a/data/path.json', 'a/log/path/log.txt')
-    existing_date = datetime.datetime.strptime("Tue Feb 20 19:18:25 2024", "%a %b %d %H:%M:%S %Y")
+    given_args = Namespace(check_config=False, **args_tuple("a/config/path.json", "1:00:00:00", '/a/data/path.json', '/a/log/path/log.txt', None, False, None, False, None, None, None, None)._asdict())
+    existing_date = parse_timestamp("Tue Feb 20 19:18:25 2024")
     m_ArgumentParser_parse = mocker.patch('p4_timecop.kernel.run_timecop.ArgumentParser', return_value=MockArgumentParser(given_args))
     m_os_chdir = mocker.patch('p4_timecop.kernel.run_timecop.os.chdir')
 
@@ -272,63 +1131,45 @@ def test_main(mocker):
         return_value=existing_date
     )
 
+    existing_data = {
+        '//an/existing/file/path.txt': [
+            {
+                'type': 'binary+l', 
+                'client': "client", 
+                'user': 'rmaffesoli',
+                'timestamp': "Tue Feb 20 19:18:25 2024",
+            },
+        ],
+        '/a/file/path/to/be/unlocked': # return value stored in old data format style to test upgrade functionality
+            {
+                'type': 'binary+l', 
+                'client': 'client', 
+                'user': 'rmaffesoli', 
+                'timestamp': "Tue Feb 20 19:18:25 2024"
+            }
+        
+    }
     m_read_json = mocker.patch(
-        'p4_timecop.kernel.run_timecop.read_json', 
-        return_value= {  
-            '//an/existing/file/path.txt': [
-                {
-                    'type': 'binary+l', 
-                    'client': "client", 
-                    'user': 'rmaffesoli',
-                    'timestamp': "Tue Feb 20 19:18:25 2024",
-                },
-            ],
-            '/a/file/path/to/be/unlocked': # return value stored in old data format style to test upgrade functionality
-                {
-                    'type': 'binary+l', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': "Tue Feb 20 19:18:25 2024"
-                }
-            
-        }
+        'p4_timecop.kernel.state.read_json',
+        side_effect=lambda path: {} if path.endswith('.meta') else existing_data
     )
 
     m_setup_server_connection = mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=MockP4())
+    m_setup_server_connection.return_value.run_return_value = []
     m_get_open_files_dict = mocker.patch(
         'p4_timecop.kernel.run_timecop.get_open_files_dict', 
         return_value={
             '//an/existing/file/path.txt': [
-                {
-                    'type': 'binary+l', 
-                    'client': "client", 
-                    'user': 'rmaffesoli',
-                    'timestamp': existing_date
-                },
+                Checkout('binary+l', "client", 'rmaffesoli', existing_date),
             ],
             '//a/newly/openedfile/path.txt': [
-                {
-                    'type': 'binary+l', 
-                    'client': "client", 
-                    'user': 'rmaffesoli',
-                    'timestamp': existing_date
-                },
+                Checkout('binary+l', "client", 'rmaffesoli', existing_date),
             ],
             '/a/file/path/to/be/unlocked': [
-                {
-                    'type': 'binary+l', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': existing_date
-                },
+                Checkout('binary+l', 'client', 'rmaffesoli', existing_date),
             ],
             '/a/file/path/to/be/ignored': [
-                {
-                    'type': 'binary', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': existing_date
-                },
+                Checkout('binary', 'client', 'rmaffesoli', existing_date),
             ]
         }
     )
@@ -336,100 +1177,243 @@ def test_main(mocker):
         'p4_timecop.kernel.run_timecop.check_open_files', 
         return_value={
             '/a/file/path/to/be/unlocked': [
-                {
-                    'type': 'binary+l', 
-                    'client': "client", 
-                    'user': 'rmaffesoli',
-                    'timestamp': existing_date
-                }
+                Checkout('binary+l', "client", 'rmaffesoli', existing_date)
             ]
         }
     )
-    m_perform_reverts = mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts')
-    mocker.patch('p4_timecop.kernel.run_timecop.datetime', mydatetime)
-    m_write_log = mocker.patch('p4_timecop.kernel.run_timecop.write_log')
-    m_write_json = mocker.patch('p4_timecop.kernel.run_timecop.write_json')
+    m_perform_reverts = mocker.patch(
+        'p4_timecop.kernel.run_timecop.perform_reverts',
+        return_value=(
+            {
+                '/a/file/path/to/be/unlocked': [
+                    Checkout('binary+l', "client", 'rmaffesoli', existing_date)
+                ]
+            },
+            {}
+        )
+    )
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=existing_date + 0.5)
+    m_write_log = mocker.patch('p4_timecop.kernel.logger.write_log')
+    m_write_json = mocker.patch('p4_timecop.kernel.state.write_json')
+    m_os_replace = mocker.patch('p4_timecop.kernel.state.os.replace')
 
-    log_calls = [
-        mocker.call(['Tue Feb 20 19:18:25 2024: /a/file/path/to/be/unlocked has been force reverted from rmaffesoli@client.\n'], 'a/log/path/log.txt'),
-        mocker.call(['Tue Feb 20 19:18:25 2024: Auto Unlock Completed.\n'], 'a/log/path/log.txt')
+    log_lines = [
+        'Tue Feb 20 19:18:25 2024: /a/file/path/to/be/unlocked has been force reverted from rmaffesoli@client.\n',
+        'Tue Feb 20 19:18:25 2024: Auto Unlock Completed.\n'
     ]
 
     main()
 
 
     m_ArgumentParser_parse.assert_called_once()
-    m_os_chdir.assert_called_once()
-    m_load_server_config.assert_called_once_with('a/config/path.json')
-    m_calc_limit.assert_called_once_with('1:00:00:00')
-    m_read_json.assert_called_once_with('a/data/path.json')
+    m_os_chdir.assert_not_called()
+    m_load_server_config.assert_called_once_with(os.path.join(SCRIPT_DIR, 'a/config/path.json'))
+    m_calc_limit.assert_called_once_with('1:00:00:00', existing_date)
+    m_read_json.assert_any_call('/a/data/path.json')
     m_setup_server_connection.assert_called_once_with(port='ssl:helix:1666', user='rmaffesoli', password=None, charset='none')
+    assert m_get_open_files_dict.call_args[0][0].connection.connection is m_setup_server_connection.return_value
     m_get_open_files_dict.assert_called_once_with(
-        m_setup_server_connection.return_value, 
+        mocker.ANY, 
         {
-            '//an/existing/file/path.txt': [{
-                'type': 'binary+l', 
-                'client': 'client', 
-                'user': 'rmaffesoli', 
-                'timestamp': 'Tue Feb 20 19:18:25 2024', 
-            }],
-            '/a/file/path/to/be/unlocked': [{
-                'type': 'binary+l', 
-                'client': 'client', 
-                'user': 'rmaffesoli', 
-                'timestamp': 'Tue Feb 20 19:18:25 2024'
-            }]
+            '//an/existing/file/path.txt': [Checkout('binary+l', 'client', 'rmaffesoli', existing_date)],
+            '/a/file/path/to/be/unlocked': [Checkout('binary+l', 'client', 'rmaffesoli', existing_date)]
         },
+        stream=False,
+        paths=None,
+        exclusive_only=False,
+        now=existing_date
     )
     
     m_check_open_files.assert_called_once_with(
         m_get_open_files_dict.return_value, 
         existing_date,
-        set()
+        set(),
+        mocker.ANY,
+        counts=mocker.ANY,
+        policies=None,
+        expiring=None,
+        warn_window=14400
     )
+    assert m_check_open_files.call_args[0][3].matches(Checkout('binary+l', 'client', 'rmaffesoli', existing_date))
+    assert not m_check_open_files.call_args[0][3].matches(Checkout('binary', 'client', 'rmaffesoli', existing_date))
 
+    assert m_perform_reverts.call_args[0][0].connection.connection is m_setup_server_connection.return_value
     m_perform_reverts.assert_called_once_with(
-        m_setup_server_connection.return_value,
+        mocker.ANY,
         {
             '/a/file/path/to/be/unlocked': [
-                {
-                    'type': 'binary+l', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': existing_date
-                }
+                Checkout('binary+l', 'client', 'rmaffesoli', existing_date)
             ]
-        }
+        },
+        chunk_size=100,
+        ops_per_second=None,
+        time_budget=None
     )
 
-    m_write_log.assert_has_calls(log_calls)
+    assert m_write_log.call_args_list == [
+        mocker.call(log_lines[:1], '/a/log/path/log.txt'),
+        mocker.call(log_lines[1:], '/a/log/path/log.txt'),
+    ]
 
-    m_write_json.assert_called_once_with(
+    m_write_json.assert_any_call(
         {
             '//an/existing/file/path.txt': [
-                {
-                    'type': 'binary+l', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': existing_date
-                }, 
+                Checkout('binary+l', 'client', 'rmaffesoli', existing_date), 
             ],
             '//a/newly/openedfile/path.txt': [
-                {
-                    'type': 'binary+l', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': existing_date
-                }
+                Checkout('binary+l', 'client', 'rmaffesoli', existing_date)
             ],
             '/a/file/path/to/be/ignored': [
-                {
-                    'type': 'binary', 
-                    'client': 'client', 
-                    'user': 'rmaffesoli', 
-                    'timestamp': existing_date
-                },
+                Checkout('binary', 'client', 'rmaffesoli', existing_date),
             ]
         }, 
-        'a/data/path.json'
-    )
\ No newline at end of file
+        '/a/data/path.json.tmp'
+    )
+    assert m_os_replace.call_args_list == [
+        mocker.call('/a/data/path.json.tmp', '/a/data/path.json'),
+        mocker.call('/a/data/path.json.meta.tmp', '/a/data/path.json.meta'),
+    ]
+    meta_writes = [call for call in m_write_json.call_args_list if call[0][1] == '/a/data/path.json.meta.tmp']
+    assert len(meta_writes) == 1
+    assert meta_writes[0][0][0]['version'] == 2
+    assert 'history' in meta_writes[0][0][0]
+    m_read_json.assert_any_call('/a/data/path.json.meta')
+
+@pytest.mark.parametrize(
+    "config,expected_code",
+    [
+        ({'servers': {'commit': {'server': {'port': 'ssl:helix:1666', 'user': 'timecop'}}}}, 0),
+        ({'servers': {'commit': {'server': {'port': 'ssl:helix:1666'}, 'revert_chunk_size': 0}}}, 1),
+    ],
+)
+def test_main_check_config(mocker, capsys, config, expected_code):
+    given_args = Namespace(config='/etc/timecop.json', data=None, log=None, plan=None, snapshot=None, record_snapshot=None, replay=None, check_config=True)
+    mocker.patch('p4_timecop.kernel.run_timecop.ArgumentParser', return_value=MockArgumentParser(given_args))
+    mocker.patch('p4_timecop.kernel.run_timecop.load_server_config', return_value=config)
+    m_run_servers = mocker.patch('p4_timecop.kernel.run_timecop.run_servers')
+    m_setup_server_connection = mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection')
+
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+
+    assert exit_info.value.code == expected_code
+    m_run_servers.assert_not_called()
+    m_setup_server_connection.assert_not_called()
+    output = capsys.readouterr().out
+    if expected_code:
+        assert 'Config error: servers.commit.server.user: missing' in output
+        assert 'Config error: servers.commit.revert_chunk_size: expected a whole number of at least 1, got 0' in output
+    else:
+        assert '/etc/timecop.json is valid, 1 servers configured.' in output
+
+
+def test_main_invalid_config(mocker):
+    given_args = Namespace(config='/etc/timecop.json', data=None, log=None, plan=None, snapshot=None, record_snapshot=None, replay=None, check_config=False)
+    mocker.patch('p4_timecop.kernel.run_timecop.ArgumentParser', return_value=MockArgumentParser(given_args))
+    mocker.patch('p4_timecop.kernel.run_timecop.load_server_config', return_value={'servers': {'commit': {'file_lock_time_limit': '1 day'}}})
+    m_run_servers = mocker.patch('p4_timecop.kernel.run_timecop.run_servers')
+
+    with pytest.raises(SystemExit):
+        main()
+
+    m_run_servers.assert_not_called()
+
+
+CONNECTION = {'port': 'ssl:helix:1666', 'user': 'timecop'}
+
+
+def test_main_several_servers(mocker):
+    given_args = Namespace(config='/etc/timecop.json', data=None, log=None, plan=None, snapshot=None, record_snapshot=None, replay=None, check_config=False, workers=None, daemon=False)
+    mocker.patch('p4_timecop.kernel.run_timecop.ArgumentParser', return_value=MockArgumentParser(given_args))
+    mocker.patch(
+        'p4_timecop.kernel.run_timecop.load_server_config',
+        return_value={'max_workers': 2, 'servers': {'commit': {'server': CONNECTION}, 'edge': {'server': CONNECTION}}}
+    )
+    m_run_servers = mocker.patch('p4_timecop.kernel.run_timecop.run_servers')
+
+    main()
+
+    servers = m_run_servers.call_args[0][0]
+    assert servers['commit']['data_filepath'] == os.path.join(SCRIPT_DIR, '../data_commit.json')
+    assert servers['commit']['log_filepath'] == os.path.join(SCRIPT_DIR, '../log_commit.txt')
+    assert servers['edge']['data_filepath'] == os.path.join(SCRIPT_DIR, '../data_edge.json')
+
+
+def test_process_server_save_failure_keeps_revert_log(mocker, tmp_path):
+    now = 1708456705
+    mocker.patch('p4_timecop.kernel.run_timecop.time.time', return_value=now)
+    server = MockP4()
+    server.run_return_value = [
+        {'depotFile': '//art/chair.fbx', 'type': 'binary+l', 'client': 'ws_a', 'user': 'painter'},
+    ]
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    checkout = Checkout('binary+l', 'ws_a', 'painter', now - 2 * 86400)
+    mocker.patch('p4_timecop.kernel.run_timecop.perform_reverts', return_value=({'//art/chair.fbx': [checkout]}, {}))
+    mocker.patch('p4_timecop.kernel.state.os.replace', side_effect=FileNotFoundError('data.json.tmp'))
+
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps({'//art/chair.fbx': [checkout.to_dict()]}))
+    log_path = tmp_path / 'log.txt'
+    given_args = args_tuple("a/config/path.json", None, str(data_path), str(log_path), None, False, None, False, None, None, None, None)
+
+    with pytest.raises(FileNotFoundError):
+        process_server('commit', {'server': {}}, given_args)
+
+    log_text = log_path.read_text()
+    assert '//art/chair.fbx has been force reverted from painter@ws_a.' in log_text
+    assert 'Auto Unlock Completed.' not in log_text
+
+
+def test_process_server_data_arg_placeholder(mocker, tmp_path):
+    server = MockP4()
+    server.run_return_value = []
+    mocker.patch('p4_timecop.kernel.run_timecop.setup_server_connection', return_value=server)
+    given_args = args_tuple("a/config/path.json", None, str(tmp_path / '{server}.json'), str(tmp_path / '{server}.txt'), None, False, None, False, None, None, None, None)
+
+    process_server('edge', {'server': {}}, given_args)
+
+    assert read_json(str(tmp_path / 'edge.json')) == {}
+    assert (tmp_path / 'edge.txt').exists()
+
+
+@pytest.mark.parametrize(
+    "arg_name,flag",
+    [
+        ('data', '--data'),
+        ('plan', '--plan'),
+        ('record_snapshot', '--record-snapshot'),
+    ],
+)
+def test_main_several_servers_shared_path_arg(mocker, capsys, arg_name, flag):
+    arg_values = dict(data=None, log=None, plan=None, snapshot=None, record_snapshot=None, replay=None)
+    arg_values[arg_name] = '/var/lib/timecop/shared'
+    given_args = Namespace(config='/etc/timecop.json', check_config=False, **arg_values)
+    mocker.patch('p4_timecop.kernel.run_timecop.ArgumentParser', return_value=MockArgumentParser(given_args))
+    mocker.patch(
+        'p4_timecop.kernel.run_timecop.load_server_config',
+        return_value={'servers': {'commit': {'server': CONNECTION}, 'edge': {'server': CONNECTION}}}
+    )
+    m_run_servers = mocker.patch('p4_timecop.kernel.run_timecop.run_servers')
+
+    with pytest.raises(SystemExit):
+        main()
+
+    m_run_servers.assert_not_called()
+    assert 'Config error: {}: needs a {{server}} placeholder when several servers are configured'.format(flag) in capsys.readouterr().out
+
+
+def test_main_several_servers_replay_plan(mocker):
+    given_args = Namespace(
+        config='/etc/timecop.json', data=None, log=None, plan='/var/lib/timecop/replay.json', snapshot=None,
+        record_snapshot=None, replay=['/var/lib/timecop/snapshot.jsonl.gz'], check_config=False, workers=None
+    )
+    mocker.patch('p4_timecop.kernel.run_timecop.ArgumentParser', return_value=MockArgumentParser(given_args))
+    mocker.patch(
+        'p4_timecop.kernel.run_timecop.load_server_config',
+        return_value={'servers': {'commit': {'server': CONNECTION}, 'edge': {'server': CONNECTION}}}
+    )
+    m_replay_snapshots = mocker.patch('p4_timecop.kernel.run_timecop.replay_snapshots')
+
+    main()
+
+    m_replay_snapshots.assert_called_once()